@@ -9,8 +9,25 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
-application = get_asgi_application()
+# Django 3.2's ASGI handler iterates streamed responses (.../export/,
+# ?stream=1) in the event loop, where their queries fail. Django runs as
+# the WSGI application instead, responses included in its sync thread
+# (which, like the ASGI handler's, serves one request at a time, so the
+# API is best served by the WSGI server, see README).
+django_application = WsgiToAsgi(get_wsgi_application())
+
+# imported after Django is set up
+from recipe import sse  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """The event stream of recipe changes is served without Django's
+       request handling (see recipe/sse.py), everything else by Django"""
+    if scope['type'] == 'http' and scope['path'] == sse.PATH:
+        return await sse.events_application(scope, receive, send)
+    return await django_application(scope, receive, send)
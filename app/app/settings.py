@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -47,6 +49,11 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # compression must come before any middleware that reads or writes the
+    # response body, so it compresses their final result. ConditionalGet
+    # gives ETags to responses (from their uncompressed content)
+    'mainapp.middleware.CompressionMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -88,7 +95,45 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASS'),
     }
 }
+
+# Shards of the recipes of users (mainapp/sharding.py): DB_SHARDS=a:1,b:2
+# adds the databases a and b (on the same server) next to the default one,
+# with the shard ids 1 and 2 (the default one is 0). A shard keeps its id
+# for good, whatever the order of DB_SHARDS.
+# New users are placed on one of DB_SHARDS_FOR_NEW_USERS.
+DB_SHARD_IDS = {'default': 0}
+for shard in filter(None, os.environ.get('DB_SHARDS', '').split(',')):
+    alias, _, shard_id = shard.partition(':')
+    if not shard_id.isdigit():
+        raise ImproperlyConfigured(
+            f'DB_SHARDS: {shard!r} has no shard id (ie. {alias}:1)'
+        )
+    DATABASES[alias] = dict(DATABASES['default'], NAME=alias)
+    DB_SHARD_IDS[alias] = int(shard_id)
+DATABASE_ROUTERS = ['mainapp.sharding.ShardRouter']
+DB_SHARDS_FOR_NEW_USERS = os.environ.get(
+    'DB_SHARDS_FOR_NEW_USERS', 'default'
+).split(',')
+# the shard with id i numbers recipes, tags and ingredients i + 1,
+# i + 1 + stride, ... (so shard ids are below DB_SHARD_ID_STRIDE)
+DB_SHARD_ID_STRIDE = 64
  
+# Caches. 'default' is kept by each process (ie. compressed responses),
+# 'shared' is seen by every process, so it's used for everything another
+# process must not miss (ie. versions of cached recipe details). It's a
+# table of the default database (python manage.py createcachetable), any
+# other shared backend (ie. Memcached) can be used instead.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'recipe_app_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -140,3 +185,121 @@ STATIC_ROOT = '/vol/web/static'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'mainapp.CustomUser'
+
+# Number of recipes fetched from a server-side cursor and rendered at once
+# by streaming responses (ie. .../recipes/?stream=1)
+RECIPE_STREAM_CHUNK_SIZE = 1000
+
+# Number of lines validated and written at once by bulk recipe imports, and
+# the number of line errors returned in the summary of an import
+RECIPE_IMPORT_BATCH_SIZE = 500
+RECIPE_IMPORT_MAX_ERRORS = 1000
+
+# Response compression (mainapp.middleware.CompressionMiddleware). Smaller
+# responses are not compressed, compressed bodies of responses that have an
+# ETag are kept in the given cache for COMPRESSION_CACHE_TIMEOUT seconds
+COMPRESSION_MIN_SIZE = 200
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_CACHE_ALIAS = 'default'
+COMPRESSION_CACHE_TIMEOUT = 60 * 60
+
+# Default histogram bucket edges of .../recipes/stats/, recipes below the
+# first and above the last edge have their own (open ended) buckets
+RECIPE_STATS_PRICE_BUCKETS = [5, 10, 20, 50]
+RECIPE_STATS_TIME_BUCKETS = [15, 30, 60, 120]
+
+# Number of candidates (recipes sharing the most LSH buckets) that are
+# scored exactly by .../recipes/<id>/similar/
+RECIPE_SIMILAR_CANDIDATES = 100
+
+# Number of users whose pantry index ("what can I cook") is kept in memory
+# by each process (changes are counted in Postgres, so other processes
+# know their copy is outdated)
+PANTRY_INDEX_CACHE_SIZE = 128
+
+# Token bucket throttling (mainapp/throttling.py) per IP address (anon),
+# user, authentication token and endpoint class (throttle_scope of views).
+# Buckets are shared by all workers through a memory mapped file.
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': [
+        'mainapp.throttling.AnonRateThrottle',
+        'mainapp.throttling.UserRateThrottle',
+        'mainapp.throttling.TokenRateThrottle',
+        'mainapp.throttling.EndpointRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '600/min',
+        'user': '1200/min',
+        'token': '1200/min',
+        'recipes': '600/min',
+        'uploads': '30/min',
+    },
+}
+THROTTLE_STORE_PATH = os.environ.get(
+    'THROTTLE_STORE_PATH', '/tmp/recipe-app-throttle.bin'
+)
+THROTTLE_STORE_SLOTS = 1 << 16
+# tests use a temporary throttle file instead (mainapp/testing.py)
+TEST_RUNNER = 'mainapp.testing.TestRunner'
+
+# Lists (and admin changelists) with more rows than this, according to the
+# statistics of Postgres, report an estimated count instead of COUNT(*)
+COUNT_ESTIMATE_THRESHOLD = 100000
+
+# POST requests sent with an Idempotency-Key header (mainapp/idempotency.py):
+# responses are kept for IDEMPOTENCY_KEY_TTL seconds, a retry waits up to
+# IDEMPOTENCY_WAIT_TIMEOUT seconds for the first request to finish, which
+# is considered dead after IDEMPOTENCY_LOCK_TIMEOUT seconds
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_LOCK_TIMEOUT = 5 * 60
+
+# Jobs run by python manage.py run_workers (mainapp/jobs.py): the number of
+# jobs of a queue running at once over all workers, seconds between checks
+# for new jobs, retry backoff (doubled after every attempt, up to the max),
+# how often running jobs refresh their lock, and the time after which a
+# running job whose lock wasn't refreshed is considered lost
+JOB_QUEUE_CONCURRENCY = {
+    'deletes': 1,
+}
+JOB_POLL_INTERVAL = 1
+JOB_RETRY_BACKOFF = 10
+JOB_RETRY_MAX_BACKOFF = 60 * 60
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_LOCK_TIMEOUT = 5 * 60
+
+# Cache of recipe details (recipe/caching.py): the cache used, how long a
+# detail is kept, and how long concurrent requests for a detail that is
+# being rendered wait for it (the lock expires after the lock timeout)
+RECIPE_CACHE_ALIAS = 'shared'  # not a cache of each process (recipe/checks.py)
+RECIPE_CACHE_TIMEOUT = 60 * 60
+RECIPE_CACHE_LOCK_TIMEOUT = 10
+RECIPE_CACHE_LOCK_WAIT = 2
+
+# Delta sync of offline clients (.../api/recipe/sync/). Every sync resends
+# the changes of the last RECIPE_SYNC_OVERLAP seconds, so rows written by
+# transactions still running during the previous sync are not missed.
+# Tombstones of deleted rows are kept for RECIPE_SYNC_TOMBSTONE_TTL seconds,
+# clients with older cursors have to sync everything again.
+RECIPE_SYNC_OVERLAP = 60
+RECIPE_SYNC_TOMBSTONE_TTL = 30 * 24 * 60 * 60
+
+# Event stream of recipe changes (.../api/recipe/events/, served by
+# app/asgi.py only): the Postgres channel the events are sent on, seconds
+# between keep-alive comments, and how many events are buffered per client
+# before it's asked to sync instead
+RECIPE_EVENTS_CHANNEL = 'recipe_events'
+RECIPE_EVENTS_HEARTBEAT = 15
+RECIPE_EVENTS_QUEUE_SIZE = 100
+
+# Modules only imported when they're used, not while a worker starts
+# (checked by: python manage.py profile_startup --check)
+STARTUP_DEFERRED_MODULES = ('PIL',)
+
+# Moving a user to another shard (python manage.py move_user_shard): the
+# changes made meanwhile are copied again, at most SHARD_MOVE_MAX_PASSES
+# times, then changes are rejected for SHARD_MOVE_GRACE seconds (longer
+# than a request takes) to copy the last ones
+SHARD_MOVE_MAX_PASSES = 5
+SHARD_MOVE_GRACE = 30
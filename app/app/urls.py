@@ -19,7 +19,12 @@ from django.urls import path, include  # include helps define urls as a string
 from django.conf.urls.static import static
 from django.conf import settings
 
+from mainapp.admin import shard_sites
+
 urlpatterns = [
+    # the rows of other shards, see mainapp/admin.py
+    *(path(f'admin/{alias}/', site.urls)
+      for alias, site in shard_sites.items()),
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
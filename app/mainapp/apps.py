@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class MainappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mainapp'
+
+    def ready(self):
+        # connects the signal receivers (ie. recipe counters of tags)
+        from mainapp import signals  # noqa: F401
+        from mainapp import checks  # noqa: F401
+        from mainapp import sharding
+        # ids of recipes, tags and ingredients are unique over all shards
+        post_migrate.connect(sharding.set_id_sequences, sender=self)
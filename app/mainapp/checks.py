@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core import checks
+
+
+# Rows of a shard get ids with the remainder of its shard id (see
+# set_id_sequences in mainapp/sharding.py), two shards with the same
+# remainder would number their rows alike.
+@checks.register()
+def check_shard_ids(app_configs, **kwargs):
+    """Check every shard has its own id, below DB_SHARD_ID_STRIDE"""
+    stride = settings.DB_SHARD_ID_STRIDE
+    errors = []
+    seen = {}
+    for alias, shard_id in settings.DB_SHARD_IDS.items():
+        if not 0 <= shard_id < stride:
+            errors.append(checks.Error(
+                f'The shard id of {alias!r} ({shard_id}) isn\'t below '
+                f'DB_SHARD_ID_STRIDE ({stride}).',
+                id='mainapp.E001',
+            ))
+        elif shard_id in seen:
+            errors.append(checks.Error(
+                f'{alias!r} has the shard id of {seen[shard_id]!r} '
+                f'({shard_id}).',
+                hint='Give each shard its own id in DB_SHARDS, ie. '
+                     'DB_SHARDS=shard1:1,shard2:2.',
+                id='mainapp.E002',
+            ))
+        seen.setdefault(shard_id, alias)
+    return errors
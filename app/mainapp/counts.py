@@ -0,0 +1,59 @@
+import json
+
+from django.conf import settings
+from django.db import connections
+
+
+# COUNT(*) has to read every matching row, which is a sequential scan on
+# large tables. Postgres already knows roughly how many rows there are:
+# pg_class.reltuples for a whole table (updated by VACUUM/ANALYZE), and the
+# planner estimate of EXPLAIN for a filtered query. Those estimates are used
+# above COUNT_ESTIMATE_THRESHOLD rows, smaller results are counted exactly.
+
+COUNT_HEADER = 'X-Total-Count'
+EXACT_HEADER = 'X-Total-Count-Exact'
+
+
+def table_estimate(model, using='default'):
+    """Return the number of rows of the table of model according to the
+       statistics, or None if the table was never analyzed"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    # -1 (or 0 before Postgres 14) means the table was never analyzed
+    return int(row[0]) if row and row[0] > 0 else None
+
+
+def plan_estimate(queryset):
+    """Return the number of rows of a queryset estimated by the planner"""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):  # depends on the version of psycopg2
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(queryset, threshold=None):
+    """Return (count, exact) of a queryset, where exact tells whether the
+       count is exact or an estimate of Postgres"""
+    if threshold is None:
+        threshold = settings.COUNT_ESTIMATE_THRESHOLD
+    if not queryset.query.where:
+        estimate = table_estimate(queryset.model, queryset.db)
+    else:
+        estimate = plan_estimate(queryset)
+    if estimate is not None and estimate >= threshold:
+        return estimate, False
+    return queryset.count(), True
+
+
+def set_count_headers(response, count, exact):
+    """Add the (exact or estimated) number of items to a list response"""
+    response[COUNT_HEADER] = str(count)
+    response[EXACT_HEADER] = 'true' if exact else 'false'
+    return response
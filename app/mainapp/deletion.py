@@ -0,0 +1,173 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from mainapp import jobs, sharding
+from mainapp.models import CustomUser, Tag, Ingredient, Recipe, Tombstone
+from mainapp.signals import COUNTED_RELATIONS, bump_recipe_counts, \
+    no_tombstones
+
+
+# Deleting a user (or many recipes) at once cascades through tags,
+# ingredients, recipes and both through tables in one long transaction.
+# Instead, rows are marked as deleted (deleted_at) in the request, which
+# hides them right away, and the reaper deletes them later in chunks of
+# bounded size, each in its own short transaction. Every soft delete
+# queues a reap job, run by the workers (python manage.py run_workers).
+
+# sent after recipes were marked as deleted, with recipes=[(id, user_id)]
+recipes_soft_deleted = Signal()
+
+
+def soft_delete_recipes(queryset):
+    """Mark the recipes of queryset as deleted, return their number.
+       Tag/ingredient recipe counts stop counting them immediately."""
+    # everything happens on the shard of the recipes
+    with sharding.use_shard(queryset.db), \
+            transaction.atomic(using=queryset.db):
+        recipes = list(queryset.filter(deleted_at__isnull=True).order_by(
+            'pk'
+        ).select_for_update().values_list('pk', 'user_id'))
+        if not recipes:
+            return 0
+        recipe_ids = [pk for pk, _ in recipes]
+        now = timezone.now()
+        Recipe.objects.filter(pk__in=recipe_ids).update(deleted_at=now)
+        # clients syncing changes learn about the deletion right away
+        Tombstone.objects.bulk_create(
+            Tombstone(user_id=user_id, model='recipe', object_id=pk,
+                      deleted_at=now)
+            for pk, user_id in recipes
+        )
+        for through, (model, column) in COUNTED_RELATIONS.items():
+            related_ids = through.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values_list(column, flat=True)
+            bump_recipe_counts(model, {
+                pk: -count for pk, count in Counter(related_ids).items()
+            })
+        recipes_soft_deleted.send(sender=Recipe, recipes=recipes)
+        # jobs live in the default database, a job queued right away would
+        # be kept even if the shard rolled back, and could run before the
+        # shard commits (missing the recipes)
+        transaction.on_commit(queue_reap, using=queryset.db)
+    return len(recipes)
+
+
+def queue_reap():
+    """Queue a reap job (if none is queued yet)"""
+    jobs.enqueue(reap, unique=True)
+
+
+def soft_delete_user(user):
+    """Mark a user as deleted, the user can't log in anymore"""
+    with transaction.atomic():
+        user.deleted_at = timezone.now()
+        user.is_active = False
+        user.save(update_fields=['deleted_at', 'is_active'])
+        Token.objects.filter(user=user).delete()
+        jobs.enqueue(reap, unique=True)
+
+
+class Reaper:
+    """Delete rows marked as deleted, batch_size rows per transaction.
+       progress (if given) is called after every batch with the numbers
+       of rows deleted so far."""
+
+    def __init__(self, batch_size=500, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.deleted = Counter()
+
+    def run(self):
+        """Delete deleted recipes, then deleted users with all their data
+           and expired tombstones (of every shard), return the numbers of
+           deleted rows per model"""
+        for alias in sharding.shards():
+            with sharding.use_shard(alias):
+                self.reap_recipes(
+                    Recipe.objects.filter(deleted_at__isnull=False)
+                )
+        for user in CustomUser.objects.filter(deleted_at__isnull=False):
+            with sharding.use_shard(user.shard):
+                self.reap_user(user)
+        for alias in sharding.shards():
+            with sharding.use_shard(alias):
+                self.reap_tombstones()
+        return dict(self.deleted)
+
+    def _report(self, name, count):
+        self.deleted[name] += count
+        if self.progress:
+            self.progress(dict(self.deleted))
+
+    def _batches(self, queryset, *fields):
+        """Yield lists of rows of queryset (pk first), batch by batch, the
+           next batch is read after the previous one was deleted"""
+        while True:
+            rows = list(queryset.order_by('pk').values_list(
+                'pk', *fields
+            )[:self.batch_size])
+            if not rows:
+                return
+            yield rows
+
+    def reap_recipes(self, queryset):
+        """Delete recipes with their relations and image files"""
+        for rows in self._batches(queryset, 'image'):
+            recipe_ids = [pk for pk, _ in rows]
+            with transaction.atomic(using=sharding.current()):
+                # recipes of deleted users are marked too, so signal
+                # receivers know they are reaped (see mainapp/signals.py)
+                Recipe.objects.filter(
+                    pk__in=recipe_ids, deleted_at__isnull=True
+                ).update(deleted_at=timezone.now())
+                Recipe.objects.filter(pk__in=recipe_ids).delete()
+            # files are deleted once the rows are gone for good
+            storage = Recipe._meta.get_field('image').storage
+            for _, image in rows:
+                if image:
+                    storage.delete(image)
+            self._report('recipes', len(rows))
+
+    def reap_user(self, user):
+        """Delete a deleted user and everything the user owns"""
+        self.reap_recipes(Recipe.objects.filter(user=user))
+        for model, name in ((Tag, 'tags'), (Ingredient, 'ingredients')):
+            for rows in self._batches(model.objects.filter(user=user)):
+                # tombstones of the user would only be deleted with it
+                with transaction.atomic(using=sharding.current()), \
+                        no_tombstones():
+                    model.objects.filter(
+                        pk__in=[pk for pk, in rows]
+                    ).delete()
+                self._report(name, len(rows))
+        user_id = user.pk
+        user.delete()
+        if user.shard != sharding.DEFAULT_DB_ALIAS:
+            # the placeholder of the user on its shard
+            CustomUser.objects.using(user.shard).filter(pk=user_id).delete()
+        self._report('users', 1)
+
+    def reap_tombstones(self):
+        """Delete tombstones older than RECIPE_SYNC_TOMBSTONE_TTL seconds,
+           clients with older sync cursors have to sync everything again"""
+        expired = Tombstone.objects.filter(deleted_at__lt=(
+            timezone.now()
+            - timedelta(seconds=settings.RECIPE_SYNC_TOMBSTONE_TTL)
+        ))
+        for rows in self._batches(expired):
+            Tombstone.objects.filter(pk__in=[pk for pk, in rows]).delete()
+            self._report('tombstones', len(rows))
+
+
+@jobs.task(queue='deletes')
+def reap(batch_size=500):
+    """Job deleting the rows marked as deleted"""
+    Reaper(batch_size).run()
@@ -0,0 +1,156 @@
+import functools
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http.request import RawPostDataException
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from mainapp.models import IdempotencyKey
+
+
+# Clients retry POST requests that timed out, without knowing whether the
+# first one was done. A request sent with an Idempotency-Key header claims
+# a row of (user, key) before running; the response is stored in the row
+# and a retry with the same key gets it back without running the view
+# again. A retry arriving while the first request still runs waits for it
+# (polling the row) instead of running twice, and gets 409 if it takes
+# longer than IDEMPOTENCY_WAIT_TIMEOUT seconds.
+# Only returned responses below 500 are stored: if the view raised an
+# exception or failed, the row is deleted so the request can be retried.
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05  # seconds between checks of a running request
+
+
+def request_fingerprint(request, body=True):
+    """Return a hash of the method, path (with query string) and body"""
+    digest = hashlib.sha256(
+        f'{request.method} {request.get_full_path()}\n'.encode()
+    )
+    if body and request.content_type.startswith('multipart/'):
+        # the parsed fields and the content of every uploaded file, read in
+        # chunks: .body would load the whole upload into memory (and fail
+        # above DATA_UPLOAD_MAX_MEMORY_SIZE), and the boundary of the parts
+        # changes with every request anyway
+        for name, values in sorted(request.POST.lists()):
+            for value in values:
+                digest.update(f'{name}={value}\n'.encode())
+        for name, files in sorted(request.FILES.lists()):
+            for upload in files:
+                digest.update(f'{name}={upload.name}:{upload.size}\n'.encode())
+                for chunk in upload.chunks():
+                    digest.update(chunk)
+                upload.seek(0)
+    elif body:
+        try:
+            digest.update(request._request.body)
+        except RawPostDataException:  # the body was already parsed
+            pass
+    return digest.hexdigest()
+
+
+def _stale():
+    """Return a filter of stored responses older than IDEMPOTENCY_KEY_TTL
+       seconds and of requests running for longer than
+       IDEMPOTENCY_LOCK_TIMEOUT seconds (ie. their worker was killed)"""
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    abandoned = now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+    return Q(created_at__lt=expired) \
+        | Q(status_code__isnull=True, created_at__lt=abandoned)
+
+
+def clear_expired():
+    """Delete stale rows of every user, return their number"""
+    return IdempotencyKey.objects.filter(_stale()).delete()[0]
+
+
+def _claim(user, key, fingerprint):
+    """Create the row of a key, return (row, True) if this request created
+       it or (row of another request or None, False)"""
+    IdempotencyKey.objects.filter(_stale(), user=user, key=key).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=fingerprint
+            ), True
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user=user, key=key).first(), \
+            False
+
+
+def _wait(record):
+    """Poll the row of a running request until it has a response, return
+       the row (None if the request failed and its row was deleted)"""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    while record is not None and record.status_code is None:
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+
+def idempotent(body=True):
+    """Decorator of view handlers honoring the Idempotency-Key header.
+       body=False leaves the body out of the fingerprint of the request,
+       for views that read it as a stream (ie. imports)"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return handler(view, request, *args, **kwargs)
+            if not 0 < len(key) <= MAX_KEY_LENGTH:
+                return Response(
+                    {HEADER: [f'Expected 1 to {MAX_KEY_LENGTH} characters.']},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            fingerprint = request_fingerprint(request, body)
+            while True:
+                record, created = _claim(request.user, key, fingerprint)
+                if created:
+                    break
+                if record is not None and record.fingerprint != fingerprint:
+                    return Response(
+                        {HEADER: ['The key was used for another request.']},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                record = _wait(record)
+                if record is None:  # the first request failed, run again
+                    continue
+                if record.status_code is None:
+                    return Response(
+                        {HEADER: ['A request with the key is in progress.']},
+                        status=status.HTTP_409_CONFLICT,
+                        headers={'Retry-After': '1'}
+                    )
+                return Response(
+                    record.response, status=record.status_code,
+                    headers={REPLAYED_HEADER: 'true'}
+                )
+
+            try:
+                response = handler(view, request, *args, **kwargs)
+            except BaseException:
+                record.delete()
+                raise
+            if response.status_code >= 500:
+                record.delete()
+            else:
+                record.status_code = response.status_code
+                record.response = response.data
+                record.save(update_fields=['status_code', 'response'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,274 @@
+import json
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from mainapp.models import Job
+
+
+# Slow work (ie. reaping deleted users) is written as a Job row, in the
+# same transaction as the request that needs it, and run later by workers
+# (python manage.py run_workers). Workers take the queued job with the
+# highest priority with SELECT ... FOR UPDATE SKIP LOCKED, so workers never
+# wait for each other or take the same job. A failed job is retried after
+# JOB_RETRY_BACKOFF * 2^(attempts - 1) seconds until it runs out of
+# attempts. JOB_QUEUE_CONCURRENCY limits the number of jobs of a queue that
+# run at once over all workers: claims of limited queues are serialized
+# with a Postgres advisory lock per queue, then the running jobs counted.
+# While a job runs, its worker refreshes locked_at every
+# JOB_HEARTBEAT_INTERVAL seconds; jobs whose locked_at is older than
+# JOB_LOCK_TIMEOUT belong to a dead worker and are queued again.
+# Finished jobs are deleted, failed ones are kept with their error.
+
+
+def task(queue='default', priority=0, max_attempts=5):
+    """Decorator marking a module level function as a task, so it can be
+       enqueued with enqueue(function, **kwargs)"""
+    def decorator(func):
+        func.job_options = {
+            'queue': queue,
+            'priority': priority,
+            'max_attempts': max_attempts,
+        }
+        return func
+    return decorator
+
+
+def task_name(func):
+    """Return the import path a worker finds a task with"""
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, priority=None, delay=0, unique=False, **kwargs):
+    """Create a job calling func(**kwargs) and return it. unique=True
+       returns the queued job with the same arguments instead, if any.
+       Inside a transaction, workers see the job once it's committed."""
+    options = getattr(func, 'job_options', None)
+    if options is None:
+        raise ValueError(f'{func!r} is not a task')
+    name = task_name(func)
+    if not unique:
+        return _create(options, name, priority, delay, kwargs)
+    # concurrent enqueues of the same job wait for each other (until the
+    # end of the transaction), so only the first one creates it
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(hashtext(%s))',
+                [f'job-unique:{name}:' + json.dumps(
+                    kwargs, sort_keys=True, cls=DjangoJSONEncoder
+                )]
+            )
+        job = Job.objects.filter(
+            name=name, kwargs=kwargs, status=Job.QUEUED
+        ).first()
+        if job is None:
+            job = _create(options, name, priority, delay, kwargs)
+    return job
+
+
+def _create(options, name, priority, delay, kwargs):
+    return Job.objects.create(
+        queue=options['queue'],
+        name=name,
+        kwargs=kwargs,
+        priority=options['priority'] if priority is None else priority,
+        max_attempts=options['max_attempts'],
+        run_at=timezone.now() + timedelta(seconds=delay)
+    )
+
+
+def _full_queues(queues):
+    """Lock the limited queues (until the end of the transaction), return
+       the ones already running as many jobs as they may"""
+    limits = settings.JOB_QUEUE_CONCURRENCY
+    limited = sorted(
+        queue for queue in limits if queues is None or queue in queues
+    )
+    if not limited:
+        return []
+    with connection.cursor() as cursor:
+        for queue in limited:  # always in the same order, no deadlocks
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(hashtext(%s))',
+                [f'job-queue:{queue}']
+            )
+    running = dict(Job.objects.filter(
+        status=Job.RUNNING, queue__in=limited
+    ).values('queue').annotate(count=Count('id')).values_list(
+        'queue', 'count'
+    ))
+    return [queue for queue in limited
+            if running.get(queue, 0) >= limits[queue]]
+
+
+def claim(worker, queues=None):
+    """Mark the next job of the queues (all queues if None) as running
+       by worker and return it, or None if there is nothing to run"""
+    with transaction.atomic():
+        jobs = Job.objects.filter(
+            status=Job.QUEUED, run_at__lte=timezone.now()
+        ).exclude(queue__in=_full_queues(queues))
+        if queues is not None:
+            jobs = jobs.filter(queue__in=queues)
+        job = jobs.order_by(
+            '-priority', 'run_at', 'id'
+        ).select_for_update(skip_locked=True).first()
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.locked_at = timezone.now()
+        job.locked_by = worker
+        job.save(update_fields=[
+            'status', 'attempts', 'locked_at', 'locked_by'
+        ])
+    return job
+
+
+def _claimed(job):
+    """Return the row of a job as long as it's held by the claim job was
+       returned by (every claim is another attempt)"""
+    return Job.objects.filter(
+        pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by,
+        attempts=job.attempts
+    )
+
+
+class Heartbeat(threading.Thread):
+    """Thread refreshing locked_at of a running job every
+       JOB_HEARTBEAT_INTERVAL seconds, so it isn't taken as lost however
+       long it runs"""
+
+    def __init__(self, job):
+        super().__init__(daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.JOB_HEARTBEAT_INTERVAL):
+                _claimed(self.job).update(locked_at=timezone.now())
+        finally:
+            connection.close()  # the connection of this thread
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job):
+    """Run a claimed job, delete it when done or schedule its retry. If
+       the job was taken as lost meanwhile, its row is left alone."""
+    try:
+        func = import_string(job.name)
+        if not hasattr(func, 'job_options'):
+            raise ImportError(f'{job.name} is not a task')
+        with Heartbeat(job):
+            func(**job.kwargs)
+    except Exception:
+        fail_job(job, traceback.format_exc())
+        return False
+    _claimed(job).delete()
+    return True
+
+
+def fail_job(job, error, claimed=None):
+    """Queue a job again after a backoff, or mark it as failed when it
+       has no attempts left (only while the claim of job holds it, or
+       claimed, a filter of it)"""
+    claimed = _claimed(job) if claimed is None else claimed
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        backoff = min(
+            settings.JOB_RETRY_BACKOFF * 2 ** max(job.attempts - 1, 0),
+            settings.JOB_RETRY_MAX_BACKOFF
+        )
+        claimed.update(
+            status=Job.QUEUED, run_at=now + timedelta(seconds=backoff),
+            locked_at=None, locked_by='', last_error=error
+        )
+    else:
+        claimed.update(
+            status=Job.FAILED, finished_at=now, locked_at=None,
+            last_error=error
+        )
+
+
+def requeue_lost():
+    """Retry (or fail) jobs whose locked_at wasn't refreshed for
+       JOB_LOCK_TIMEOUT seconds, their worker is considered dead, return
+       their number"""
+    expired = timezone.now() - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    lost = Job.objects.filter(status=Job.RUNNING, locked_at__lt=expired)
+    count = 0
+    for job in lost:
+        # unless a heartbeat came meanwhile
+        fail_job(job, f'Lost by worker {job.locked_by}',
+                 _claimed(job).filter(locked_at__lt=expired))
+        count += 1
+    return count
+
+
+class Worker:
+    """Run jobs of the queues (all queues if None) with a pool of threads.
+       burst=True returns once there is no job to run instead of polling
+       every JOB_POLL_INTERVAL seconds. report (if given) is called with
+       (job, succeeded) after every job."""
+
+    def __init__(self, queues=None, threads=1, burst=False, report=None):
+        self.queues = queues
+        self.threads = threads
+        self.burst = burst
+        self.report = report
+        self.stopping = threading.Event()
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+
+    def run(self):
+        """Run until stop() is called (or nothing is left with burst).
+           A single thread runs in the calling thread."""
+        if self.threads == 1:
+            return self._loop(f'{self.name}:0')
+        threads = [
+            threading.Thread(target=self._loop, args=(f'{self.name}:{i}',))
+            for i in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        """Let the running jobs finish and stop"""
+        self.stopping.set()
+
+    def _loop(self, name):
+        try:
+            while not self.stopping.is_set():
+                job = claim(name, self.queues)
+                if job is None:
+                    requeue_lost()
+                    if self.burst:
+                        return
+                    self.stopping.wait(settings.JOB_POLL_INTERVAL)
+                    continue
+                succeeded = run_job(job)
+                if self.report:
+                    self.report(job, succeeded)
+        finally:
+            # every thread has its own database connection
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
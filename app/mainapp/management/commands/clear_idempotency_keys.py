@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.idempotency import clear_expired
+
+
+class Command(BaseCommand):
+    """Django command to delete expired responses of Idempotency-Key
+       requests (and requests that never finished)"""
+    help = 'Delete expired idempotency keys'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Deleted {clear_expired()} idempotency keys')
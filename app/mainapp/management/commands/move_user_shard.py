@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.sharding import UserMove
+
+
+class Command(BaseCommand):
+    """Django command to move the tags, ingredients and recipes of a user
+       to another shard while the user keeps using the API (see UserMove
+       in mainapp/sharding.py)"""
+    help = 'Move the recipes of a user to another database shard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user to move')
+        parser.add_argument('shard', help='Alias of the target database')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User {options["email"]} does not exist')
+
+        move = UserMove(
+            user, options['shard'], options['batch_size'], self._progress
+        )
+        source = user.shard
+        try:
+            copied = move.run()
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {user.email} from {source} to {options["shard"]} '
+            f'({self._summary(copied)} copied)'
+        ))
+
+    def _summary(self, copied):
+        return ', '.join(
+            f'{count} {name}' for name, count in sorted(copied.items())
+        ) or 'nothing'
+
+    def _progress(self, copied):
+        """Report the progress after every pass"""
+        self.stdout.write(f'Pass done: {self._summary(copied)} copied')
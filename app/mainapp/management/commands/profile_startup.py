@@ -0,0 +1,81 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp import startup
+
+
+class Command(BaseCommand):
+    """Django command to show how long a worker takes to start (the median
+       of --repeat fresh interpreters): the import time per package, the
+       time of each phase and of the models and ready() of every app"""
+    help = 'Profile the startup time of the application'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15,
+                            help='Number of packages shown')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the timings as JSON (ie. for CI)')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Fail if a module of STARTUP_DEFERRED_MODULES is imported '
+                 'at startup'
+        )
+        parser.add_argument(
+            '--budget', type=float,
+            help='Fail if the startup takes longer (seconds)'
+        )
+
+    def handle(self, *args, **options):
+        deferred = settings.STARTUP_DEFERRED_MODULES
+        try:
+            runs = [
+                startup.profile(deferred) for _ in range(options['repeat'])
+            ]
+        except Exception as error:
+            raise CommandError(f'Startup failed: {error}')
+        summary = startup.summarize(runs)
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2, sort_keys=True))
+        else:
+            self._report(summary, options['top'])
+
+        if options['check'] and summary['deferred']:
+            raise CommandError(
+                'Imported at startup: ' + ', '.join(summary['deferred'])
+            )
+        total = summary['phases']['total']
+        if options['budget'] is not None and total > options['budget']:
+            raise CommandError(
+                f'Startup took {total:.3f}s, over {options["budget"]}s'
+            )
+
+    def _report(self, summary, top):
+        packages = summary['packages']
+        self.stdout.write(
+            f'Startup (median of {summary["runs"]} runs): '
+            f'{summary["phases"]["total"] * 1000:.1f} ms, '
+            f'imports {sum(packages.values()) * 1000:.1f} ms'
+        )
+        self.stdout.write('\nPhases:')
+        for phase in ('setup', 'middleware', 'urls'):
+            self._line(phase, summary['phases'][phase])
+        self.stdout.write('\nApps:')
+        for label, seconds in sorted(summary['apps'].items()):
+            self._line(label, seconds)
+        self.stdout.write(f'\nImport time of the top {top} packages:')
+        for package, seconds in sorted(
+            packages.items(), key=lambda item: -item[1]
+        )[:top]:
+            self._line(package, seconds)
+        if summary['deferred']:
+            self.stdout.write(self.style.WARNING(
+                '\nDeferred modules imported at startup: '
+                + ', '.join(summary['deferred'])
+            ))
+
+    def _line(self, label, seconds):
+        self.stdout.write(f'  {label:<40} {seconds * 1000:8.1f} ms')
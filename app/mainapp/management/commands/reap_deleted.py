@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mainapp.deletion import Reaper
+
+
+class Command(BaseCommand):
+    """Django command to delete users and recipes marked as deleted, in
+       chunks of --batch-size rows (one short transaction per chunk)"""
+    help = 'Delete users and recipes marked as deleted, chunk by chunk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running, looking for deleted rows every N seconds'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = Reaper(
+                options['batch_size'], progress=self._progress
+            ).run()
+            self.stdout.write(f'Done: {self._summary(deleted)}')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def _summary(self, deleted):
+        return ', '.join(
+            f'{count} {name}' for name, count in deleted.items()
+        ) or 'nothing to delete'
+
+    def _progress(self, deleted):
+        self.stdout.write(f'Deleted so far: {self._summary(deleted)}')
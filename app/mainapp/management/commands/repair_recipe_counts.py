@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from mainapp import sharding
+from mainapp.models import Tag, Ingredient
+from mainapp.signals import actual_recipe_count, recipe_counts_changed
+
+
+class Command(BaseCommand):
+    """Django command to recompute recipe_count of tags and ingredients
+       and fix the ones that drifted from the real number of recipes"""
+    help = 'Recompute recipe_count of tags and ingredients in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the drift, do not fix it')
+
+    def handle(self, *args, **options):
+        aliases = sharding.shards()
+        for alias in aliases:
+            if len(aliases) > 1:
+                self.stdout.write(f'Shard {alias}:')
+            with sharding.use_shard(alias):
+                for model in (Tag, Ingredient):
+                    drifted = self._repair(
+                        model, options['batch_size'], options['dry_run']
+                    )
+                    self.stdout.write(
+                        f'{model.__name__}: {drifted} recipe counts '
+                        f'{"drifted" if options["dry_run"] else "repaired"}'
+                    )
+
+    def _repair(self, model, batch_size, dry_run):
+        """Repair recipe counts batch by batch (by ranges of ids), so
+           every query only touches a bounded number of rows"""
+        drifted = 0
+        last_pk = 0
+        while True:
+            pks = list(model.objects.filter(pk__gt=last_pk).order_by(
+                'pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return drifted
+            last_pk = pks[-1]
+
+            batch = model.objects.filter(pk__gte=pks[0], pk__lte=last_pk)
+            wrong = list(batch.annotate(
+                actual=actual_recipe_count(model)
+            ).exclude(recipe_count=F('actual')).values_list('pk', flat=True))
+            drifted += len(wrong)
+            if wrong and not dry_run:
+                # the count is computed again inside the update itself, so
+                # changes made meanwhile by requests are not lost
+                model.objects.filter(pk__in=wrong).update(
+                    recipe_count=actual_recipe_count(model)
+                )
+                recipe_counts_changed.send(sender=model, pks=wrong)
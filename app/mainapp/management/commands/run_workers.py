@@ -0,0 +1,67 @@
+import multiprocessing
+import signal
+
+from django.db import connections
+from django.core.management.base import BaseCommand
+
+from mainapp.jobs import Worker
+
+
+class Command(BaseCommand):
+    """Django command to run queued jobs (mainapp/jobs.py) with a pool of
+       --processes processes of --threads threads each"""
+    help = 'Run queued jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument(
+            '--queues', default='',
+            help='Comma separated queues to take jobs from (default: all)'
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Stop once there is no job to run'
+        )
+
+    def handle(self, *args, **options):
+        queues = [
+            queue for queue in options['queues'].split(',') if queue
+        ] or None
+        if options['processes'] == 1:
+            return self._work(queues, options)
+
+        # every process opens its own database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=self._work, args=(queues, options))
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        self._on_stop(lambda: [process.terminate() for process in processes])
+        for process in processes:
+            process.join()
+
+    def _work(self, queues, options):
+        worker = Worker(
+            queues, options['threads'], options['burst'], self._report
+        )
+        previous = self._on_stop(worker.stop)
+        try:
+            worker.run()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def _on_stop(self, stop):
+        """Call stop on SIGTERM/SIGINT, return the previous handlers"""
+        return {
+            signum: signal.signal(signum, lambda *args: stop())
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+
+    def _report(self, job, succeeded):
+        result = 'done' if succeeded else f'failed (attempt {job.attempts})'
+        self.stdout.write(f'Job {job.pk} {job.name}: {result}')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from rest_framework.settings import api_settings
+
+from mainapp.throttling import get_store, throttle_counts
+
+
+class Command(BaseCommand):
+    """Django command to show how often every throttle rate was checked
+       and how often it fired (the request was throttled)"""
+    help = 'Show counters of the throttling rates shared by all workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Clear all counters and buckets afterwards')
+
+    def handle(self, *args, **options):
+        for scope, rate in api_settings.DEFAULT_THROTTLE_RATES.items():
+            checked, throttled = throttle_counts(scope)
+            self.stdout.write(
+                f'{scope} ({rate}): {checked} checked, {throttled} throttled'
+            )
+        if options['reset']:
+            get_store().clear()
+            self.stdout.write('Counters reset')
@@ -0,0 +1,163 @@
+import hashlib
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, only gzip is offered without it
+    brotli = None
+
+
+def parse_accept_encoding(header):
+    """Return {encoding: quality} of an Accept-Encoding header,
+       ie. 'gzip, br;q=0.8' -> {'gzip': 1.0, 'br': 0.8}"""
+    encodings = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name] = quality
+    return encodings
+
+
+def choose_encoding(header):
+    """Return the best encoding we support for an Accept-Encoding header,
+       or None if the client does not accept any of them"""
+    accepted = parse_accept_encoding(header)
+    # brotli comes first because it compresses JSON better than gzip,
+    # it is used unless the client gives a higher quality value to gzip
+    supported = ('br', 'gzip') if brotli is not None else ('gzip',)
+    qualities = {
+        name: accepted.get(name, accepted.get('*', 0.0))
+        for name in supported
+    }
+    best = max(supported, key=lambda name: qualities[name])
+    return best if qualities[best] > 0 else None
+
+
+class StreamCompressor:
+    """Incremental gzip or brotli compressor"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(
+                mode=brotli.MODE_TEXT,
+                quality=settings.COMPRESSION_BROTLI_QUALITY
+            )
+        else:
+            # wbits=16 + MAX_WBITS produces the gzip format
+            self._compressor = zlib.compressobj(
+                settings.COMPRESSION_GZIP_LEVEL,
+                zlib.DEFLATED,
+                16 + zlib.MAX_WBITS
+            )
+
+    def compress(self, data, flush=False):
+        """Compress data, with flush=True everything compressed so far
+           is returned instead of being buffered by the compressor"""
+        if self.encoding == 'br':
+            return self._compressor.process(data) + (
+                self._compressor.flush() if flush else b''
+            )
+        return self._compressor.compress(data) + (
+            self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else b''
+        )
+
+    def finish(self):
+        """End the compressed stream"""
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(encoding, data):
+    """Compress the whole data with the given encoding"""
+    compressor = StreamCompressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_sequence(encoding, sequence):
+    """Compress a streamed response piece by piece. Every piece is flushed,
+       so the client receives data as soon as it is produced"""
+    compressor = StreamCompressor(encoding)
+    for data in sequence:
+        yield compressor.compress(data, flush=True)
+    yield compressor.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress responses with gzip or brotli (the one the client prefers,
+       from the Accept-Encoding header). Responses smaller than
+       COMPRESSION_MIN_SIZE are sent as they are, streamed responses are
+       compressed while they are streamed. Compressed bodies of responses
+       with an ETag are cached, so repeated hits of the same content don't
+       pay the compression CPU again."""
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response  # already compressed (or encoded) by the view
+        if not response.streaming and (
+                len(response.content) < settings.COMPRESSION_MIN_SIZE):
+            return response
+
+        # the response depends on Accept-Encoding, caches must know that
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(
+                encoding, response.streaming_content
+            )
+            del response['Content-Length']
+        else:
+            compressed = self._compress_content(encoding, response)
+            if len(compressed) >= len(response.content):
+                return response  # nothing to win
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # the compressed body is not byte for byte the same anymore,
+        # that's why the ETag becomes weak (as GZipMiddleware does)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+
+        response['Content-Encoding'] = encoding
+        return response
+
+    def _compress_content(self, encoding, response):
+        """Return the compressed content, from the cache if possible"""
+        etag = response.get('ETag')
+        if not etag:
+            return compress(encoding, response.content)
+
+        # the ETag identifies the content (ConditionalGetMiddleware makes
+        # it from a hash of the content), so it is part of the key together
+        # with the encoding and the content type of the response
+        cache = caches[settings.COMPRESSION_CACHE_ALIAS]
+        key = 'compressed:{}:{}'.format(encoding, hashlib.md5(
+            f'{response.get("Content-Type", "")}:{etag}'.encode('utf-8')
+        ).hexdigest())
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = compress(encoding, response.content)
+            cache.set(key, compressed, settings.COMPRESSION_CACHE_TIMEOUT)
+        return compressed
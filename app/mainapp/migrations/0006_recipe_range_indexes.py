@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-19 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'price'], name='mainapp_rec_user_id_72c9f3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'time_minutes'], name='mainapp_rec_user_id_501ab9_idx'),
+        ),
+    ]
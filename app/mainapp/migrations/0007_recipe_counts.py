@@ -0,0 +1,47 @@
+# Generated by Django 3.2 on 2026-10-19 02:47
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_recipes(apps, schema_editor):
+    """Fill recipe_count of existing tags and ingredients"""
+    Recipe = apps.get_model('mainapp', 'Recipe')
+    for model_name, relation in (('Tag', 'tags'), ('Ingredient', 'ingredients')):
+        model = apps.get_model('mainapp', model_name)
+        through = getattr(Recipe, relation).through
+        column = f'{model_name.lower()}_id'
+        model.objects.update(recipe_count=Coalesce(Subquery(
+            through.objects.filter(**{column: OuterRef('pk')})
+            .values(column).annotate(count=Count('*')).values('count')
+        ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0006_recipe_range_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_recipes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', '-recipe_count'], name='mainapp_ing_user_id_fe3db6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', '-recipe_count'], name='mainapp_tag_user_id_bc1f66_idx'),
+        ),
+    ]
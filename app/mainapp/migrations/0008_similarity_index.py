@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-19 02:50
+
+from django.conf import settings
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0007_recipe_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSignature',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='mainapp.recipe')),
+                ('minhashes', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), size=None)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeLSHBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='mainapp.recipe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recipelshbucket',
+            index=models.Index(fields=['user', 'band', 'bucket'], name='mainapp_rec_user_id_6bd65b_idx'),
+        ),
+    ]
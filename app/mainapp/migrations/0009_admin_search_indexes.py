@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+# Indexes used by prefix searches of the admin (search_fields '^name').
+# istartswith is compiled to UPPER("column"::text) LIKE UPPER('abc%'), so
+# the indexes are on the same expression; text_pattern_ops makes LIKE
+# prefix queries use them whatever the collation of the database is.
+SEARCH_INDEXES = [
+    ('mainapp_customuser', 'email', 'mainapp_user_email_upper_idx'),
+    ('mainapp_tag', 'name', 'mainapp_tag_name_upper_idx'),
+    ('mainapp_ingredient', 'name', 'mainapp_ingredient_name_upper_idx'),
+    ('mainapp_recipe', 'title', 'mainapp_recipe_title_upper_idx'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0008_similarity_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX {index} ON {table} '
+            f'(UPPER({column}::text) text_pattern_ops);',
+            reverse_sql=f'DROP INDEX {index};'
+        )
+        for table, column, index in SEARCH_INDEXES
+    ]
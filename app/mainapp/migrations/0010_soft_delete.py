@@ -0,0 +1,31 @@
+# Generated by Django 3.2 on 2026-10-19 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0009_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='mainapp_user_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='mainapp_recipe_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2 on 2026-10-19 03:15
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0011_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue', models.CharField(default='default', max_length=64)),
+                ('name', models.CharField(max_length=255)),
+                ('kwargs', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('priority', models.SmallIntegerField(default=0)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('locked_by', models.CharField(blank=True, max_length=255)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(status='queued'), fields=['queue', '-priority', 'run_at'], name='mainapp_job_queued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(status='running'), fields=['status', 'locked_at'], name='mainapp_job_running_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.2 on 2026-10-19 03:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0012_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=32)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'updated_at'], name='mainapp_ing_user_id_3abb54_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'updated_at'], name='mainapp_rec_user_id_37bde5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'updated_at'], name='mainapp_tag_user_id_c3fc74_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'deleted_at'], name='mainapp_tom_user_id_7dca81_idx'),
+        ),
+    ]
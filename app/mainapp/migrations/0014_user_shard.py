@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-19 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0013_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='shard',
+            field=models.CharField(default='default', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='shard_readonly',
+            field=models.BooleanField(default=False),
+        ),
+    ]
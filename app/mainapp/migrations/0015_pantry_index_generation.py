@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-19 03:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0014_user_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PantryIndexGeneration',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='mainapp.customuser')),
+                ('generation', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,6 +1,8 @@
 import uuid
 import os  # to manipulate paths
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 # BaseUserManager class - in order to create our own custom user manager
 # AbstractBaseUser class - in order to create our own custom user model
@@ -8,6 +10,9 @@ from django.contrib.auth.models import PermissionsMixin
 # PermissionsMixin - to manage and create custom permissions for a user
 
 from django.conf import settings  # importing settings from core 'app' app
+from django.utils import timezone
+
+from mainapp import sharding
 
 
 def recipe_image_file_path(instance, filename):
@@ -26,7 +31,10 @@ class CustomUserManager(BaseUserManager):
         if not email:
             raise ValueError("User must have an email address")
 
-        user = self.model(email=self.normalize_email(email), **extra_fields)
+        email = self.normalize_email(email)
+        # the database the rows of the user live on (mainapp/sharding.py)
+        extra_fields.setdefault('shard', sharding.place(email))
+        user = self.model(email=email, **extra_fields)
         # here self.model() referes back to the class it manages for,
         # (ie. CustomUserManager manages CustomUser), then self.model()
         # is called in 'create_user' then it will put attributes of
@@ -35,6 +43,7 @@ class CustomUserManager(BaseUserManager):
         user.set_password(password)  # set_password func comes with
         # AbstractBaseUser
         user.save(self._db)
+        sharding.copy_user(user, user.shard)
 
         return user
 
@@ -44,11 +53,14 @@ class CustomUserManager(BaseUserManager):
         if not email:
             raise ValueError("User must have an email address")
 
-        user = self.model(email=self.normalize_email(email), **extra_fields)
+        email = self.normalize_email(email)
+        extra_fields.setdefault('shard', sharding.place(email))
+        user = self.model(email=email, **extra_fields)
         user.set_password(password)
         user.is_superuser = True
         user.is_staff = True
         user.save(using=self._db)
+        sharding.copy_user(user, user.shard)
 
         return user
 
@@ -62,9 +74,24 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):  # to put CustomUser
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # set when the user deleted the account, the user and everything it
+    # owns is deleted later in chunks (python manage.py reap_deleted)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # database alias of the shard the tags, ingredients and recipes of the
+    # user live on, changes are rejected while they are moved to another
+    # one (see mainapp/sharding.py)
+    shard = models.CharField(max_length=64, default='default')
+    shard_readonly = models.BooleanField(default=False)
 
     objects = CustomUserManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at'],
+                         name='mainapp_user_deleted_idx',
+                         condition=models.Q(deleted_at__isnull=False)),
+        ]
+
     USERNAME_FIELD = "email"
 
 
@@ -76,6 +103,18 @@ class Tag(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    # number of recipes using the tag, kept up to date by mainapp/signals.py
+    # (python manage.py repair_recipe_counts fixes it if it ever drifts)
+    recipe_count = models.PositiveIntegerField(default=0)
+    # last change, clients sync the changes since their last sync
+    # (.../api/recipe/sync/), recipe_count changes included
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-recipe_count']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
 
     def __str__(self):
         """Returns string representation"""
@@ -89,6 +128,15 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    # number of recipes using the ingredient (see Tag.recipe_count)
+    recipe_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)  # see Tag.updated_at
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-recipe_count']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
 
     def __str__(self):
         """Returns string representation"""
@@ -113,6 +161,160 @@ class Recipe(models.Model):
     # order of classes, meaning that Ingredient must come before Recipe.
     tags = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # deleted recipes are hidden right away and deleted later in chunks
+    # (see mainapp/deletion.py)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # last change, changes of tags/ingredients of the recipe included
+    # (see mainapp/signals.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # range filters of the recipe list (ie. ?price_max=10) are always
+        # limited to the recipes of one user
+        indexes = [
+            models.Index(fields=['user', 'price']),
+            models.Index(fields=['user', 'time_minutes']),
+            models.Index(fields=['user', 'updated_at']),
+            # only deleted recipes, the ones the reaper is looking for
+            models.Index(fields=['deleted_at'],
+                         name='mainapp_recipe_deleted_idx',
+                         condition=models.Q(deleted_at__isnull=False)),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class RecipeSignature(models.Model):
+    """MinHash signature of the ingredient set of a recipe, used to find
+       similar recipes (see recipe/similarity.py)"""
+    recipe = models.OneToOneField(
+        'Recipe',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='signature'
+    )
+    minhashes = ArrayField(models.BigIntegerField())
+
+
+class RecipeLSHBucket(models.Model):
+    """One band of the MinHash signature of a recipe. Recipes that share
+       a (band, bucket) pair are candidates of being similar"""
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        related_name='lsh_buckets'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'band', 'bucket']),
+        ]
+
+
+class PantryIndexGeneration(models.Model):
+    """Number of changes of the pantry index of a user. Processes keeping
+       a copy of the index made before the last change rebuild it (see
+       recipe/pantry.py)"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    generation = models.BigIntegerField(default=0)
+
+
+class IdempotencyKey(models.Model):
+    """Response of a POST request sent with an Idempotency-Key header, the
+       same request sent again gets it back (see mainapp/idempotency.py)"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    key = models.CharField(max_length=255)
+    # hash of the method, path and body, the key can't be reused for
+    # another request
+    fingerprint = models.CharField(max_length=64)
+    # null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'],
+                                    name='mainapp_idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+
+class Job(models.Model):
+    """Work run later by a worker (python manage.py run_workers), see
+       mainapp/jobs.py"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'  # no attempts left, finished jobs are deleted
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    queue = models.CharField(max_length=64, default='default')
+    # import path of the task function, ie. 'mainapp.deletion.reap'
+    name = models.CharField(max_length=255)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # jobs with a higher priority run first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=QUEUED
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # not run before this time (retries are delayed with a backoff)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=255, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # only queued jobs, in the order workers take them
+            models.Index(fields=['queue', '-priority', 'run_at'],
+                         name='mainapp_job_queued_idx',
+                         condition=models.Q(status='queued')),
+            models.Index(fields=['status', 'locked_at'],
+                         name='mainapp_job_running_idx',
+                         condition=models.Q(status='running')),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+
+class Tombstone(models.Model):
+    """A deleted recipe, tag or ingredient, so clients syncing changes
+       (.../api/recipe/sync/) learn about the deletion"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    # 'recipe', 'tag' or 'ingredient'
+    model = models.CharField(max_length=32)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at']),
+        ]
@@ -0,0 +1,426 @@
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from rest_framework import exceptions
+from rest_framework.permissions import SAFE_METHODS
+
+
+# Every row of a user (tags, ingredients, recipes and what is derived from
+# them) lives on one database, the shard of the user (CustomUser.shard).
+# Every alias of DATABASES is a shard (see DB_SHARDS in app/settings.py),
+# the default one also keeps users, tokens, idempotency keys and jobs.
+#
+# ShardRouter sends queries of the sharded models to the shard of the
+# object or user they are about, or else to the current shard: the shard
+# of request.user during requests of the recipe API (ShardedViewMixin),
+# set with use_shard() elsewhere. Every shard has the whole schema
+# (python manage.py migrate --database <alias>), and the ids of recipes,
+# tags and ingredients are unique over all shards (set_id_sequences), so
+# rows keep their ids when a user is moved to another shard
+# (python manage.py move_user_shard, see UserMove).
+
+SHARDED_MODELS = {
+    'mainapp.tag', 'mainapp.ingredient', 'mainapp.recipe',
+    'mainapp.recipe_tags', 'mainapp.recipe_ingredients',
+    'mainapp.recipesignature', 'mainapp.recipelshbucket',
+    'mainapp.tombstone',
+}
+# tables whose ids are unique over all shards
+GLOBAL_ID_TABLES = ('mainapp_tag', 'mainapp_ingredient', 'mainapp_recipe')
+
+_current = ContextVar('shard', default=None)
+
+
+def is_sharded(model):
+    # not _meta.label_lower, the table of DatabaseCache is routed too, with
+    # options of its own that only have app_label and model_name
+    meta = model._meta
+    return f'{meta.app_label}.{meta.model_name}' in SHARDED_MODELS
+
+
+def shards():
+    """Aliases of all shards"""
+    return list(settings.DATABASES)
+
+
+def current():
+    """Alias of the shard queries of sharded models go to by default"""
+    return _current.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_shard(alias):
+    """Send queries of sharded models to a shard (ie. in commands)"""
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def place(email):
+    """Return the shard of a new user, one of DB_SHARDS_FOR_NEW_USERS"""
+    aliases = settings.DB_SHARDS_FOR_NEW_USERS
+    return aliases[zlib.crc32(email.lower().encode()) % len(aliases)]
+
+
+def copy_user(user, alias):
+    """Make sure a shard has a row of the user, the foreign keys of the
+       user's rows point to it. It's only a placeholder (the user can't log
+       in with it), users are always read from the default database."""
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    users = type(user).objects.using(alias)
+    if not users.filter(pk=user.pk).exists():
+        users.bulk_create([type(user)(
+            pk=user.pk, email=user.email, password=make_password(None),
+            is_active=False, shard=alias
+        )])
+
+
+def _sequences(cursor):
+    """Yield the tables of GLOBAL_ID_TABLES and their id sequences"""
+    for table in GLOBAL_ID_TABLES:
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, 'id'])
+        sequence, = cursor.fetchone()
+        yield table, sequence
+
+
+def set_id_sequences(using, **kwargs):
+    """Let the shard with id i (DB_SHARD_IDS) number rows i + 1,
+       i + 1 + stride, ... so ids are unique over all shards (run after
+       every migrate, see apps.py). It's done without other shards too,
+       so shards can be added later on without migrating the others."""
+    stride = settings.DB_SHARD_ID_STRIDE
+    remainder = (settings.DB_SHARD_IDS[using] + 1) % stride
+    with connections[using].cursor() as cursor:
+        for table, sequence in _sequences(cursor):
+            cursor.execute(
+                f'SELECT GREATEST(MAX(id), (SELECT last_value FROM '
+                f'{sequence})) FROM {table}'
+            )
+            last, = cursor.fetchone()
+            # the next id above every id used so far with the remainder
+            # of the shard
+            following = last + 1 + (remainder - last - 1) % stride
+            cursor.execute(f'ALTER SEQUENCE {sequence} INCREMENT BY %s',
+                           [stride])
+            cursor.execute('SELECT setval(%s, %s, false)',
+                           [sequence, following])
+
+
+def has_id_sequences(alias):
+    """Return whether set_id_sequences() was run on a shard (by migrate)"""
+    with connections[alias].cursor() as cursor:
+        for table, sequence in _sequences(cursor):
+            cursor.execute(
+                'SELECT seqincrement FROM pg_sequence '
+                'WHERE seqrelid = %s::regclass', [sequence]
+            )
+            if cursor.fetchone()[0] != settings.DB_SHARD_ID_STRIDE:
+                return False
+    return True
+
+
+class ShardRouter:
+    """Route queries of sharded models to the right shard"""
+
+    def _db(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None:
+            if is_sharded(type(instance)) and instance._state.db:
+                return instance._state.db
+            # ie. user.recipe_set or Recipe(user=user)
+            shard = getattr(instance, 'shard', None)
+            if shard:
+                return shard
+        return current()
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Sharded rows only relate to rows of the same shard, and to
+           their user"""
+        if is_sharded(type(obj1)) and is_sharded(type(obj2)):
+            return obj1._state.db == obj2._state.db
+        return True
+
+
+class ShardReadOnly(exceptions.APIException):
+    status_code = 503
+    default_detail = 'Your recipes are being moved, try again shortly.'
+    default_code = 'shard_read_only'
+
+    def __init__(self):
+        super().__init__()
+        # sent as Retry-After by the exception handler of DRF
+        self.wait = settings.SHARD_MOVE_GRACE
+
+
+class ShardedViewMixin:
+    """Run the queries of a request on the shard of request.user, and
+       reject changes while the user is being moved"""
+    _shard_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.user.shard_readonly and \
+                request.method not in SAFE_METHODS:
+            raise ShardReadOnly()
+        self._shard_token = _current.set(request.user.shard)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._shard_token is not None:
+            _current.reset(self._shard_token)
+            self._shard_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def delete_rows(queryset, batch_size=500):
+    """Delete the rows of queryset batch by batch without signals (the
+       rows live on in another shard), return their number"""
+    connection = connections[queryset.db]
+    meta = queryset.model._meta
+    table = connection.ops.quote_name(meta.db_table)
+    column = connection.ops.quote_name(meta.pk.column)
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN %s',
+                           [tuple(pks)])
+        deleted += len(pks)
+
+
+class UserMove:
+    """Move the rows of a user to another shard while the user keeps
+       using the API. Everything is copied, then what changed meanwhile
+       (updated_at, tombstones of deleted rows) until little is left.
+       Changes are then rejected for SHARD_MOVE_GRACE seconds (requests
+       that started before see it too late), the last changes are copied
+       and the user is switched over. The rows left on the old shard are
+       deleted once the requests still reading them are done. progress
+       (if given) is called after every pass with the numbers of copied
+       rows."""
+
+    def __init__(self, user, target, batch_size=500, progress=None):
+        from mainapp.models import Tag, Ingredient, Recipe
+        self.models = {'tag': Tag, 'ingredient': Ingredient,
+                       'recipe': Recipe}
+        self.user = user
+        self.source = user.shard
+        self.target = target
+        self.batch_size = batch_size
+        self.progress = progress
+        self.copied = Counter()
+
+    def run(self):
+        if self.target not in shards():
+            raise ValueError(f'Unknown shard {self.target}')
+        if self.target == self.source:
+            raise ValueError(f'The user is on {self.target} already')
+        for alias in (self.source, self.target):
+            if not has_id_sequences(alias):
+                # ids of the shards could collide
+                raise ValueError(
+                    f'The ids of {alias} aren\'t unique over all shards, '
+                    f'run python manage.py migrate --database {alias}'
+                )
+        copy_user(self.user, self.target)
+
+        since = None
+        for _ in range(settings.SHARD_MOVE_MAX_PASSES):
+            # rows written by transactions still running when the pass
+            # started may have older updated_at times
+            started = timezone.now() - timedelta(
+                seconds=settings.RECIPE_SYNC_OVERLAP
+            )
+            copied = self.copy(since)
+            since = started
+            if copied < self.batch_size:
+                break
+
+        self._update_user(shard_readonly=True)
+        try:
+            time.sleep(settings.SHARD_MOVE_GRACE)
+            self.copy(since)
+            self.copy_tombstones()
+            self._update_user(shard=self.target, shard_readonly=False)
+        except BaseException:
+            self._update_user(shard_readonly=False)
+            raise
+        time.sleep(settings.SHARD_MOVE_GRACE)
+        self.delete_source()
+        return dict(self.copied)
+
+    def _update_user(self, **fields):
+        type(self.user).objects.filter(pk=self.user.pk).update(**fields)
+        for name, value in fields.items():
+            setattr(self.user, name, value)
+
+    def _source(self, model):
+        return model.objects.using(self.source)
+
+    def _target(self, model):
+        return model.objects.using(self.target)
+
+    def _batches(self, queryset):
+        """Yield lists of the objects of queryset, batch by batch"""
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).order_by('pk')[
+                :self.batch_size
+            ])
+            if not rows:
+                return
+            last_pk = rows[-1].pk
+            yield rows
+
+    def copy(self, since=None):
+        """Copy the rows of the user changed since then (all without it),
+           delete the ones deleted since then, return their number"""
+        copied = 0
+        for kind in ('tag', 'ingredient', 'recipe'):
+            model = self.models[kind]
+            rows = self._source(model).filter(user=self.user)
+            if since is not None:
+                rows = rows.filter(updated_at__gte=since)
+            for batch in self._batches(rows):
+                with transaction.atomic(using=self.target):
+                    self._upsert(model, batch)
+                    if kind == 'recipe':
+                        self._copy_relations([row.pk for row in batch])
+                copied += len(batch)
+                self.copied[kind] += len(batch)
+        if since is not None:
+            copied += self._copy_deletions(since)
+        if self.progress:
+            self.progress(dict(self.copied))
+        return copied
+
+    def _upsert(self, model, rows):
+        """Write rows to the target with their ids"""
+        pks = [row.pk for row in rows]
+        existing = set(self._target(model).filter(
+            pk__in=pks
+        ).values_list('pk', flat=True))
+        fields = [field.name for field in model._meta.concrete_fields
+                  if not field.primary_key]
+        self._target(model).bulk_update(
+            [row for row in rows if row.pk in existing], fields
+        )
+        new = [row for row in rows if row.pk not in existing]
+        # bulk_create() sets updated_at (auto_now) to now, the copies keep
+        # the times of the rows (the cursors of syncs), bulk_update()
+        # writes them as they are
+        stamps = [(row, row.updated_at) for row in new]
+        self._target(model).bulk_create(new)
+        for row, updated_at in stamps:
+            row.updated_at = updated_at
+        self._target(model).bulk_update(new, ['updated_at'])
+
+    def _copy_relations(self, recipe_ids):
+        """Replace tags, ingredients and similarity index of recipes"""
+        from mainapp.models import Recipe, RecipeSignature, RecipeLSHBucket
+        for through, column in ((Recipe.tags.through, 'tag_id'),
+                                (Recipe.ingredients.through,
+                                 'ingredient_id')):
+            delete_rows(self._target(through).filter(
+                recipe_id__in=recipe_ids
+            ))
+            self._target(through).bulk_create(
+                through(recipe_id=recipe_id, **{column: related_id})
+                for recipe_id, related_id in self._source(through).filter(
+                    recipe_id__in=recipe_ids
+                ).values_list('recipe_id', column)
+            )
+        delete_rows(self._target(RecipeSignature).filter(
+            recipe_id__in=recipe_ids
+        ))
+        self._target(RecipeSignature).bulk_create(
+            self._source(RecipeSignature).filter(recipe_id__in=recipe_ids)
+        )
+        delete_rows(self._target(RecipeLSHBucket).filter(
+            recipe_id__in=recipe_ids
+        ))
+        buckets = list(self._source(RecipeLSHBucket).filter(
+            recipe_id__in=recipe_ids
+        ))
+        for bucket in buckets:
+            bucket.pk = None
+        self._target(RecipeLSHBucket).bulk_create(buckets)
+
+    def _copy_deletions(self, since):
+        """Apply the deletions of the tombstones written since then"""
+        from mainapp.models import Recipe, Tombstone
+        deleted = self._source(Tombstone).filter(
+            user=self.user, deleted_at__gte=since
+        ).values_list('model', 'object_id')
+        pks = {}
+        for kind, pk in deleted:
+            pks.setdefault(kind, set()).add(pk)
+        count = 0
+        for kind, model in self.models.items():
+            if kind not in pks:
+                continue
+            # recipes marked as deleted are still there, with deleted_at
+            alive = list(self._source(model).filter(pk__in=pks[kind]))
+            gone = pks[kind] - {row.pk for row in alive}
+            with transaction.atomic(using=self.target):
+                self._upsert(model, alive)
+                if kind == 'recipe':
+                    self._copy_relations(list(pks[kind]))
+                else:
+                    through = getattr(Recipe, f'{kind}s').through
+                    delete_rows(self._target(through).filter(**{
+                        f'{kind}_id__in': gone
+                    }))
+                delete_rows(self._target(model).filter(pk__in=gone))
+            count += len(pks[kind])
+        return count
+
+    def copy_tombstones(self):
+        """Replace the tombstones of the user (read by syncs)"""
+        from mainapp.models import Tombstone
+        with transaction.atomic(using=self.target):
+            delete_rows(self._target(Tombstone).filter(user=self.user))
+            tombstones = list(self._source(Tombstone).filter(user=self.user))
+            for tombstone in tombstones:
+                tombstone.pk = None
+            self._target(Tombstone).bulk_create(tombstones)
+        self.copied['tombstones'] += len(tombstones)
+
+    def delete_source(self):
+        """Delete the rows of the user from the old shard"""
+        from mainapp.models import Recipe, RecipeSignature, \
+            RecipeLSHBucket, Tombstone
+        recipes = {'recipe__user': self.user}
+        for queryset in (
+            self._source(RecipeLSHBucket).filter(user=self.user),
+            self._source(RecipeSignature).filter(**recipes),
+            self._source(Recipe.tags.through).filter(**recipes),
+            self._source(Recipe.ingredients.through).filter(**recipes),
+            self._source(Tombstone).filter(user=self.user),
+            self._source(Recipe).filter(user=self.user),
+            self._source(self.models['tag']).filter(user=self.user),
+            self._source(self.models['ingredient']).filter(user=self.user),
+        ):
+            delete_rows(queryset, self.batch_size)
+        if self.source != DEFAULT_DB_ALIAS:  # the placeholder of the user
+            delete_rows(self._source(type(self.user)).filter(
+                pk=self.user.pk
+            ))
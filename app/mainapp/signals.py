@@ -0,0 +1,166 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import m2m_changed, pre_delete, post_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from mainapp.models import Tag, Ingredient, Recipe, Tombstone
+
+
+# Tag.recipe_count and Ingredient.recipe_count are kept exact here, every
+# change of Recipe.tags / Recipe.ingredients updates them with atomic
+# 'recipe_count = recipe_count + n' queries (F() expressions), so concurrent
+# requests never overwrite each other's changes. Counts never go below 0:
+# two requests removing the same relation (ie. a recipe deleted while its
+# tags are cleared) both subtract it, the count is clamped instead of
+# failing the CHECK constraint of the column (repair_recipe_counts fixes
+# the drift).
+
+# through table -> (related model, column of the related model)
+COUNTED_RELATIONS = {
+    Recipe.tags.through: (Tag, 'tag_id'),
+    Recipe.ingredients.through: (Ingredient, 'ingredient_id'),
+}
+
+# sent with sender=Tag/Ingredient, pks of the changed recipe counts and
+# user_id, the user of them all (None if unknown)
+recipe_counts_changed = Signal()
+
+
+def bump_recipe_counts(model, deltas, user_id=None):
+    """Add deltas ({pk: n}) to recipe_count of tags/ingredients (of the
+       user user_id if given), with one query per distinct delta (ie. +1
+       for all new relations)"""
+    by_delta = {}
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(pk)
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(
+            recipe_count=Greatest(F('recipe_count') + delta, 0),
+            updated_at=timezone.now()
+        )
+    if by_delta:
+        recipe_counts_changed.send(
+            sender=model, user_id=user_id,
+            pks=[pk for pks in by_delta.values() for pk in pks]
+        )
+
+
+def actual_recipe_count(model):
+    """Return an expression counting the recipes of each tag/ingredient"""
+    through, column = next(
+        (through, column)
+        for through, (related, column) in COUNTED_RELATIONS.items()
+        if related is model
+    )
+    return Coalesce(Subquery(
+        through.objects.filter(**{column: OuterRef('pk')})
+        .filter(recipe__deleted_at__isnull=True)  # see mainapp/deletion.py
+        .values(column).annotate(count=Count('*')).values('count')
+    ), 0)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def count_recipes_on_m2m_change(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    """Update recipe counts when tags/ingredients of recipes change.
+       Removals are counted in pre_* signals, while the rows still exist
+       (remove() and clear() run both signals in the same transaction)"""
+    model, column = COUNTED_RELATIONS[sender]
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+
+    if not reverse:  # recipe.tags.add(tag1, tag2), pk_set = tag ids
+        if action == 'post_add':
+            # Django only sends the ids that were actually added
+            bump_recipe_counts(model, dict.fromkeys(pk_set, 1),
+                               instance.user_id)
+            return
+        rows = sender.objects.filter(recipe_id=instance.pk)
+        if action == 'pre_remove':
+            rows = rows.filter(**{f'{column}__in': pk_set})
+        bump_recipe_counts(
+            model, dict.fromkeys(rows.values_list(column, flat=True), -1),
+            instance.user_id
+        )
+    else:  # tag.recipe_set.add(recipe1, recipe2), pk_set = recipe ids
+        if action == 'post_add':
+            bump_recipe_counts(model, {instance.pk: len(pk_set)},
+                               instance.user_id)
+            return
+        rows = sender.objects.filter(**{column: instance.pk})
+        if action == 'pre_remove':
+            rows = rows.filter(recipe_id__in=pk_set)
+        bump_recipe_counts(model, {instance.pk: -rows.count()},
+                           instance.user_id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def count_recipes_on_delete(sender, instance, **kwargs):
+    """Deleting a recipe deletes its relations without m2m_changed
+       signals, so counts of its tags/ingredients are updated here"""
+    if instance.deleted_at is not None:
+        return  # already uncounted when it was marked as deleted
+    for through, (model, column) in COUNTED_RELATIONS.items():
+        related_ids = through.objects.filter(
+            recipe_id=instance.pk
+        ).values_list(column, flat=True)
+        bump_recipe_counts(model, dict.fromkeys(related_ids, -1),
+                           instance.user_id)
+
+
+# Recipe.updated_at, Tag.updated_at and Ingredient.updated_at tell clients
+# what changed since their last sync, tombstones what was deleted.
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def touch_recipes_on_m2m_change(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    """Recipes whose tags/ingredients changed are updated"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':  # tag.recipe_set.clear()
+        model, column = COUNTED_RELATIONS[sender]
+        recipes = Recipe.objects.filter(pk__in=sender.objects.filter(
+            **{column: instance.pk}
+        ).values('recipe_id'))
+    else:
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    recipes.update(updated_at=timezone.now())
+
+
+_tombstones = ContextVar('tombstones', default=True)
+
+
+@contextmanager
+def no_tombstones():
+    """Delete rows without tombstones, ie. the rows of a deleted user (no
+       client of the user syncs anymore)"""
+    token = _tombstones.set(False)
+    try:
+        yield
+    finally:
+        _tombstones.reset(token)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def leave_tombstone(sender, instance, **kwargs):
+    """Remember deleted recipes, tags and ingredients"""
+    if getattr(instance, 'deleted_at', None) is not None:
+        return  # the tombstone was left when it was marked as deleted
+    if not _tombstones.get():
+        return
+    Tombstone.objects.create(
+        user_id=instance.user_id,
+        model=sender._meta.model_name,
+        object_id=instance.pk
+    )
@@ -0,0 +1,112 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+# How long a process takes until it can serve requests, measured by
+# `python manage.py profile_startup`. Every run starts a fresh interpreter
+# with `python -X importtime -m mainapp.startup`, which sets up Django the
+# same way app/wsgi.py does, loads the middleware and the URLconf (with
+# every view), and prints the timings of each phase as JSON. The import
+# times written to stderr are added up per top level package.
+
+def _timed(timings, label, func):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[label] = time.perf_counter() - start
+    return wrapper
+
+
+def boot(deferred):
+    """Start the application like a worker, return the timings of the
+       phases and apps, and the deferred modules that were imported"""
+    start = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+    import django
+    from django.apps.config import AppConfig
+
+    # the models and ready() of every app are timed on their AppConfig
+    apps = {}
+    create = AppConfig.create.__func__
+
+    def create_timed(cls, entry):
+        config = create(cls, entry)
+        config.import_models = _timed(
+            apps, f'{config.label}.models', config.import_models
+        )
+        config.ready = _timed(apps, f'{config.label}.ready', config.ready)
+        return config
+    AppConfig.create = classmethod(create_timed)
+
+    phases = {}
+    _timed(phases, 'setup', django.setup)(set_prefix=False)
+    from django.core.handlers.wsgi import WSGIHandler
+    _timed(phases, 'middleware', WSGIHandler)()
+    from django.urls import get_resolver
+    _timed(phases, 'urls', lambda: get_resolver().url_patterns)()
+    phases['total'] = time.perf_counter() - start
+
+    return {
+        'phases': phases,
+        'apps': apps,
+        'deferred': [name for name in deferred if name in sys.modules],
+    }
+
+
+def parse_importtime(stderr):
+    """Add up the self times of `-X importtime` (microseconds) per top
+       level package"""
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue  # the header
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(own)
+    return packages
+
+
+def profile(deferred, python=sys.executable):
+    """Boot the application in a new interpreter, return its timings with
+       the import time per package (seconds)"""
+    process = subprocess.run(
+        [python, '-X', 'importtime', '-m', 'mainapp.startup', *deferred],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True, text=True, check=True
+    )
+    result = json.loads(process.stdout.splitlines()[-1])
+    result['packages'] = {
+        package: micros / 1e6
+        for package, micros in parse_importtime(process.stderr).items()
+    }
+    return result
+
+
+def summarize(runs):
+    """The median of every timing over several runs"""
+    def medians(key):
+        labels = {label for run in runs for label in run[key]}
+        return {
+            label: statistics.median(run[key].get(label, 0) for run in runs)
+            for label in labels
+        }
+    return {
+        'runs': len(runs),
+        'phases': medians('phases'),
+        'apps': medians('apps'),
+        'packages': medians('packages'),
+        'deferred': sorted({name for run in runs for name in run['deferred']}),
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(boot(sys.argv[1:])))
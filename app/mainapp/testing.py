@@ -0,0 +1,61 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test.runner import DiscoverRunner
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from mainapp.models import Recipe
+
+
+class TestRunner(DiscoverRunner):
+    """The default test runner, with a throttle file of its own, so token
+       buckets (mainapp/throttling.py) don't carry over from earlier runs
+       or from runs in parallel, and requests of tests aren't throttled"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._throttle_directory = tempfile.TemporaryDirectory()
+        settings.THROTTLE_STORE_PATH = os.path.join(
+            self._throttle_directory.name, 'throttle.bin'
+        )
+
+    def teardown_test_environment(self, **kwargs):
+        super().teardown_test_environment(**kwargs)
+        self._throttle_directory.cleanup()
+
+
+def create_user(email='testt@gmail.com', password='Test1234', **params):
+    """Create a user for the tests"""
+    return get_user_model().objects.create_user(email, password, **params)
+
+
+def create_sample_recipe(user, **params):
+    """Create and retrieve a sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.99
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def detail_url(recipe_id):
+    """Return recipe detail URL"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class AuthenticatedClientMixin:
+    """Set up tests of the API with self.user and self.client
+       authenticated as that user"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
@@ -1,8 +1,12 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 # Client in order to be a test client to receive a request
 from django.contrib.auth import get_user_model
 # get_user_model in order to get a current active User model
 from django.urls import reverse  # in order to generate a url/path
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from mainapp.models import Tag, Recipe
 
 
 class TestAdminSite(TestCase):
@@ -45,3 +49,56 @@ class TestAdminSite(TestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, 200)
+
+
+class TestFastAdmin(TestCase):
+    """Test admin pages of large tables stay fast"""
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='admin@gmail.com',
+            password='admin1234'
+        )
+        self.client.force_login(self.admin_user)
+        self.tag = Tag.objects.create(user=self.admin_user, name='Vegan')
+        self.recipe = Recipe.objects.create(
+            user=self.admin_user, title='Cake', time_minutes=10, price=5
+        )
+
+    def test_recipe_change_page_autocomplete(self):
+        """Test tags are not rendered as <select> options"""
+        url = reverse('admin:mainapp_recipe_change', args=[self.recipe.id])
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertNotContains(response, f'<option value="{self.tag.id}"')
+
+    @override_settings(COUNT_ESTIMATE_THRESHOLD=1)
+    def test_changelist_estimated_count(self):
+        """Test unfiltered changelists count rows from statistics"""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE mainapp_recipe')
+        url = reverse('admin:mainapp_recipe_changelist')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertContains(response, 'Cake')
+        self.assertFalse([
+            query for query in queries
+            if 'COUNT(*)' in query['sql'] and 'mainapp_recipe' in query['sql']
+        ])
+        self.assertTrue([
+            query for query in queries if 'reltuples' in query['sql']
+        ])
+
+    def test_search_uses_index(self):
+        """Test the prefix search on email can use its index"""
+        queryset = get_user_model().objects.filter(email__istartswith='adm')
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+
+        self.assertIn('mainapp_user_email_upper_idx', plan)
@@ -0,0 +1,101 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from mainapp import counts
+from mainapp.models import Recipe, Tag
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def analyze(model):
+    """Update the statistics of the table of model"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+
+class CountRowsTests(TestCase):
+    """Test exact and estimated counts"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com',
+            'Test1234'
+        )
+        for i in range(3):
+            Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=10, price=5
+            )
+
+    def test_exact_below_threshold(self):
+        """Test small results are counted exactly"""
+        analyze(Recipe)
+
+        self.assertEqual(
+            counts.count_rows(Recipe.objects.all(), threshold=100), (3, True)
+        )
+
+    def test_table_estimate(self):
+        """Test large tables use the row estimate of the statistics"""
+        analyze(Recipe)
+
+        with self.assertNumQueries(1):
+            count = counts.count_rows(Recipe.objects.all(), threshold=2)
+
+        self.assertEqual(count, (3, False))
+
+    def test_filtered_plan_estimate(self):
+        """Test filtered querysets use the estimate of EXPLAIN"""
+        analyze(Recipe)
+        queryset = Recipe.objects.filter(user=self.user)
+
+        count, exact = counts.count_rows(queryset, threshold=1)
+
+        self.assertFalse(exact)
+        self.assertEqual(count, counts.plan_estimate(queryset))
+        self.assertGreaterEqual(count, 1)
+
+
+class CountHeadersApiTests(TestCase):
+    """Test list endpoints report their number of items"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com',
+            'Test1234'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(2):
+            Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=10, price=5
+            )
+        Tag.objects.create(user=self.user, name='Vegan')
+
+    def test_list_headers(self):
+        """Test lists rendered at once have an exact count"""
+        for url, count in ((RECIPES_URL, '2'), (TAGS_URL, '1')):
+            response = self.client.get(url)
+
+            self.assertEqual(response[counts.COUNT_HEADER], count)
+            self.assertEqual(response[counts.EXACT_HEADER], 'true')
+
+    @override_settings(COUNT_ESTIMATE_THRESHOLD=1)
+    def test_streamed_list_estimated(self):
+        """Test streamed lists count with the provider"""
+        analyze(Recipe)
+
+        response = self.client.get(RECIPES_URL, {'stream': 1})
+
+        self.assertEqual(response[counts.EXACT_HEADER], 'false')
+        self.assertGreaterEqual(int(response[counts.COUNT_HEADER]), 1)
+        self.assertEqual(
+            len(json.loads(b''.join(response.streaming_content))), 2
+        )
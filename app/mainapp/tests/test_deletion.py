@@ -0,0 +1,157 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from mainapp.deletion import Reaper, soft_delete_recipes, soft_delete_user
+from mainapp.jobs import Worker
+from mainapp.models import Tag, Ingredient, Recipe, RecipeSignature, Job
+from mainapp.testing import create_sample_recipe, create_user
+
+
+class DeletionTests(TestCase):
+    """Test marking rows as deleted and reaping them in chunks"""
+    # the reaper and the commands visit every shard (DB_SHARDS)
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = create_user('test@gmail.com', 'Test1234')
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(
+            user=self.user, name='Salt'
+        )
+        self.recipes = [
+            create_sample_recipe(self.user, title=f'R{i}') for i in range(3)
+        ]
+        for recipe in self.recipes:
+            recipe.tags.add(self.tag)
+            recipe.ingredients.add(self.ingredient)
+
+    def test_soft_delete_recipes(self):
+        """Test recipes are marked and uncounted right away"""
+        deleted = soft_delete_recipes(
+            Recipe.objects.filter(pk__in=[r.pk for r in self.recipes[:2]])
+        )
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(
+            Recipe.objects.filter(deleted_at__isnull=False).count(), 2
+        )
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 1)
+        # already deleted recipes are not counted twice
+        self.assertEqual(soft_delete_recipes(Recipe.objects.all()), 1)
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 0)
+
+    def test_reap_recipes_in_batches(self):
+        """Test the reaper deletes marked recipes chunk by chunk"""
+        soft_delete_recipes(Recipe.objects.filter(pk__in=[
+            r.pk for r in self.recipes[:2]
+        ]))
+        progress = []
+
+        deleted = Reaper(batch_size=1, progress=progress.append).run()
+
+        self.assertEqual(deleted, {'recipes': 2})
+        self.assertEqual(progress, [{'recipes': 1}, {'recipes': 2}])
+        self.assertEqual(list(Recipe.objects.all()), [self.recipes[2]])
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 1)
+        self.assertEqual(Recipe.tags.through.objects.count(), 1)
+        self.assertEqual(RecipeSignature.objects.count(), 1)
+
+    def test_reap_deletes_image_files(self):
+        """Test image files of reaped recipes are deleted"""
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            recipe = self.recipes[0]
+            recipe.image = SimpleUploadedFile('cake.jpg', b'image data')
+            recipe.save()
+            path = recipe.image.path
+            self.assertTrue(os.path.exists(path))
+
+            soft_delete_recipes(Recipe.objects.filter(pk=recipe.pk))
+            Reaper().run()
+
+            self.assertFalse(os.path.exists(path))
+
+    def test_reap_user(self):
+        """Test a deleted user is reaped with everything it owns"""
+        user2 = create_user('test2@gmail.com', 'Test12345')
+        kept = create_sample_recipe(user2)
+        soft_delete_user(self.user)
+
+        deleted = Reaper(batch_size=2).run()
+
+        self.assertEqual(deleted, {
+            'recipes': 3, 'tags': 1, 'ingredients': 1, 'users': 1
+        })
+        self.assertEqual(list(Recipe.objects.all()), [kept])
+        self.assertFalse(Tag.objects.exists())
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+
+    def test_reap_user_without_tombstones(self):
+        """Test rows of a reaped user leave no tombstones"""
+        soft_delete_user(self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            Reaper().run()
+
+        self.assertFalse([
+            query for query in queries
+            if query['sql'].startswith('INSERT INTO "mainapp_tombstone"')
+        ])
+
+    def test_reap_command(self):
+        """Test the command reports its progress"""
+        soft_delete_recipes(Recipe.objects.filter(pk=self.recipes[0].pk))
+        out = StringIO()
+
+        call_command('reap_deleted', stdout=out)
+
+        self.assertIn('Deleted so far: 1 recipes', out.getvalue())
+        self.assertIn('Done: 1 recipes', out.getvalue())
+
+    def test_soft_delete_queues_reap_job(self):
+        """Test soft deletes queue one reap job, run by the workers"""
+        with self.captureOnCommitCallbacks(execute=True):
+            soft_delete_recipes(Recipe.objects.filter(pk=self.recipes[0].pk))
+        soft_delete_user(self.user)
+
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'mainapp.deletion.reap')
+        self.assertEqual(job.queue, 'deletes')
+
+        Worker(burst=True).run()
+
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_reap_job_queued_on_commit(self):
+        """Test the reap job isn't queued before the delete commits"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            soft_delete_recipes(Recipe.objects.filter(pk=self.recipes[0].pk))
+
+            self.assertFalse(Job.objects.exists())
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Job.objects.get().name, 'mainapp.deletion.reap')
+
+    def test_repair_ignores_deleted_recipes(self):
+        """Test recipe counts repaired don't count deleted recipes"""
+        soft_delete_recipes(Recipe.objects.filter(pk=self.recipes[0].pk))
+
+        call_command('repair_recipe_counts', stdout=StringIO())
+
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 2)
@@ -0,0 +1,209 @@
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from mainapp import jobs
+from mainapp.models import Job
+
+
+CALLS = []
+
+
+@jobs.task()
+def record(value):
+    """Task remembering its calls"""
+    CALLS.append(value)
+
+
+@jobs.task(queue='limited', max_attempts=2)
+def explode():
+    """Task that always fails"""
+    raise RuntimeError('Boom')
+
+
+@jobs.task()
+def outlive_lock():
+    """Task running longer than JOB_LOCK_TIMEOUT, it remembers how many
+       jobs were taken as lost meanwhile"""
+    time.sleep(0.5)
+    CALLS.append(jobs.requeue_lost())
+
+
+def not_a_task():
+    pass
+
+
+class JobTests(TestCase):
+    """Test queueing, claiming and running jobs"""
+
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueue_and_run(self):
+        """Test a job runs its task with its arguments, then is deleted"""
+        job = jobs.enqueue(record, value=1)
+
+        claimed = jobs.claim('worker')
+
+        self.assertEqual(claimed, job)
+        self.assertEqual(claimed.status, Job.RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertTrue(jobs.run_job(claimed))
+        self.assertEqual(CALLS, [1])
+        self.assertFalse(Job.objects.exists())
+        self.assertIsNone(jobs.claim('worker'))
+
+    def test_enqueue_not_a_task(self):
+        """Test only tasks can be queued"""
+        with self.assertRaises(ValueError):
+            jobs.enqueue(not_a_task)
+
+    def test_enqueue_unique(self):
+        """Test unique jobs are not queued twice"""
+        first = jobs.enqueue(record, unique=True, value=1)
+
+        self.assertEqual(jobs.enqueue(record, unique=True, value=1), first)
+        self.assertNotEqual(jobs.enqueue(record, unique=True, value=2),
+                            first)
+
+    def test_priority_and_delay(self):
+        """Test higher priorities run first, delayed jobs wait"""
+        low = jobs.enqueue(record, value=1)
+        high = jobs.enqueue(record, priority=10, value=2)
+        jobs.enqueue(record, priority=20, delay=60, value=3)
+
+        self.assertEqual(jobs.claim('worker'), high)
+        self.assertEqual(jobs.claim('worker'), low)
+        self.assertIsNone(jobs.claim('worker'))
+
+    def test_queues(self):
+        """Test workers only take jobs of their queues"""
+        job = jobs.enqueue(explode)
+        jobs.enqueue(record, value=1)
+
+        self.assertEqual(jobs.claim('worker', ['limited']), job)
+        self.assertIsNone(jobs.claim('worker', ['limited']))
+
+    def test_retry_with_backoff(self):
+        """Test failed jobs are retried later, until no attempt is left"""
+        jobs.enqueue(explode)
+
+        self.assertFalse(jobs.run_job(jobs.claim('worker')))
+
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('RuntimeError: Boom', job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        self.assertIsNone(jobs.claim('worker'))
+
+        Job.objects.update(run_at=timezone.now())
+        jobs.run_job(jobs.claim('worker'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNotNone(job.finished_at)
+
+    @override_settings(JOB_QUEUE_CONCURRENCY={'limited': 1})
+    def test_queue_concurrency(self):
+        """Test a queue doesn't run more jobs at once than its limit"""
+        first = jobs.enqueue(explode)
+        jobs.enqueue(explode)
+        other = jobs.enqueue(record, value=1)
+
+        self.assertEqual(jobs.claim('worker', ['limited']), first)
+        self.assertIsNone(jobs.claim('worker', ['limited']))
+        self.assertEqual(jobs.claim('worker'), other)
+
+    def test_requeue_lost(self):
+        """Test jobs of dead workers are queued again"""
+        jobs.enqueue(record, value=1)
+        jobs.claim('worker')
+        Job.objects.update(locked_at=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(jobs.requeue_lost(), 1)
+
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('worker', job.last_error)
+
+    def test_lost_job_left_to_new_claim(self):
+        """Test a worker whose job was taken as lost doesn't delete the row
+           claimed by another worker"""
+        jobs.enqueue(record, value=1)
+        first = jobs.claim('worker1')
+        Job.objects.update(locked_at=timezone.now() - timedelta(days=1))
+        jobs.requeue_lost()
+        Job.objects.update(run_at=timezone.now())
+        second = jobs.claim('worker2')
+
+        self.assertTrue(jobs.run_job(first))
+
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.locked_by),
+                         (Job.RUNNING, 'worker2'))
+        self.assertTrue(jobs.run_job(second))
+        self.assertFalse(Job.objects.exists())
+
+    def test_run_workers_command(self):
+        """Test the command runs the queued jobs"""
+        job = jobs.enqueue(record, value=1)
+        out = StringIO()
+
+        call_command('run_workers', burst=True, threads=1, stdout=out)
+
+        self.assertEqual(CALLS, [1])
+        self.assertIn(f'Job {job.pk} mainapp.tests.test_jobs.record: done',
+                      out.getvalue())
+
+
+class WorkerThreadsTests(TransactionTestCase):
+    """Test threads of a worker, each with its own connection"""
+
+    def test_every_job_runs_once(self):
+        """Test jobs are shared between threads without running twice"""
+        CALLS.clear()
+        for value in range(20):
+            jobs.enqueue(record, value=value)
+
+        jobs.Worker(threads=4, burst=True).run()
+
+        self.assertEqual(sorted(CALLS), list(range(20)))
+        self.assertFalse(Job.objects.exists())
+
+    def test_enqueue_unique_concurrently(self):
+        """Test unique jobs enqueued by concurrent transactions are queued
+           once"""
+        def enqueue():
+            try:
+                with transaction.atomic():
+                    jobs.enqueue(record, unique=True, value=1)
+                    time.sleep(0.2)  # the other thread checks meanwhile
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=enqueue) for _ in range(2)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Job.objects.count(), 1)
+
+    @override_settings(JOB_HEARTBEAT_INTERVAL=0.05, JOB_LOCK_TIMEOUT=0.2)
+    def test_heartbeat(self):
+        """Test a job running longer than JOB_LOCK_TIMEOUT isn't taken as
+           lost while its worker is alive"""
+        CALLS.clear()
+        jobs.enqueue(outlive_lock)
+
+        jobs.Worker(burst=True).run()
+
+        self.assertEqual(CALLS, [0])
+        self.assertFalse(Job.objects.exists())
@@ -0,0 +1,141 @@
+import gzip
+from unittest.mock import patch
+
+import brotli
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from mainapp import middleware
+from mainapp.models import Tag
+
+
+CONTENT = b'{"name":"Sample"}' * 100
+
+
+def get_response(content=CONTENT, etag=None):
+    """Return a view function returning the given content"""
+    def view(request):
+        response = HttpResponse(content, content_type='application/json')
+        if etag:
+            response['ETag'] = etag
+        return response
+    return view
+
+
+class AcceptEncodingTests(TestCase):
+    """Test negotiation of the response encoding"""
+
+    def test_brotli_preferred(self):
+        """Test brotli is chosen when both encodings are accepted"""
+        self.assertEqual(middleware.choose_encoding('gzip, deflate, br'), 'br')
+
+    def test_quality_values(self):
+        """Test quality values of the client are respected"""
+        self.assertEqual(middleware.choose_encoding('gzip, br;q=0.5'), 'gzip')
+        self.assertEqual(middleware.choose_encoding('*;q=0.1'), 'br')
+        self.assertIsNone(middleware.choose_encoding('gzip;q=0, br;q=0'))
+        self.assertIsNone(middleware.choose_encoding('identity'))
+        self.assertIsNone(middleware.choose_encoding(''))
+
+    def test_gzip_without_brotli(self):
+        """Test only gzip is offered when brotli is not installed"""
+        with patch.object(middleware, 'brotli', None):
+            self.assertEqual(middleware.choose_encoding('br, gzip'), 'gzip')
+            self.assertIsNone(middleware.choose_encoding('br'))
+
+
+class CompressionMiddlewareTests(TestCase):
+    """Test compression of responses"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        cache.clear()
+
+    def _process(self, view, accept='gzip, br'):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING=accept)
+        return middleware.CompressionMiddleware(view)(request)
+
+    def test_compress_gzip(self):
+        """Test responses are compressed with gzip"""
+        response = self._process(get_response(), accept='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), CONTENT)
+        self.assertEqual(response['Content-Length'],
+                         str(len(response.content)))
+
+    def test_compress_brotli(self):
+        """Test responses are compressed with brotli"""
+        response = self._process(get_response())
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), CONTENT)
+
+    def test_small_response_not_compressed(self):
+        """Test responses below the size threshold are not compressed"""
+        with override_settings(COMPRESSION_MIN_SIZE=len(CONTENT) + 1):
+            response = self._process(get_response())
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, CONTENT)
+
+    def test_not_accepted_not_compressed(self):
+        """Test responses are not compressed if the client can't read it"""
+        response = self._process(get_response(), accept='identity')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_streaming_response(self):
+        """Test streamed responses are compressed piece by piece"""
+        pieces = [b'[', CONTENT, b',', CONTENT, b']']
+
+        def view(request):
+            return StreamingHttpResponse(iter(pieces))
+
+        response = self._process(view, accept='gzip')
+        compressed = list(response.streaming_content)
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(compressed), len(pieces) + 1)
+        self.assertEqual(gzip.decompress(b''.join(compressed)),
+                         b''.join(pieces))
+
+    def test_compressed_body_cached_by_etag(self):
+        """Test compressed bodies of responses with an ETag are cached"""
+        view = get_response(etag='"abc"')
+
+        with patch.object(middleware, 'compress',
+                          wraps=middleware.compress) as compress:
+            first = self._process(view)
+            second = self._process(view)
+
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second['ETag'], 'W/"abc"')
+
+    def test_api_response_compressed(self):
+        """Test API responses get an ETag and are compressed"""
+        user = get_user_model().objects.create_user(
+            'testt@gmail.com',
+            'Test1234'
+        )
+        for i in range(20):
+            Tag.objects.create(user=user, name=f'Tag number {i}')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get(
+            reverse('recipe:tag-list'), HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertIn(b'Tag number 19', gzip.decompress(response.content))
@@ -0,0 +1,105 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from mainapp.models import Tag, Ingredient, Recipe
+from mainapp.testing import create_sample_recipe, create_user
+
+
+class RecipeCountTests(TestCase):
+    """Test recipe_count of tags and ingredients is kept exact"""
+    # the reaper and the commands visit every shard (DB_SHARDS)
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = create_user('test@gmail.com', 'Test1234')
+        self.tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        self.tag2 = Tag.objects.create(user=self.user, name='Dessert')
+        self.ingredient = Ingredient.objects.create(
+            user=self.user, name='Salt'
+        )
+        self.recipe = create_sample_recipe(self.user)
+
+    def assertCounts(self, tag1, tag2):
+        self.tag1.refresh_from_db()
+        self.tag2.refresh_from_db()
+        self.assertEqual(
+            (self.tag1.recipe_count, self.tag2.recipe_count), (tag1, tag2)
+        )
+
+    def test_add_and_remove(self):
+        """Test adding and removing tags of a recipe"""
+        self.recipe.tags.add(self.tag1, self.tag2)
+        self.recipe.tags.add(self.tag1)  # already added, not counted twice
+        self.assertCounts(1, 1)
+
+        create_sample_recipe(self.user).tags.add(self.tag1)
+        self.assertCounts(2, 1)
+
+        self.recipe.tags.remove(self.tag1)
+        self.recipe.tags.remove(self.tag1)  # already removed
+        self.assertCounts(1, 1)
+
+    def test_set_and_clear(self):
+        """Test replacing and clearing tags of a recipe"""
+        self.recipe.tags.set([self.tag1])
+        self.recipe.tags.set([self.tag2])
+        self.assertCounts(0, 1)
+
+        self.recipe.tags.clear()
+        self.assertCounts(0, 0)
+
+    def test_reverse_relation(self):
+        """Test changing recipes of a tag"""
+        recipe2 = create_sample_recipe(self.user)
+
+        self.tag1.recipe_set.add(self.recipe, recipe2)
+        self.assertCounts(2, 0)
+
+        self.tag1.recipe_set.remove(recipe2)
+        self.assertCounts(1, 0)
+
+        self.tag1.recipe_set.clear()
+        self.assertCounts(0, 0)
+
+    def test_delete_recipe(self):
+        """Test deleting recipes decreases counts of their tags"""
+        self.recipe.tags.add(self.tag1)
+        self.recipe.ingredients.add(self.ingredient)
+        create_sample_recipe(self.user).tags.add(self.tag1)
+
+        self.recipe.delete()
+        self.assertCounts(1, 0)
+        self.ingredient.refresh_from_db()
+        self.assertEqual(self.ingredient.recipe_count, 0)
+
+        Recipe.objects.all().delete()
+        self.assertCounts(0, 0)
+
+    def test_concurrent_removals(self):
+        """Test a relation removed twice leaves the count at 0 instead of
+           failing"""
+        self.recipe.tags.add(self.tag1)
+        # another request removed the relation meanwhile
+        Tag.objects.filter(pk=self.tag1.pk).update(recipe_count=0)
+
+        self.recipe.tags.remove(self.tag1)
+
+        self.assertCounts(0, 0)
+
+    def test_repair_command(self):
+        """Test the repair command fixes drifted counts"""
+        self.recipe.tags.add(self.tag1)
+        self.recipe.ingredients.add(self.ingredient)
+        Tag.objects.update(recipe_count=7)
+        out = StringIO()
+
+        call_command('repair_recipe_counts', dry_run=True, stdout=out)
+        self.assertIn('Tag: 2 recipe counts drifted', out.getvalue())
+        self.assertCounts(7, 7)
+
+        call_command('repair_recipe_counts', batch_size=1, stdout=out)
+        self.assertIn('Tag: 2 recipe counts repaired', out.getvalue())
+        self.assertIn('Ingredient: 0 recipe counts repaired', out.getvalue())
+        self.assertCounts(1, 0)
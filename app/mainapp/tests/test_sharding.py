@@ -0,0 +1,349 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+
+from mainapp import sharding
+from mainapp.checks import check_shard_ids
+from mainapp.deletion import Reaper, soft_delete_recipes, soft_delete_user
+from mainapp.models import Tag, Ingredient, Recipe, RecipeSignature, \
+    Tombstone
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user, detail_url
+)
+
+
+# these tests need another database, ie. DB_SHARDS=shard1:1 python
+# manage.py test (it's created by the test runner, like the default one)
+SHARD = next(
+    (alias for alias in settings.DATABASES if alias != 'default'), None
+)
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+SYNC_URL = reverse('recipe:sync')
+
+
+class PlacementTests(TestCase):
+    """Test placing users without other shards"""
+
+    def test_default_shard(self):
+        """Test new users are placed on the default database"""
+        user = create_user()
+
+        self.assertEqual(user.shard, 'default')
+
+    def test_place_is_stable(self):
+        """Test a user is always placed on the same shard"""
+        with self.settings(DB_SHARDS_FOR_NEW_USERS=['a', 'b', 'c']):
+            shards = {sharding.place(f'user{i}@gmail.com') for i in range(20)}
+
+            self.assertEqual(shards, {'a', 'b', 'c'})
+            self.assertEqual(sharding.place('Test@gmail.com'),
+                             sharding.place('test@gmail.com'))
+
+
+class IdSequenceTests(TestCase):
+    """Test ids are numbered for shards without other shards too"""
+
+    def test_id_sequences(self):
+        """Test the default database steps its ids by the stride"""
+        user = create_user()
+        tags = [Tag.objects.create(user=user, name=name)
+                for name in ('Vegan', 'Dessert')]
+
+        self.assertTrue(sharding.has_id_sequences('default'))
+        self.assertEqual(tags[1].pk - tags[0].pk,
+                         settings.DB_SHARD_ID_STRIDE)
+
+
+class ShardIdCheckTests(SimpleTestCase):
+    """Test the check of the shard ids"""
+
+    def errors(self, shard_ids):
+        with self.settings(DB_SHARD_IDS=shard_ids):
+            return [error.id for error in check_shard_ids(None)]
+
+    def test_own_ids(self):
+        """Test shards with their own ids pass"""
+        self.assertEqual(self.errors({'default': 0, 'a': 2, 'b': 1}), [])
+
+    def test_shared_id(self):
+        """Test two shards can't have the same id"""
+        self.assertEqual(self.errors({'default': 0, 'a': 1, 'b': 1}),
+                         ['mainapp.E002'])
+
+    def test_id_too_large(self):
+        """Test shard ids are below the stride of the ids"""
+        self.assertEqual(
+            self.errors({'default': 0, 'a': settings.DB_SHARD_ID_STRIDE}),
+            ['mainapp.E001']
+        )
+
+
+@skipUnless(SHARD, 'needs another database (DB_SHARDS)')
+@override_settings(DB_SHARDS_FOR_NEW_USERS=[SHARD])
+class ShardedApiTests(AuthenticatedClientMixin, TestCase):
+    """Test the recipe API of users placed on another shard"""
+    databases = '__all__'
+
+    def test_new_user(self):
+        """Test the user is kept on the default database, with a
+           placeholder on its shard"""
+        self.assertEqual(self.user.shard, SHARD)
+        placeholder = get_user_model().objects.using(SHARD).get(
+            pk=self.user.pk
+        )
+        self.assertFalse(placeholder.is_active)
+        self.assertFalse(placeholder.has_usable_password())
+
+    def test_rows_on_shard(self):
+        """Test created rows are written to and read from the shard"""
+        tag = self.client.post(TAGS_URL, {'name': 'Vegan'}).data
+        response = self.client.post(RECIPES_URL, {
+            'title': 'Cake', 'time_minutes': 10, 'price': '5.00',
+            'tags': [tag['id']], 'ingredients': []
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe_id = response.data['id']
+
+        self.assertFalse(Recipe.objects.using('default').exists())
+        recipe = Recipe.objects.using(SHARD).get(pk=recipe_id)
+        self.assertEqual(list(recipe.tags.values_list('id', flat=True)),
+                         [tag['id']])
+        self.assertEqual(recipe.user, self.user)
+        self.assertEqual(
+            Tag.objects.using(SHARD).get(pk=tag['id']).recipe_count, 1
+        )
+
+        detail = self.client.get(detail_url(recipe_id)).data
+        self.assertEqual(detail['tags'][0]['name'], 'Vegan')
+        streamed = self.client.get(RECIPES_URL, {'stream': 1})
+        self.assertIn(b'"title":"Cake"', b''.join(streamed))
+        self.assertEqual(
+            [row['id'] for row in self.client.get(SYNC_URL).data['recipes']],
+            [recipe_id]
+        )
+
+    def test_delete_on_shard(self):
+        """Test recipes of the shard are soft deleted and reaped there"""
+        with sharding.use_shard(SHARD):
+            recipe = create_sample_recipe(self.user)
+
+        response = self.client.delete(detail_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        Reaper().run()
+        self.assertFalse(Recipe.objects.using(SHARD).exists())
+        self.assertTrue(Tombstone.objects.using(SHARD).exists())
+
+    def test_reap_user(self):
+        """Test a deleted user is deleted from the shard too"""
+        with sharding.use_shard(SHARD):
+            create_sample_recipe(self.user).tags.add(
+                Tag.objects.create(user=self.user, name='Vegan')
+            )
+        soft_delete_user(self.user)
+
+        Reaper().run()
+
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(get_user_model().objects.using(SHARD).exists())
+        self.assertFalse(Tag.objects.using(SHARD).exists())
+
+    def test_read_only_while_moving(self):
+        """Test changes are rejected while the user is being moved"""
+        self.user.shard_readonly = True
+
+        response = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'],
+                         str(settings.SHARD_MOVE_GRACE))
+        self.assertEqual(self.client.get(TAGS_URL).status_code,
+                         status.HTTP_200_OK)
+
+    def test_unique_ids(self):
+        """Test ids are unique over all shards"""
+        stride = settings.DB_SHARD_ID_STRIDE
+        other = create_user('other@gmail.com', 'Test1234', shard='default')
+        tag = Tag.objects.create(user=other, name='Vegan')
+        with sharding.use_shard(SHARD):
+            sharded = Tag.objects.create(user=self.user, name='Vegan')
+
+        self.assertEqual(tag.pk % stride, 1)
+        self.assertEqual(
+            sharded.pk % stride,
+            (settings.DB_SHARD_IDS[SHARD] + 1) % stride
+        )
+
+
+@skipUnless(SHARD, 'needs another database (DB_SHARDS)')
+@override_settings(SHARD_MOVE_GRACE=0, RECIPE_SYNC_OVERLAP=0)
+class UserMoveTests(AuthenticatedClientMixin, TestCase):
+    """Test moving a user to another shard"""
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self.recipes = [
+            create_sample_recipe(self.user, title=f'Recipe {i}')
+            for i in range(3)
+        ]
+        for recipe in self.recipes:
+            recipe.tags.add(self.tag)
+            recipe.ingredients.add(self.salt)
+        soft_delete_recipes(Recipe.objects.filter(pk=self.recipes[2].pk))
+
+    def test_move(self):
+        """Test every row is moved with its id and the API shows the same
+           recipes afterwards"""
+        before = self.client.get(RECIPES_URL).data
+        out = StringIO()
+
+        call_command('move_user_shard', self.user.email, SHARD, stdout=out)
+
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.shard, self.user.shard_readonly),
+                         (SHARD, False))
+        self.assertIn(f'from default to {SHARD}', out.getvalue())
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(RECIPES_URL).data, before)
+        # the deleted recipe and the similarity index are moved too
+        self.assertIsNotNone(
+            Recipe.objects.using(SHARD).get(pk=self.recipes[2].pk).deleted_at
+        )
+        self.assertEqual(RecipeSignature.objects.using(SHARD).count(), 3)
+        self.assertEqual(Tombstone.objects.using(SHARD).count(), 1)
+        # nothing is left behind, except the user itself
+        for model in (Tag, Ingredient, Recipe, RecipeSignature, Tombstone):
+            self.assertFalse(model.objects.using('default').exists())
+        self.assertTrue(get_user_model().objects.filter(
+            pk=self.user.pk
+        ).exists())
+
+    def test_changes_during_move(self):
+        """Test changes made while rows are copied are moved too"""
+        changes = []
+
+        def change(copied):
+            """Another request changes rows after the first pass"""
+            if changes:
+                return
+            changes.append(copied)
+            self.tag.refresh_from_db()
+            self.tag.name = 'Vegetarian'
+            self.tag.save()
+            self.recipes[0].ingredients.remove(self.salt)
+            soft_delete_recipes(Recipe.objects.filter(pk=self.recipes[1].pk))
+            self.salt.delete()
+            changes.append(create_sample_recipe(self.user, title='New'))
+
+        sharding.UserMove(self.user, SHARD, progress=change).run()
+
+        with sharding.use_shard(SHARD):
+            self.assertEqual(Tag.objects.get().name, 'Vegetarian')
+            self.assertFalse(Ingredient.objects.exists())
+            self.assertFalse(self.recipes[0].ingredients.exists())
+            self.assertEqual(
+                set(Recipe.objects.filter(
+                    deleted_at__isnull=True
+                ).values_list('title', flat=True)),
+                {'Recipe 0', 'New'}
+            )
+            self.assertEqual(Tombstone.objects.count(), 3)
+
+    def test_move_back(self):
+        """Test a user can be moved back, ids don't collide with new rows"""
+        sharding.UserMove(self.user, SHARD).run()
+        self.user.refresh_from_db()
+        sharding.UserMove(self.user, 'default').run()
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.shard, 'default')
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 3)
+        self.assertFalse(get_user_model().objects.using(SHARD).exists())
+        tag = Tag.objects.create(user=self.user, name='New')
+        self.assertNotEqual(tag.pk, self.tag.pk)
+
+    def test_move_keeps_updated_at(self):
+        """Test moved rows keep their times, so syncs don't resend them"""
+        updated_at = Recipe.objects.get(pk=self.recipes[0].pk).updated_at
+
+        sharding.UserMove(self.user, SHARD).run()
+
+        self.assertEqual(
+            Recipe.objects.using(SHARD).get(pk=self.recipes[0].pk).updated_at,
+            updated_at
+        )
+
+    def test_move_without_id_sequences(self):
+        """Test moving fails if a shard's ids may collide with others"""
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER SEQUENCE mainapp_tag_id_seq INCREMENT 1')
+
+        with self.assertRaisesMessage(CommandError, 'migrate --database'):
+            call_command('move_user_shard', self.user.email, SHARD,
+                         stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.shard, 'default')
+
+    def test_invalid_target(self):
+        """Test moving to an unknown or the current shard fails"""
+        for shard in ('nope', 'default'):
+            with self.assertRaises(Exception):
+                call_command('move_user_shard', self.user.email, shard,
+                             stdout=StringIO())
+
+
+@skipUnless(SHARD, 'needs another database (DB_SHARDS)')
+class ShardAdminTests(TestCase):
+    """Test the admin of the rows of a shard"""
+    databases = '__all__'
+
+    def setUp(self):
+        admin_user = get_user_model().objects.create_superuser(
+            email='admin@gmail.com',
+            password='admin1234'
+        )
+        self.client.force_login(admin_user)
+        self.user = create_user(shard=SHARD)
+        with sharding.use_shard(SHARD):
+            self.tag = Tag.objects.create(user=self.user, name='Vegan')
+            self.recipe = create_sample_recipe(self.user, title='Cake')
+            self.recipe.tags.add(self.tag)
+
+    def test_changelist(self):
+        """Test the rows of the shard are listed on its admin site"""
+        response = self.client.get(
+            reverse(f'admin-{SHARD}:mainapp_recipe_changelist')
+        )
+
+        self.assertContains(response, 'Cake')
+        self.assertNotContains(
+            self.client.get(reverse('admin:mainapp_recipe_changelist')),
+            'Cake'
+        )
+
+    def test_change(self):
+        """Test a row of the shard is changed on the shard"""
+        url = reverse(f'admin-{SHARD}:mainapp_tag_change',
+                      args=[self.tag.pk])
+
+        response = self.client.post(url, {
+            'name': 'Vegetarian', 'user': self.user.pk, 'recipe_count': 1
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            Tag.objects.using(SHARD).get(pk=self.tag.pk).name, 'Vegetarian'
+        )
@@ -0,0 +1,81 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, override_settings
+
+from mainapp import startup
+
+
+IMPORTTIME = '''\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |     django.utils.version
+import time:       250 |        350 |   django.apps
+import time:        50 |        400 | django
+import time:       300 |        300 | PIL
+'''
+
+
+def sample_run(total, deferred=()):
+    return {
+        'phases': {'setup': 0.2, 'middleware': 0.01, 'urls': 0.05,
+                   'total': total},
+        'apps': {'mainapp.models': 0.02, 'mainapp.ready': 0.001},
+        'packages': {'django': 0.15, 'rest_framework': 0.03},
+        'deferred': list(deferred),
+    }
+
+
+class StartupTests(SimpleTestCase):
+    """Test profiling the startup of the application"""
+
+    def test_parse_importtime(self):
+        """Test import times are added up per top level package"""
+        self.assertEqual(
+            startup.parse_importtime(IMPORTTIME),
+            {'django': 400, 'PIL': 300}
+        )
+
+    def test_summarize(self):
+        """Test the median of the runs is taken"""
+        runs = [sample_run(0.5), sample_run(0.9, ['PIL']), sample_run(0.6)]
+
+        summary = startup.summarize(runs)
+
+        self.assertEqual(summary['phases']['total'], 0.6)
+        self.assertEqual(summary['deferred'], ['PIL'])
+
+    def test_deferred_modules_not_imported(self):
+        """Test starting a worker imports no deferred module (Pillow is
+           only needed to validate uploaded images)"""
+        result = startup.profile(['PIL'])
+
+        self.assertEqual(result['deferred'], [])
+        self.assertIn('mainapp.ready', result['apps'])
+        self.assertGreater(result['packages']['django'], 0)
+
+    @override_settings(STARTUP_DEFERRED_MODULES=('PIL',))
+    def test_command_check(self):
+        """Test --check fails when a deferred module is imported"""
+        out = StringIO()
+        with patch('mainapp.startup.profile',
+                   return_value=sample_run(0.5, ['PIL'])):
+            call_command('profile_startup', repeat=1, stdout=out)
+
+            with self.assertRaisesMessage(CommandError, 'PIL'):
+                call_command('profile_startup', repeat=1, check=True,
+                             stdout=StringIO())
+
+        self.assertIn('median of 1 runs): 500.0 ms', out.getvalue())
+        self.assertIn('mainapp.models', out.getvalue())
+
+    def test_command_budget(self):
+        """Test --budget fails when the startup takes longer"""
+        with patch('mainapp.startup.profile', return_value=sample_run(0.5)):
+            call_command('profile_startup', repeat=1, budget=1,
+                         stdout=StringIO())
+
+            with self.assertRaisesMessage(CommandError, 'over 0.4s'):
+                call_command('profile_startup', repeat=1, budget=0.4,
+                             stdout=StringIO())
@@ -0,0 +1,171 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from mainapp import throttling
+
+
+TAGS_URL = reverse('recipe:tag-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+CREATE_USER_URL = reverse('user:create')
+
+RATES = {
+    'anon': '100/min',
+    'user': '100/min',
+    'token': '100/min',
+    'recipes': '100/min',
+    'uploads': '100/min',
+}
+
+
+def rates(**params):
+    """Return throttling settings with the given rates changed"""
+    return {
+        'DEFAULT_THROTTLE_RATES': dict(RATES, **params),
+    }
+
+
+class ThrottlingTestCase(TestCase):
+    """Every test uses its own shared bucket file"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'throttle.bin')
+        path_override = override_settings(THROTTLE_STORE_PATH=self.path)
+        path_override.enable()
+        self.addCleanup(path_override.disable)
+
+
+class SharedBucketStoreTests(ThrottlingTestCase):
+    """Test token buckets of the memory mapped store"""
+
+    def test_take_and_refill(self):
+        """Test a bucket empties and refills over time"""
+        store = throttling.SharedBucketStore(self.path, 64)
+
+        results = [store.take('user', '1', 2, 1.0, now=100.0)
+                   for _ in range(3)]
+        self.assertEqual(
+            results, [(True, 0.0), (True, 0.0), (False, 1.0)]
+        )
+
+        self.assertEqual(store.take('user', '1', 2, 1.0, now=100.5),
+                         (False, 0.5))
+        self.assertEqual(store.take('user', '1', 2, 1.0, now=101.0),
+                         (True, 0.0))
+        # other keys have their own bucket
+        self.assertTrue(store.take('user', '2', 2, 1.0, now=101.0)[0])
+        self.assertEqual(store.count('checked:user'), 6)
+        self.assertEqual(store.count('throttled:user'), 2)
+
+    def test_shared_between_instances(self):
+        """Test buckets are shared through the file, ie. by workers"""
+        first = throttling.SharedBucketStore(self.path, 64)
+        second = throttling.SharedBucketStore(self.path, 64)
+
+        first.take('user', '1', 1, 1.0, now=100.0)
+
+        self.assertFalse(second.take('user', '1', 1, 1.0, now=100.0)[0])
+
+    def test_full_table_reuses_oldest_slot(self):
+        """Test the least recently updated bucket is reused when full"""
+        store = throttling.SharedBucketStore(self.path, 2)
+
+        for key in range(10):
+            store.take('user', str(key), 1, 1.0, now=float(key))
+
+        self.assertTrue(store.take('user', '10', 1, 1.0, now=10.0)[0])
+
+
+class ThrottlingApiTests(ThrottlingTestCase):
+    """Test throttling of API requests"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(
+            'testt@gmail.com',
+            'Test1234'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(REST_FRAMEWORK=rates(user='2/min'))
+    def test_user_throttled(self):
+        """Test requests over the user rate get 429 and Retry-After"""
+        for _ in range(2):
+            self.assertEqual(
+                self.client.get(TAGS_URL).status_code, status.HTTP_200_OK
+            )
+
+        response = self.client.get(TAGS_URL)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(throttling.throttle_counts('user'), (3, 1))
+
+    @override_settings(REST_FRAMEWORK=rates(recipes='1/min'))
+    def test_endpoint_throttled(self):
+        """Test the rate of an endpoint class leaves others alone"""
+        self.client.get(RECIPES_URL)
+
+        response = self.client.get(RECIPES_URL)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(
+            self.client.get(TAGS_URL).status_code, status.HTTP_200_OK
+        )
+
+    @override_settings(REST_FRAMEWORK=rates(token='1/min'))
+    def test_token_throttled(self):
+        """Test requests authenticated with a token use its bucket"""
+        client = APIClient()
+        token = Token.objects.create(user=self.user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        client.get(TAGS_URL)
+
+        response = client.get(TAGS_URL)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        # the user is not throttled without the token
+        self.assertEqual(
+            self.client.get(TAGS_URL).status_code, status.HTTP_200_OK
+        )
+
+    @override_settings(REST_FRAMEWORK=rates(anon='1/min'))
+    def test_anonymous_throttled(self):
+        """Test anonymous requests are throttled by IP address"""
+        client = APIClient()
+        client.post(CREATE_USER_URL, {})
+
+        response = client.post(CREATE_USER_URL, {})
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+
+    def test_stats_command(self):
+        """Test the command shows the counters of every rate"""
+        self.client.get(TAGS_URL)
+        out = StringIO()
+
+        call_command('throttle_stats', reset=True, stdout=out)
+
+        self.assertIn('user (1200/min): 1 checked, 0 throttled',
+                      out.getvalue())
+        self.assertEqual(throttling.throttle_counts('user'), (0, 0))
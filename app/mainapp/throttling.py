@@ -0,0 +1,253 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+# Token bucket throttling shared by all worker processes of a machine.
+#
+# Every limit ("100/min") is a bucket of 100 tokens refilled continuously
+# at 100 tokens per minute, a request takes one token and is throttled
+# when the bucket is empty. Buckets live in a memory mapped file, so every
+# check is a few memory reads and writes under a file lock (fcntl.flock)
+# instead of a round-trip to a cache server.
+#
+# The file is a header followed by a fixed number of slots (an open
+# addressing hash table): (key hash, tokens, last update time). A bucket
+# that wasn't used for a long time is full again, so when all probed slots
+# are taken the least recently updated one is reused. Counters of how often
+# each limit was checked and fired are kept in the same table.
+
+MAGIC = b'RCPTHRT1'
+HEADER = struct.Struct('<8sQ')  # magic, number of slots
+SLOT = struct.Struct('<Qdd')  # key hash, tokens (or count), updated at
+MAX_PROBES = 8
+
+
+def key_hash(key):
+    """Return the non zero 64 bit hash of a key (0 marks free slots)"""
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class SharedBucketStore:
+    """Token buckets and counters in a memory mapped file"""
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()  # flock doesn't exclude threads
+        self._pid = None
+        self._open()
+
+    def _open(self):
+        """(Re)open the file, ie. in a new process after a fork, where the
+           inherited file descriptor would share the lock of the parent"""
+        size = HEADER.size + SLOT.size * self.slots
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            if (os.fstat(fd).st_size != size or
+                    header != HEADER.pack(MAGIC, self.slots)):
+                # new file, or created with another number of slots
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, HEADER.pack(MAGIC, self.slots), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+        self._pid = os.getpid()
+
+    def _locked(self, function, *args):
+        """Call function(*args) holding both the thread and file lock"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                return function(*args)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, index):
+        return HEADER.size + SLOT.size * index
+
+    def _find(self, key, create=True):
+        """Return (offset, tokens, updated) of the slot of a key. A missing
+           key gets a free or the least recently updated slot, with
+           tokens and updated set to None"""
+        hashed = key_hash(key)
+        oldest = None
+        for probe in range(MAX_PROBES):
+            offset = self._offset((hashed + probe) % self.slots)
+            slot_hash, tokens, updated = SLOT.unpack_from(self._map, offset)
+            if slot_hash == hashed:
+                return offset, tokens, updated
+            if slot_hash == 0:
+                oldest = (offset, float('-inf'))
+                break
+            if oldest is None or updated < oldest[1]:
+                oldest = (offset, updated)
+        if create:
+            SLOT.pack_into(self._map, oldest[0], hashed, 0.0, 0.0)
+        return oldest[0], None, None
+
+    def _take(self, scope, key, capacity, refill_rate, now):
+        key = f'{scope}:{key}'
+        offset, tokens, updated = self._find(key)
+        if tokens is None:
+            tokens, updated = capacity, now
+        tokens = min(capacity, tokens + max(0.0, now - updated) * refill_rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        SLOT.pack_into(self._map, offset, key_hash(key), tokens, now)
+        self._increment(f'checked:{scope}', now)
+        if not allowed:
+            self._increment(f'throttled:{scope}', now)
+        wait = 0.0 if allowed else (1 - tokens) / refill_rate
+        return allowed, wait
+
+    def take(self, scope, key, capacity, refill_rate, now=None):
+        """Take a token from the bucket of key in scope and count the check,
+           return (allowed, wait) where wait is the number of seconds until
+           the next token"""
+        now = time.time() if now is None else now
+        return self._locked(
+            self._take, scope, key, capacity, refill_rate, now
+        )
+
+    def _increment(self, key, now):
+        offset, count, _ = self._find(key)
+        SLOT.pack_into(self._map, offset, key_hash(key), (count or 0) + 1,
+                       now)
+
+    def _count(self, key):
+        offset, count, _ = self._find(key, create=False)
+        return int(count or 0)
+
+    def count(self, key):
+        """Return the value of a counter"""
+        return self._locked(self._count, key)
+
+    def _clear(self):
+        size = SLOT.size * self.slots
+        self._map[HEADER.size:HEADER.size + size] = bytes(size)
+
+    def clear(self):
+        """Remove all buckets and counters"""
+        self._locked(self._clear)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    """Return the store of the configured file (one per process)"""
+    path, slots = settings.THROTTLE_STORE_PATH, settings.THROTTLE_STORE_SLOTS
+    with _stores_lock:
+        if (path, slots) not in _stores:
+            _stores[path, slots] = SharedBucketStore(path, slots)
+        return _stores[path, slots]
+
+
+def parse_rate(rate):
+    """Return (capacity, refill rate per second) of a rate like '100/min'"""
+    number, period = rate.split('/')
+    seconds = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}[period[0]]
+    return int(number), int(number) / seconds
+
+
+def throttle_counts(scope):
+    """Return (checked, throttled) counters of a scope"""
+    store = get_store()
+    return store.count(f'checked:{scope}'), store.count(f'throttled:{scope}')
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Base class of token bucket throttles. Subclasses give the scope
+       (the name of the rate in DEFAULT_THROTTLE_RATES) and the key of the
+       bucket of a request; requests without a key are not throttled."""
+    scope = None
+
+    def get_scope(self, view):
+        return self.scope
+
+    def get_cache_key(self, request, view):
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(view)
+        # rates are read on every request, so they can be changed in tests
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        key = self.get_cache_key(request, view) if rate else None
+        if key is None:
+            return True
+
+        capacity, refill_rate = parse_rate(rate)
+        allowed, self._wait = get_store().take(
+            scope, key, capacity, refill_rate
+        )
+        return allowed
+
+    def wait(self):
+        """Seconds until a request is allowed again, DRF returns it in the
+           Retry-After header of the 429 response"""
+        return getattr(self, '_wait', None)
+
+
+class AnonRateThrottle(TokenBucketThrottle):
+    """Limit anonymous requests per IP address"""
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.get_ident(request)
+
+
+class UserRateThrottle(TokenBucketThrottle):
+    """Limit requests per authenticated user, whatever token is used"""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return str(request.user.pk)
+        return None
+
+
+class TokenRateThrottle(TokenBucketThrottle):
+    """Limit requests per authentication token"""
+    scope = 'token'
+
+    def get_cache_key(self, request, view):
+        token = getattr(request.auth, 'key', None)
+        if token is None:
+            return None
+        # only a hash of the token is kept in the shared file
+        return hashlib.sha256(token.encode()).hexdigest()
+
+
+class EndpointRateThrottle(TokenBucketThrottle):
+    """Limit requests of a user (or IP address) per endpoint class, the
+       scope is the throttle_scope attribute of the view (it can be given
+       per action, ie. @action(..., throttle_scope='uploads'))"""
+
+    def get_scope(self, view):
+        return getattr(view, 'throttle_scope', None)
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
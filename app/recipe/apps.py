@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class RecipeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipe'
+
+    def ready(self):
+        # connects the signal receivers (ie. similarity index updates)
+        from recipe import signals  # noqa: F401
+        # system checks of the settings (ie. the cache of recipe details)
+        from recipe import checks  # noqa: F401
@@ -0,0 +1,123 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from mainapp import sharding
+from mainapp.models import Recipe
+
+
+# Cache of rendered recipe details (.../recipes/<id>/). Every recipe has a
+# version in the cache (a random token), deleted whenever the recipe or
+# one of its tags/ingredients changes (see recipe/signals.py) and created
+# again by the next request needing it. The cache is shared by every
+# process (RECIPE_CACHE_ALIAS, see recipe/checks.py). A cached detail
+# keeps the version it was rendered with and is only used while it's
+# current, both are read at once: a hit is one read of the cache.
+# Renaming a tag (or changing its recipe_count) looks up the recipes
+# showing it to outdate them. Versions are deleted right away and again
+# after the commit, so a detail rendered from data of the transaction in
+# between isn't used either.
+# On a miss, only the request holding the lock of the recipe renders and
+# stores it, concurrent requests wait (up to RECIPE_CACHE_LOCK_WAIT
+# seconds) for the result instead of rendering it too.
+
+POLL_INTERVAL = 0.02  # seconds between checks of a detail being rendered
+
+
+def _cache():
+    return caches[settings.RECIPE_CACHE_ALIAS]
+
+
+def version_key(pk):
+    """Return the key of the version of a recipe"""
+    return f'recipe-version:{pk}'
+
+
+def detail_key(pk):
+    return f'recipe-detail:{pk}'
+
+
+def _lock_key(pk):
+    return f'recipe-detail-lock:{pk}'
+
+
+def bump(kind, pks):
+    """Outdate the versions of the recipes of pks (kind 'recipe'), or of
+       the recipes of the tags/ingredients (kind 'tag', 'ingredient')"""
+    pks = list(pks)
+    if pks and kind != 'recipe':
+        through = getattr(Recipe, f'{kind}s').through
+        pks = through.objects.filter(**{
+            f'{kind}_id__in': pks
+        }).values_list('recipe_id', flat=True)
+    keys = [version_key(pk) for pk in pks]
+    if not keys:
+        return
+
+    def delete_versions():
+        # one query with a database cache, set_many() writes key by key
+        _cache().delete_many(keys)
+    delete_versions()
+    transaction.on_commit(delete_versions, using=sharding.current())
+
+
+def _version(cache, recipe_id):
+    """Return the version of a recipe, created if it's missing"""
+    key = version_key(recipe_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _lookup(cache, recipe_id):
+    """Return the cached entry of a recipe if it's up to date, else None"""
+    found = cache.get_many([detail_key(recipe_id), version_key(recipe_id)])
+    entry = found.get(detail_key(recipe_id))
+    version = found.get(version_key(recipe_id))
+    if entry is None or version is None or entry['version'] != version:
+        return None
+    return entry
+
+
+def _owned(entry, user_id):
+    return entry['data'] if entry['user_id'] == user_id else None
+
+
+def get_detail(recipe_id, user_id, render):
+    """Return the detail of a recipe of the user, from the cache or from
+       render() (the detail, or None if the user has no such recipe)"""
+    cache = _cache()
+    entry = _lookup(cache, recipe_id)
+    if entry is not None:
+        return _owned(entry, user_id)
+
+    lock = _lock_key(recipe_id)
+    if not cache.add(lock, 1, settings.RECIPE_CACHE_LOCK_TIMEOUT):
+        # another request is rendering it, wait for its result
+        deadline = time.monotonic() + settings.RECIPE_CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = _lookup(cache, recipe_id)
+            if entry is not None:
+                return _owned(entry, user_id)
+        return render()  # taking too long, render without storing
+
+    try:
+        # the version of the recipe is read before rendering, so changes
+        # of the recipe made meanwhile make the stored detail outdated
+        version = _version(cache, recipe_id)
+        data = render()
+        if data is not None:
+            cache.set(detail_key(recipe_id), {
+                'version': version,
+                'user_id': user_id,
+                'data': data,
+            }, settings.RECIPE_CACHE_TIMEOUT)
+    finally:
+        cache.delete(lock)
+    return data
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+# Cached recipe details are invalidated by replacing their versions in
+# the cache (recipe/caching.py). A cache of each process (LocMemCache)
+# only sees the changes made by its own process, the other ones would keep
+# returning outdated details, so it's refused.
+@checks.register(checks.Tags.caches)
+def check_recipe_cache(app_configs, **kwargs):
+    """Check the cache of recipe details is shared by all processes"""
+    alias = settings.RECIPE_CACHE_ALIAS
+    if isinstance(caches[alias], LocMemCache):
+        return [checks.Error(
+            f'RECIPE_CACHE_ALIAS ({alias!r}) is a cache of each process.',
+            hint='Use a cache shared by every process, ie. DatabaseCache '
+                 'or Memcached.',
+            id='recipe.E001',
+        )]
+    return []
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import select
+import threading
+import time
+
+import psycopg2
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+from mainapp import sharding
+
+
+# Changes of recipes, tags and ingredients are pushed to the clients of
+# their user (.../api/recipe/events/, see recipe/sse.py). Signal receivers
+# (recipe/signals.py) publish an event once the transaction that made the
+# change commits, with NOTIFY on the RECIPE_EVENTS_CHANNEL channel of
+# Postgres (the events of a transaction are sent together, with one
+# query). Every process runs one thread LISTENing to the channel, which
+# hands the events over to the open event streams of their user, however
+# many there are, without polling the database.
+
+# sent instead of events a client missed (its queue overflowed, or the
+# listener reconnected), the client has to sync (.../api/recipe/sync/)
+RESYNC = {'type': 'resync'}
+
+
+# NOTIFY payloads must be shorter than 8000 bytes
+MAX_PAYLOAD = 7900
+
+
+def publish(user_id, kind, pk, action):
+    """Send an event ('created', 'changed' or 'deleted') about a recipe,
+       tag or ingredient (kind) to the clients of the user, once the
+       current transaction is committed. The events of a transaction are
+       sent together, with one query."""
+    using = sharding.current()
+    conn = connections[using]
+    batch = getattr(conn, 'recipe_events', None)
+    if batch is None or not batch.pending(conn):
+        batch = conn.recipe_events = EventBatch()
+        batch.events.append((user_id, kind, pk, action))
+        # sent on the default database once the shard commits (right away
+        # outside of transactions)
+        transaction.on_commit(batch.send, using=using)
+    else:
+        batch.events.append((user_id, kind, pk, action))
+
+
+class EventBatch:
+    """Events of one transaction of a connection. Events of a savepoint
+       that is rolled back are sent too, clients only fetch what changed."""
+
+    def __init__(self):
+        self.events = []
+
+    def pending(self, conn):
+        """Return whether the batch will be sent by the commit of the
+           current transaction of conn (else it was sent or rolled back)"""
+        return conn.in_atomic_block and any(
+            hook[1] == self.send for hook in conn.run_on_commit
+        )
+
+    def payloads(self):
+        """Return the events as JSON lists of at most MAX_PAYLOAD bytes"""
+        payloads, chunk, size = [], [], 2
+        for user_id, kind, pk, action in self.events:
+            event = json.dumps({
+                'user': user_id, 'type': kind, 'id': pk, 'action': action
+            }, separators=(',', ':'))
+            if chunk and size + len(event) + 1 > MAX_PAYLOAD:
+                payloads.append('[' + ','.join(chunk) + ']')
+                chunk, size = [], 2
+            chunk.append(event)
+            size += len(event) + 1
+        if chunk:
+            payloads.append('[' + ','.join(chunk) + ']')
+        return payloads
+
+    def send(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_notify(%s, payload) FROM unnest(%s) AS payload',
+                [settings.RECIPE_EVENTS_CHANNEL, self.payloads()]
+            )
+
+
+class Subscription:
+    """Events of a user for one client, read by its event loop"""
+
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(settings.RECIPE_EVENTS_QUEUE_SIZE)
+
+    def push(self, event):
+        """Hand an event over to the event loop (from any thread)"""
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # the client is too slow, the missed events are replaced by
+            # a request to sync
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class EventHub:
+    """The listener of a process and the subscriptions it serves"""
+
+    def __init__(self):
+        self.subscriptions = {}  # user id -> set of Subscription
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.listening = threading.Event()  # set while LISTENing
+
+    def subscribe(self, user_id, loop):
+        """Return a new subscription to the events of a user"""
+        subscription = Subscription(user_id, loop)
+        with self.lock:
+            self.subscriptions.setdefault(user_id, set()).add(subscription)
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(
+                    target=self._listen, name='recipe-events', daemon=True
+                )
+                self.thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.user_id]
+
+    def dispatch(self, event):
+        """Push an event to the subscriptions of its user"""
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(event['user'], ()))
+        for subscription in subscriptions:
+            subscription.push(event)
+
+    def broadcast(self, event):
+        """Push an event to every subscription"""
+        with self.lock:
+            subscriptions = [
+                subscription
+                for subscriptions in self.subscriptions.values()
+                for subscription in subscriptions
+            ]
+        for subscription in subscriptions:
+            subscription.push(event)
+
+    def stop(self):
+        """Stop the listener (it's started again by the next subscribe)"""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _listen(self):
+        """LISTEN to the channel with a connection of its own, reconnect
+           after errors"""
+        first = True
+        while not self.stopping.is_set():
+            try:
+                conn = psycopg2.connect(
+                    **connections['default'].get_connection_params()
+                )
+            except psycopg2.Error:
+                time.sleep(1)
+                continue
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f'LISTEN "{settings.RECIPE_EVENTS_CHANNEL}"'
+                    )
+                if not first:  # events sent meanwhile are lost
+                    self.broadcast(RESYNC)
+                first = False
+                self.listening.set()
+                self._receive(conn)
+            except psycopg2.Error:
+                time.sleep(1)
+            finally:
+                self.listening.clear()
+                conn.close()
+
+    def _receive(self, conn):
+        while not self.stopping.is_set():
+            # wake up now and then to see if the hub was stopped
+            if select.select([conn], [], [], 1) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notification = conn.notifies.pop(0)
+                try:
+                    events = json.loads(notification.payload)
+                except ValueError:
+                    continue
+                for event in events:  # the events of one transaction
+                    self.dispatch(event)
+
+
+hub = EventHub()
@@ -0,0 +1,95 @@
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+
+from mainapp.sharding import use_shard
+from . import fast
+from .streaming import iter_row_chunks
+
+
+# Export of the whole recipe book of a user. Recipes are read from a
+# server-side cursor chunk by chunk, and the tag and ingredient names of
+# every chunk are fetched in bulk, so the memory used stays bounded
+# whatever the number of recipes is.
+
+EXPORT_FIELDS = (
+    'id', 'title', 'time_minutes', 'price', 'link', 'tags', 'ingredients'
+)
+
+EXPORT_TYPES = {
+    # type: (content type, file extension)
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# names in a csv cell are joined with this separator, ie. "Vegan|Dessert"
+CSV_NAMES_SEPARATOR = '|'
+
+
+def iter_export_records(queryset, chunk_size=None):
+    """Yield one dictionary per recipe, with names of tags/ingredients"""
+    for rows in iter_row_chunks(queryset, chunk_size):
+        recipe_ids = [row['id'] for row in rows]
+        with use_shard(queryset.db):
+            tags = fast.related_objects('tags', recipe_ids)
+            ingredients = fast.related_objects('ingredients', recipe_ids)
+        for row in rows:
+            yield {
+                'id': row['id'],
+                'title': row['title'],
+                'time_minutes': row['time_minutes'],
+                'price': fast.format_price(row['price']),
+                'link': row['link'],
+                'tags': [tag['name'] for tag in tags.get(row['id'], [])],
+                'ingredients': [
+                    ingredient['name']
+                    for ingredient in ingredients.get(row['id'], [])
+                ],
+            }
+
+
+def iter_ndjson(queryset, chunk_size=None):
+    """Yield the recipes as newline delimited JSON, one recipe per line"""
+    for record in iter_export_records(queryset, chunk_size):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        yield (line + '\n').encode('utf-8')
+
+
+class _Echo:
+    """File-like object that returns what is written instead of storing
+       it, so csv.writer can be used to produce lines one by one"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset, chunk_size=None):
+    """Yield the recipes as csv lines, starting with a header line"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS).encode('utf-8')
+    for record in iter_export_records(queryset, chunk_size):
+        record['tags'] = CSV_NAMES_SEPARATOR.join(record['tags'])
+        record['ingredients'] = CSV_NAMES_SEPARATOR.join(
+            record['ingredients']
+        )
+        yield writer.writerow(
+            [record[field] for field in EXPORT_FIELDS]
+        ).encode('utf-8')
+
+
+def export_response(queryset, export_type, chunk_size=None):
+    """Return a streamed (chunked transfer) export of the recipes"""
+    content_type, extension = EXPORT_TYPES[export_type]
+    iterator = iter_csv if export_type == 'csv' else iter_ndjson
+    # no Content-Length is set on streamed responses, so the server
+    # sends them with 'Transfer-Encoding: chunked'. The database is chosen
+    # now, while the shard of the request is set (mainapp/sharding.py)
+    response = StreamingHttpResponse(
+        iterator(queryset.using(queryset.db), chunk_size),
+        content_type=content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="recipes.{extension}"'
+    )
+    return response
@@ -0,0 +1,169 @@
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from mainapp import sharding
+from mainapp.models import Tag, Ingredient, Recipe
+from mainapp.signals import bump_recipe_counts
+from . import similarity, pantry, events
+from .serializers import RecipeImportSerializer
+from .streaming import chunked
+
+
+# Bulk import of newline delimited JSON recipes (one recipe per line, the
+# format of .../recipes/export/?type=ndjson). Lines are read one by one and
+# handled in batches: every batch is validated, the tag and ingredient names
+# are resolved with one query per relation, and the recipes and their
+# relations are written with bulk inserts in one transaction. Invalid lines
+# are reported and skipped, they never abort the import.
+
+# relation name -> (model of the relation, through table column)
+IMPORT_RELATIONS = {
+    'tags': (Tag, 'tag_id'),
+    'ingredients': (Ingredient, 'ingredient_id'),
+}
+
+
+class RecipeImporter:
+    """Import recipes of a user from NDJSON lines"""
+
+    def __init__(self, user, batch_size=None, offset=0, max_errors=None):
+        self.user = user
+        self.batch_size = batch_size or settings.RECIPE_IMPORT_BATCH_SIZE
+        self.offset = offset  # number of lines to skip (already imported)
+        self.max_errors = max_errors or settings.RECIPE_IMPORT_MAX_ERRORS
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.next_offset = offset
+
+    def run(self, lines, progress=None):
+        """Import the lines and return the result of the import. progress
+           (if given) is called after every batch with the result so far"""
+        numbered = (
+            (number, line) for number, line in enumerate(lines, start=1)
+            if number > self.offset
+        )
+        # the recipes are written to the shard of the user (the command
+        # runs outside of requests)
+        with sharding.use_shard(self.user.shard):
+            for batch in chunked(numbered, self.batch_size):
+                self._import_batch(batch)
+                # the batch is committed, an interrupted import can be
+                # resumed from here by passing next_offset as offset
+                self.next_offset = batch[-1][0]
+                if progress:
+                    progress(self.result())
+        return self.result()
+
+    def result(self):
+        """Return the summary of the import"""
+        return {
+            'imported': self.imported,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'next_offset': self.next_offset,
+        }
+
+    def _error(self, number, errors):
+        """Record errors of the given line"""
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': number, 'errors': errors})
+
+    def _validate(self, batch):
+        """Return (line number, validated data) of the valid lines"""
+        valid = []
+        for number, line in batch:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', errors='replace')
+            if not line.strip():
+                continue  # empty lines are allowed, ie. at the end of file
+            try:
+                data = json.loads(line)
+            except ValueError as error:
+                self._error(number, {'non_field_errors': [str(error)]})
+                continue
+            if not isinstance(data, dict):
+                self._error(
+                    number,
+                    {'non_field_errors': ['Expected a JSON object.']}
+                )
+                continue
+
+            serializer = RecipeImportSerializer(data=data)
+            if serializer.is_valid():
+                valid.append((number, serializer.validated_data))
+            else:
+                self._error(number, serializer.errors)
+        return valid
+
+    def _resolve_names(self, model, names):
+        """Return {name: id} of the user's objects with the given names,
+           objects that do not exist yet are created in bulk"""
+        ids = {}
+        existing = model.objects.filter(
+            user=self.user,
+            name__in=names
+        ).order_by('-id').values_list('name', 'id')
+        for name, pk in existing:
+            ids[name] = pk  # the oldest object wins if names are repeated
+        missing = [name for name in names if name not in ids]
+        created = model.objects.bulk_create(
+            model(user=self.user, name=name) for name in missing
+        )
+        ids.update((obj.name, obj.id) for obj in created)
+        for obj in created:  # no post_save signals
+            events.publish(self.user.id, model._meta.model_name, obj.id,
+                           'created')
+        return ids
+
+    def _import_batch(self, batch):
+        """Validate and write one batch of lines"""
+        valid = self._validate(batch)
+        if not valid:
+            return
+
+        with transaction.atomic(using=sharding.current()):
+            recipes = Recipe.objects.bulk_create(
+                Recipe(
+                    user=self.user,
+                    **{key: value for key, value in data.items()
+                       if key not in IMPORT_RELATIONS}
+                )
+                for number, data in valid
+            )
+            for relation, (model, column) in IMPORT_RELATIONS.items():
+                names = {
+                    name for number, data in valid
+                    for name in data.get(relation, [])
+                }
+                if not names:
+                    continue
+                ids = self._resolve_names(model, names)
+                through = getattr(Recipe, relation).through
+                rows = [
+                    through(recipe_id=recipe.id, **{column: related_id})
+                    for recipe, (number, data) in zip(recipes, valid)
+                    for related_id in {
+                        ids[name] for name in data.get(relation, [])
+                    }
+                ]
+                through.objects.bulk_create(rows)
+                # bulk inserts don't send m2m_changed signals
+                bump_recipe_counts(
+                    model, Counter(getattr(row, column) for row in rows),
+                    self.user.id
+                )
+                if relation == 'ingredients':
+                    pantry.ingredients_added(self.user.id, (
+                        (row.recipe_id, row.ingredient_id) for row in rows
+                    ))
+            # bulk inserts don't send post_save signals either
+            pantry.recipes_added(self.user.id, (r.id for r in recipes))
+            similarity.index_recipes(recipe.id for recipe in recipes)
+            for recipe in recipes:
+                events.publish(self.user.id, 'recipe', recipe.id, 'created')
+        self.imported += len(recipes)
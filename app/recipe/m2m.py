@@ -0,0 +1,95 @@
+from django.db import router, transaction
+from django.db.models import Value
+from django.db.models.signals import m2m_changed
+
+from mainapp.models import Recipe
+from . import similarity
+from .fast import RELATIONS
+
+
+# Replacing the tags/ingredients of a recipe (PUT/PATCH) with the minimal
+# set of writes. The current ids of every changed relation are read with
+# one UNION query, then each relation gets at most one DELETE of the
+# removed rows and one bulk INSERT of the added ones, in one transaction.
+# Nothing is written (and no signal is sent) for relations that didn't
+# change. m2m_changed signals are sent exactly like related managers send
+# them, with the ids that were really removed/added, so recipe counts and
+# the recipe indexes stay up to date. The similarity index is recomputed
+# once at the end instead of after every signal.
+
+
+def current_ids(recipe, relations):
+    """Return {relation: set of related ids} of a recipe with one query"""
+    queries = [
+        through.objects.filter(recipe_id=recipe.pk).annotate(
+            relation=Value(relation)
+        ).values_list('relation', f'{column}_id')
+        for relation, (through, column) in RELATIONS.items()
+        if relation in relations
+    ]
+    ids = {relation: set() for relation in relations}
+    if not queries:
+        return ids
+    query = queries[0]
+    if queries[1:]:
+        query = query.union(*queries[1:], all=True)
+    for relation, related_id in query:
+        ids[relation].add(related_id)
+    return ids
+
+
+def _send(through, recipe, action, model, pk_set, using):
+    m2m_changed.send(
+        sender=through, instance=recipe, action=action, reverse=False,
+        model=model, pk_set=pk_set, using=using
+    )
+
+
+def replace_related(recipe, related):
+    """Make the relations of a recipe exactly the given objects, ie.
+       {'tags': [tag1], 'ingredients': [...]}. Return {relation: (added
+       ids, removed ids)} of the relations that changed."""
+    using = router.db_for_write(Recipe, instance=recipe)
+    old = current_ids(recipe, related)
+    changes = {}
+    for relation, objects in related.items():
+        new_ids = {obj.pk for obj in objects}
+        added, removed = new_ids - old[relation], old[relation] - new_ids
+        if added or removed:
+            changes[relation] = (added, removed)
+    if not changes:
+        return changes
+
+    recipe._batched_m2m = True  # see recipe/signals.py
+    try:
+        with transaction.atomic(using=using, savepoint=False):
+            _apply(recipe, changes, using)
+            if 'ingredients' in changes:
+                similarity.index_recipes([recipe.pk])
+    finally:
+        del recipe._batched_m2m
+    return changes
+
+
+def _apply(recipe, changes, using):
+    """Write the changes and send the m2m_changed signals"""
+    for relation, (added, removed) in changes.items():
+        through, column = RELATIONS[relation]
+        model = getattr(Recipe, relation).field.related_model
+        if removed:
+            _send(through, recipe, 'pre_remove', model, removed, using)
+            through.objects.using(using).filter(**{
+                'recipe_id': recipe.pk, f'{column}_id__in': removed
+            }).delete()
+            _send(through, recipe, 'post_remove', model, removed, using)
+        if added:
+            _send(through, recipe, 'pre_add', model, added, using)
+            through.objects.using(using).bulk_create(
+                through(recipe_id=recipe.pk, **{f'{column}_id': pk})
+                for pk in sorted(added)
+            )
+            _send(through, recipe, 'post_add', model, added, using)
+        # prefetched relations of the instance are outdated now
+        getattr(recipe, '_prefetched_objects_cache', {}).pop(
+            relation, None
+        )
@@ -0,0 +1,99 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from mainapp.models import Tag, Ingredient, Recipe
+from recipe.m2m import replace_related
+
+
+def rewrite(recipe, related):
+    """Delete every relation row and insert the new ones"""
+    for relation, objects in related.items():
+        getattr(recipe, relation).clear()
+        getattr(recipe, relation).add(*objects)
+
+
+def django_set(recipe, related):
+    """What ModelSerializer.update does: set() of every relation"""
+    for relation, objects in related.items():
+        getattr(recipe, relation).set(objects)
+
+
+STRATEGIES = (
+    ('clear + add', rewrite),
+    ('set()', django_set),
+    ('diff', replace_related),
+)
+
+
+class Command(BaseCommand):
+    """Django command to compare ways of replacing tags and ingredients of
+       a recipe on update. Sample data is created inside a transaction that
+       is rolled back at the end, so the database is left untouched"""
+    help = 'Benchmark tag/ingredient writes of recipe updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', type=int, default=60)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        count = options['ingredients']
+        with transaction.atomic():
+            recipe, tags, ingredients = self._create_sample_data(count)
+            scenarios = (
+                ('unchanged', ingredients[:count]),
+                ('1 replaced', ingredients[1:count + 1]),
+                ('10 replaced', ingredients[10:count + 10]),
+            )
+            for scenario, new_ingredients in scenarios:
+                related = {'tags': tags, 'ingredients': new_ingredients}
+                for name, strategy in STRATEGIES:
+                    queries, writes, seconds = self._measure(
+                        options['repeat'], recipe, related, strategy
+                    )
+                    self.stdout.write(
+                        f'{scenario:<12} {name:<12} {queries:>4} queries, '
+                        f'{writes:>3} relation writes, {seconds * 1000:.2f}ms'
+                    )
+            transaction.set_rollback(True)
+
+    def _measure(self, repeat, recipe, related, strategy):
+        """Return (queries, writes of through tables, best time) of a
+           strategy, every run starts from the same relations"""
+        timings = []
+        for _ in range(repeat):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    strategy(recipe, related)
+                    timings.append(time.perf_counter() - start)
+                transaction.set_rollback(True)
+        writes = [
+            query for query in context.captured_queries
+            if query['sql'].startswith(('DELETE', 'INSERT'))
+            and '"mainapp_recipe_' in query['sql'].split('(')[0]
+        ]
+        return len(context.captured_queries), len(writes), min(timings)
+
+    def _create_sample_data(self, count):
+        """Create a recipe with count ingredients and a few tags"""
+        user = get_user_model().objects.create_user(
+            'benchmark@example.com',
+            'benchmark'
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {i}') for i in range(5)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f'Ingredient {i}')
+            for i in range(count + 10)
+        )
+        recipe = Recipe.objects.create(
+            user=user, title='Benchmark', time_minutes=10, price=5
+        )
+        recipe.tags.add(*tags)
+        recipe.ingredients.add(*ingredients[:count])
+        return recipe, tags, ingredients
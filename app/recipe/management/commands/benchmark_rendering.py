@@ -0,0 +1,89 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from mainapp.models import Tag, Ingredient, Recipe
+from recipe import fast
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+
+
+class Command(BaseCommand):
+    """Django command to compare DRF serializers with the fast rendering
+       path of recipe/fast.py. The serializers get their relations
+       prefetched (one query per relation, like the fast path), so the
+       difference is the rendering, not N+1 queries. Sample data is created
+       inside a transaction that is rolled back at the end, so the database
+       is left untouched"""
+    help = 'Benchmark rendering of recipe lists (serializers vs fast path)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            queryset = self._create_sample_data(options['recipes'])
+            for detail, serializer_class in ((False, RecipeSerializer),
+                                             (True, RecipeDetailSerializer)):
+                # a new queryset each time, results aren't reused
+                slow, slow_queries = self._best_of(
+                    options['repeat'], lambda: serializer_class(
+                        queryset.prefetch_related('tags', 'ingredients'),
+                        many=True
+                    ).data
+                )
+                quick, quick_queries = self._best_of(
+                    options['repeat'], lambda: fast.render_queryset(
+                        queryset.all(), detail=detail
+                    )
+                )
+                self.stdout.write(
+                    f'{serializer_class.__name__} (prefetched): {slow:.3f}s '
+                    f'({slow_queries} queries), fast path: {quick:.3f}s '
+                    f'({quick_queries} queries, {slow / quick:.1f}x faster)'
+                )
+            transaction.set_rollback(True)
+
+    def _best_of(self, repeat, func):
+        """Return the best wall clock time of running func repeat times and
+           the number of queries of a run"""
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+        return min(timings), len(queries)
+
+    def _create_sample_data(self, count):
+        """Create a user with count recipes, each with tags, ingredients"""
+        user = get_user_model().objects.create_user(
+            'benchmark@example.com',
+            'benchmark'
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {i}') for i in range(20)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f'Ingredient {i}') for i in range(50)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(user=user, title=f'Recipe {i}', time_minutes=i % 120,
+                   price=i % 100)
+            for i in range(count)
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tags[i % 20].id)
+            for i, recipe in enumerate(recipes)
+        )
+        Recipe.ingredients.through.objects.bulk_create(
+            Recipe.ingredients.through(
+                recipe_id=recipe.id,
+                ingredient_id=ingredients[(i + j) % 50].id
+            )
+            for i, recipe in enumerate(recipes) for j in range(5)
+        )
+        return Recipe.objects.filter(user=user)
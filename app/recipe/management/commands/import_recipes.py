@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.imports import RecipeImporter
+
+
+class Command(BaseCommand):
+    """Django command to import NDJSON recipes (one recipe per line) for
+       a user. An interrupted import can be resumed with --offset"""
+    help = 'Import recipes of a user from a NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON file to import')
+        parser.add_argument('--email', required=True,
+                            help='Email of the user that owns the recipes')
+        parser.add_argument('--offset', type=int, default=0,
+                            help='Number of lines to skip (already imported)')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User {options["email"]} does not exist')
+
+        importer = RecipeImporter(
+            user,
+            batch_size=options['batch_size'],
+            offset=options['offset']
+        )
+        with open(options['path'], 'rb') as lines:
+            result = importer.run(lines, progress=self._progress)
+
+        for error in result['errors']:
+            self.stderr.write(f'Line {error["line"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result["imported"]} recipes, '
+            f'{result["error_count"]} invalid lines'
+        ))
+
+    def _progress(self, result):
+        """Report the progress after every batch"""
+        self.stdout.write(
+            f'{result["imported"]} recipes imported, '
+            f'next offset {result["next_offset"]}'
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from mainapp import sharding
+from mainapp.models import Recipe
+from recipe.similarity import index_recipes
+
+
+class Command(BaseCommand):
+    """Django command to compute MinHash signatures and LSH buckets of all
+       recipes (ie. recipes created before the similarity index existed)"""
+    help = 'Rebuild the similar recipes index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for alias in sharding.shards():
+            with sharding.use_shard(alias):
+                self._rebuild(alias, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Similarity index rebuilt'))
+
+    def _rebuild(self, alias, batch_size):
+        """Index the recipes of a shard batch by batch"""
+        indexed = 0
+        last_pk = 0
+        while True:
+            pks = list(Recipe.objects.filter(pk__gt=last_pk).order_by(
+                'pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return
+            index_recipes(pks)
+            indexed += len(pks)
+            last_pk = pks[-1]
+            self.stdout.write(f'{indexed} recipes indexed ({alias})')
@@ -0,0 +1,267 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from mainapp import sharding
+from mainapp.models import Recipe, PantryIndexGeneration
+
+
+# "What can I cook": the recipes a user can make with a pantry (a set of
+# ingredient ids), or make with at most k missing ingredients.
+#
+# Every user gets an in-memory index: each recipe has a bit position, and
+# each ingredient has a bitset (a Python int) of the recipes that use it.
+# Ingredients that are not in the pantry are the missing ones, so adding up
+# their bitsets gives the number of missing ingredients of every recipe at
+# once. The sum is kept as a bit-sliced counter (plane i holds bit i of the
+# count of every recipe), so a query is a few big-int operations per
+# ingredient, whatever the number of recipes is.
+#
+# Indexes are built lazily on the first query, kept in a bounded LRU cache
+# and updated incrementally (after commit) when ingredients of recipes
+# change. A generation number per user, kept in Postgres (one row per user,
+# incremented atomically), tells other processes that their copy of the
+# index is outdated.
+
+
+def _generation(user_id):
+    """Return the number of changes made to the index of the user"""
+    return PantryIndexGeneration.objects.filter(
+        user_id=user_id
+    ).values_list('generation', flat=True).first() or 0
+
+
+def _next_generation(user_id):
+    """Count a change of the index of the user, return the new number"""
+    table = PantryIndexGeneration._meta.db_table
+    using = router.db_for_write(PantryIndexGeneration)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, generation) VALUES (%s, 1) '
+            f'ON CONFLICT (user_id) DO UPDATE '
+            f'SET generation = {table}.generation + 1 RETURNING generation',
+            [user_id]
+        )
+        return cursor.fetchone()[0]
+
+
+class PantryIndex:
+    """Bitset index of the ingredients of the recipes of one user"""
+
+    def __init__(self, generation=None):
+        self.generation = generation
+        self.positions = {}  # recipe id -> bit position
+        self.recipe_ids = []  # bit position -> recipe id (None if free)
+        self.free = []  # positions of deleted recipes, reused first
+        self.ingredients = {}  # ingredient id -> bitset of recipes
+        self.recipes = 0  # bitset of all recipes
+
+    @classmethod
+    def build(cls, user_id, generation=None):
+        """Build the index of a user with two queries"""
+        index = cls(generation)
+        recipe_ids = Recipe.objects.filter(
+            user_id=user_id, deleted_at__isnull=True
+        ).values_list('pk', flat=True)
+        for recipe_id in recipe_ids:
+            index.add_recipe(recipe_id)
+        rows = Recipe.ingredients.through.objects.filter(
+            recipe__user_id=user_id, recipe__deleted_at__isnull=True
+        ).values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows:
+            index.add_ingredients(recipe_id, [ingredient_id])
+        return index
+
+    def add_recipe(self, recipe_id):
+        """Give a bit position to a new recipe"""
+        if recipe_id in self.positions:
+            return
+        if self.free:
+            position = self.free.pop()
+            self.recipe_ids[position] = recipe_id
+        else:
+            position = len(self.recipe_ids)
+            self.recipe_ids.append(recipe_id)
+        self.positions[recipe_id] = position
+        self.recipes |= 1 << position
+
+    def remove_recipe(self, recipe_id):
+        """Remove a recipe, its bit is cleared in every ingredient bitset,
+           so the position can be reused safely"""
+        position = self.positions.pop(recipe_id, None)
+        if position is None:
+            return
+        self.remove_ingredients(recipe_id, list(self.ingredients),
+                                position=position)
+        self.recipe_ids[position] = None
+        self.free.append(position)
+        self.recipes &= ~(1 << position)
+
+    def add_ingredients(self, recipe_id, ingredient_ids):
+        """Set the bit of the recipe in bitsets of the ingredients"""
+        self.add_recipe(recipe_id)
+        bit = 1 << self.positions[recipe_id]
+        for ingredient_id in ingredient_ids:
+            self.ingredients[ingredient_id] = (
+                self.ingredients.get(ingredient_id, 0) | bit
+            )
+
+    def remove_ingredients(self, recipe_id, ingredient_ids, position=None):
+        """Clear the bit of the recipe in bitsets of the ingredients"""
+        if position is None:
+            position = self.positions.get(recipe_id)
+            if position is None:
+                return
+        bit = 1 << position
+        for ingredient_id in ingredient_ids:
+            bits = self.ingredients.get(ingredient_id, 0) & ~bit
+            if bits:
+                self.ingredients[ingredient_id] = bits
+            else:
+                self.ingredients.pop(ingredient_id, None)
+
+    def match(self, pantry, max_missing=0):
+        """Return {recipe_id: number of missing ingredients} of the recipes
+           that miss at most max_missing ingredients of the pantry"""
+        width = (max_missing + 1).bit_length()
+        planes = [0] * width  # bit-sliced count of missing ingredients
+        overflow = 0  # recipes missing 2 ** width ingredients or more
+        for ingredient_id, bits in self.ingredients.items():
+            if ingredient_id in pantry:
+                continue
+            # add 1 to the counters of the recipes using the ingredient
+            carry = bits
+            for i in range(width):
+                planes[i], carry = planes[i] ^ carry, planes[i] & carry
+                if not carry:
+                    break
+            overflow |= carry
+
+        # compare all counters with max_missing at once, from the highest
+        # bit to the lowest one
+        less = 0
+        equal = self.recipes & ~overflow
+        for i in reversed(range(width)):
+            if max_missing >> i & 1:
+                less |= equal & ~planes[i]
+                equal &= planes[i]
+            else:
+                equal &= ~planes[i]
+
+        # positions of the matches, and bits of their counters, are read
+        # from binary strings (lowest bit first) instead of shifting ints
+        found = _bits(less | equal)
+        digits = [_bits(plane) for plane in planes]
+        matches = {}
+        position = found.find('1')
+        while position != -1:
+            matches[self.recipe_ids[position]] = sum(
+                1 << i for i, plane in enumerate(digits)
+                if plane[position:position + 1] == '1'
+            )
+            position = found.find('1', position + 1)
+        return matches
+
+
+def _bits(bitset):
+    """Return the binary digits of a bitset, the lowest bit first"""
+    return bin(bitset)[:1:-1]
+
+
+class PantryIndexCache:
+    """Bounded (least recently used) cache of the indexes of users"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def get(self, user_id):
+        """Return the up to date index of the user, built if needed"""
+        generation = _generation(user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.generation == generation:
+                self._indexes.move_to_end(user_id)
+                return index
+
+        index = PantryIndex.build(user_id, generation)
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def update(self, user_id, change):
+        """Apply change(index) to the cached index of the user after the
+           current transaction commits, and tell other processes"""
+        def apply():
+            generation = _next_generation(user_id)
+            with self._lock:
+                index = self._indexes.get(user_id)
+                if index is None:
+                    return
+                if index.generation == generation - 1:
+                    change(index)
+                    index.generation = generation
+                else:
+                    # changes of other processes were missed, rebuild it
+                    del self._indexes[user_id]
+        transaction.on_commit(apply, using=sharding.current())
+
+
+indexes = PantryIndexCache(settings.PANTRY_INDEX_CACHE_SIZE)
+
+
+def recipes_added(user_id, recipe_ids):
+    """Add new recipes (without ingredients) to the index of the user"""
+    recipe_ids = list(recipe_ids)
+
+    def change(index):
+        for recipe_id in recipe_ids:
+            index.add_recipe(recipe_id)
+    indexes.update(user_id, change)
+
+
+def recipes_removed(user_id, recipe_ids):
+    """Remove deleted recipes from the index of the user"""
+    recipe_ids = list(recipe_ids)
+
+    def change(index):
+        for recipe_id in recipe_ids:
+            index.remove_recipe(recipe_id)
+    indexes.update(user_id, change)
+
+
+def ingredients_added(user_id, pairs):
+    """Add (recipe_id, ingredient_id) pairs to the index of the user"""
+    pairs = list(pairs)
+
+    def change(index):
+        for recipe_id, ingredient_id in pairs:
+            index.add_ingredients(recipe_id, [ingredient_id])
+    indexes.update(user_id, change)
+
+
+def ingredients_removed(user_id, pairs):
+    """Remove (recipe_id, ingredient_id) pairs from the index of the user"""
+    pairs = list(pairs)
+
+    def change(index):
+        for recipe_id, ingredient_id in pairs:
+            index.remove_ingredients(recipe_id, [ingredient_id])
+    indexes.update(user_id, change)
+
+
+def cook_with(user_id, pantry, max_missing=0):
+    """Return {recipe_id: number of missing ingredients} of the recipes of
+       the user that can be made with at most max_missing ingredients that
+       are not in the pantry"""
+    return indexes.get(user_id).match(set(pantry), max_missing)
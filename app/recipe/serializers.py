@@ -1,5 +1,77 @@
+from django.db import models, transaction
+
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 from mainapp.models import Tag, Ingredient, Recipe
+from .m2m import replace_related
+from . import sync
+
+
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField limited to objects of the requesting user.
+       With many=True the whole list is validated with one query."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        # the same as RelatedField.many_init, with another list field
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is not None:
+            queryset = queryset.filter(user=request.user)
+        return queryset
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """List of primary keys looked up with one id__in query (instead of
+       one query per item), every missing id is reported at once"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        pks = []
+        for item in data:
+            # ints and digit strings (form data) only, 1.5 or True would
+            # be turned into another id by int()
+            if isinstance(item, str) and item.isascii() and item.isdigit():
+                item = int(item)
+            if isinstance(item, bool) or not isinstance(item, int):
+                child.fail('incorrect_type', data_type=type(item).__name__)
+            pks.append(item)
+        pks = list(dict.fromkeys(pks))  # without duplicates, in order
+
+        objects = child.get_queryset().in_bulk(pks)
+        missing = [pk for pk in pks if pk not in objects]
+        if missing:
+            raise serializers.ValidationError([
+                child.error_messages['does_not_exist'].format(pk_value=pk)
+                for pk in missing
+            ])
+        return [objects[pk] for pk in pks]
+
+    def get_attribute(self, instance):
+        # related objects are listed by id, like recipe/fast.py does (sorted
+        # here, so prefetched relations don't need another query)
+        return sorted(super().get_attribute(instance), key=lambda obj: obj.pk)
+
+
+class RelatedListSerializer(serializers.ListSerializer):
+    """List of nested tags/ingredients of a recipe, listed by id"""
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = sorted(data.all(), key=lambda obj: obj.pk)
+        return super().to_representation(data)
 
 
 # here Serializer looks into Tag model, and retrieves data from database,
@@ -9,8 +81,9 @@ class TagSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Tag
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = ('id', 'recipe_count')
+        list_serializer_class = RelatedListSerializer
         # we addded id as read only field, because we want to prevent user
         # of updating the id of the objects, it means they can update other
         # fields mentioned in 'fields'.
@@ -21,8 +94,10 @@ class IngredientSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = ('id', 'recipe_count')
+        list_serializer_class = RelatedListSerializer
+        # recipe_count is the number of recipes that use the ingredient
 
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -33,12 +108,14 @@ class RecipeSerializer(serializers.ModelSerializer):
     # meaning that we will pass only PK, in our case it is 'id'.
     # Then the list of ids of ingredients will be accessed by serializer
     # of main model (ie. 'Recipe' model).
-    ingredients = serializers.PrimaryKeyRelatedField(
+    # ids are validated with one query per relation, and only ids of
+    # tags/ingredients of the requesting user are accepted
+    ingredients = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
 
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
@@ -51,6 +128,19 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('id', )
 
+    def update(self, instance, validated_data):
+        """Update a recipe, tags and ingredients are changed by their diff
+           (recipe/m2m.py) instead of ModelSerializer's set()"""
+        related = {
+            relation: validated_data.pop(relation)
+            for relation in ('tags', 'ingredients')
+            if relation in validated_data
+        }
+        with transaction.atomic(using=instance._state.db):
+            instance = super().update(instance, validated_data)
+            replace_related(instance, related)
+        return instance
+
 
 # here we will base our class from RecipeSerializer
 # if more than one model was given, then in order to get all the mentioned
@@ -73,3 +163,183 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+
+class RecipeImportSerializer(serializers.ModelSerializer):
+    """Validate a recipe of a bulk import. The recipe fields are checked
+       with the same rules as RecipeSerializer, but tags and ingredients
+       are given by name (ie. as exported by .../recipes/export/)"""
+    tags = serializers.ListField(
+        child=serializers.CharField(
+            max_length=Tag._meta.get_field('name').max_length
+        ),
+        required=False
+    )
+    ingredients = serializers.ListField(
+        child=serializers.CharField(
+            max_length=Ingredient._meta.get_field('name').max_length
+        ),
+        required=False
+    )
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'title', 'ingredients', 'tags', 'time_minutes', 'price', 'link'
+        )
+
+
+class RecipeImportParamsSerializer(serializers.Serializer):
+    """Validate the line an import is resumed from,
+       ie. .../recipes/import/?offset=500"""
+    offset = serializers.IntegerField(required=False, default=0, min_value=0)
+
+
+class RecipeRangeFilterSerializer(serializers.Serializer):
+    """Validate range filters of the recipe list given as query params,
+       ie. .../recipes/?price_max=10&time_max=30"""
+    # any number is a bound, the ones prices can't reach match nothing
+    # (or everything), ie. price_max=1000
+    price_min = serializers.DecimalField(
+        max_digits=None, decimal_places=None, required=False
+    )
+    price_max = serializers.DecimalField(
+        max_digits=None, decimal_places=None, required=False
+    )
+    time_min = serializers.IntegerField(required=False)
+    time_max = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        """Check the lower bounds are not greater than the upper bounds"""
+        for low, high in (('price_min', 'price_max'),
+                          ('time_min', 'time_max')):
+            if low in attrs and high in attrs and attrs[low] > attrs[high]:
+                raise serializers.ValidationError(
+                    {low: [f'Must not be greater than {high}.']}
+                )
+        return attrs
+
+
+class RecipeExpandParamsSerializer(serializers.Serializer):
+    """Validate the relations nested in the recipe list instead of ids,
+       ie. .../recipes/?expand=tags,ingredients"""
+    RELATIONS = ('tags', 'ingredients')
+
+    expand = serializers.CharField(required=False)
+
+    def validate_expand(self, value):
+        """Convert comma separated relation names into a set"""
+        expand = {name.strip() for name in value.split(',') if name.strip()}
+        if not expand or not expand <= set(self.RELATIONS):
+            raise serializers.ValidationError(
+                f'Expected some of: {", ".join(self.RELATIONS)}'
+            )
+        return expand
+
+
+class RecipeStatsParamsSerializer(serializers.Serializer):
+    """Validate the histogram bucket edges of the recipe stats,
+       ie. .../recipes/stats/?price_buckets=5,10,20"""
+    MAX_EDGES = 20
+
+    price_buckets = serializers.CharField(required=False)
+    time_buckets = serializers.CharField(required=False)
+
+    def _edges(self, value, to_number):
+        """Convert comma separated edges into an increasing list"""
+        try:
+            edges = [to_number(edge) for edge in value.split(',')]
+            increasing = edges == sorted(set(edges))
+        except (ArithmeticError, ValueError, serializers.ValidationError):
+            raise serializers.ValidationError('Expected numbers, ie. 5,10,20')
+        if not increasing:
+            raise serializers.ValidationError('Edges must be increasing.')
+        if len(edges) > self.MAX_EDGES:
+            raise serializers.ValidationError(
+                f'At most {self.MAX_EDGES} edges are allowed.'
+            )
+        return edges
+
+    def validate_price_buckets(self, value):
+        # edges have to be valid prices (max_digits, decimal_places)
+        price = serializers.DecimalField(
+            max_digits=Recipe._meta.get_field('price').max_digits,
+            decimal_places=Recipe._meta.get_field('price').decimal_places
+        )
+        return self._edges(value, price.to_internal_value)
+
+    def validate_time_buckets(self, value):
+        return self._edges(value, int)
+
+
+class RecipeSimilarParamsSerializer(serializers.Serializer):
+    """Validate the number of similar recipes returned,
+       ie. .../recipes/1/similar/?limit=10"""
+    limit = serializers.IntegerField(
+        required=False, default=10, min_value=1, max_value=100
+    )
+
+
+class RecipePantryParamsSerializer(serializers.Serializer):
+    """Validate the pantry query of .../recipes/pantry/,
+       ie. ?pantry=1,2,3&missing=1"""
+    MAX_MISSING = 10
+
+    pantry = serializers.CharField(required=False, allow_blank=True)
+    missing = serializers.IntegerField(
+        required=False, default=0, min_value=0, max_value=MAX_MISSING
+    )
+
+    def validate_pantry(self, value):
+        """Convert comma separated ingredient ids into a set"""
+        ids = [pk for pk in value.split(',') if pk.strip()]
+        if not all(pk.strip().isascii() and pk.strip().isdigit()
+                   for pk in ids):
+            raise serializers.ValidationError(
+                'Expected ingredient ids, ie. 1,2,3'
+            )
+        return {int(pk) for pk in ids}
+
+
+class RecipeIdsParamsSerializer(serializers.Serializer):
+    """Validate a list of recipe ids given as a query param,
+       ie. .../recipes/shopping-list/?ids=1,2,3 or .../recipes/batch/"""
+    MAX_IDS = 100
+
+    ids = serializers.CharField()
+
+    def validate_ids(self, value):
+        """Convert comma separated recipe ids into a list without
+           duplicates, in the given order"""
+        ids = [pk.strip() for pk in value.split(',') if pk.strip()]
+        if not ids or not all(pk.isascii() and pk.isdigit() for pk in ids):
+            raise serializers.ValidationError('Expected recipe ids, ie. 1,2,3')
+        ids = list(dict.fromkeys(int(pk) for pk in ids))
+        if len(ids) > self.MAX_IDS:
+            raise serializers.ValidationError(
+                f'At most {self.MAX_IDS} recipes are allowed.'
+            )
+        return ids
+
+
+class RecipeSyncParamsSerializer(serializers.Serializer):
+    """Validate the cursor of a sync, ie. .../sync/?since=<cursor>"""
+    since = serializers.CharField(required=False)
+
+    def validate_since(self, value):
+        """Convert the cursor into the time it stands for"""
+        try:
+            return sync.decode_cursor(value)
+        except (ValueError, OverflowError):
+            raise serializers.ValidationError('Invalid cursor.')
+
+
+class RecipeBulkDeleteSerializer(serializers.Serializer):
+    """Validate the recipe ids of a bulk delete"""
+    MAX_IDS = 1000
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_IDS
+    )
@@ -0,0 +1,230 @@
+from django.db.models.signals import m2m_changed, pre_delete, post_delete, \
+    post_save
+from django.dispatch import receiver
+
+from mainapp.deletion import recipes_soft_deleted
+from mainapp.models import Tag, Ingredient, Recipe
+from mainapp.signals import recipe_counts_changed
+from . import similarity, pantry, caching, events
+
+
+# Keep the indexes of the recipe app (recipe/similarity.py, recipe/pantry.py)
+# and the detail cache (recipe/caching.py) up to date when recipes or their
+# tags/ingredients change, and tell the clients of the user about it
+# (recipe/events.py).
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def reindex_on_ingredients_change(sender, instance, action, reverse, pk_set,
+                                  **kwargs):
+    """Recompute the similarity index of the changed recipes"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse and getattr(instance, '_batched_m2m', False):
+        return  # reindexed once by recipe.m2m.replace_related
+    if not reverse:  # recipe.ingredients.add(...)
+        similarity.index_recipes([instance.pk])
+    elif action == 'post_clear':
+        # ingredient.recipe_set.clear() doesn't tell which recipes changed
+        similarity.index_recipes(getattr(instance, '_cleared_recipes', []))
+    else:  # ingredient.recipe_set.add(...), pk_set = recipe ids
+        similarity.index_recipes(pk_set)
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def remember_cleared_recipes(sender, instance, action, reverse, **kwargs):
+    """Remember recipes of an ingredient before they are cleared"""
+    if action == 'pre_clear' and reverse:
+        instance._cleared_recipes = list(
+            sender.objects.filter(ingredient_id=instance.pk)
+            .values_list('recipe_id', flat=True)
+        )
+
+
+@receiver(pre_delete, sender=Ingredient)
+def remember_ingredient_recipes(sender, instance, **kwargs):
+    """Deleting an ingredient removes it from recipes without m2m_changed
+       signals, its recipes are remembered to reindex them afterwards"""
+    instance._cleared_recipes = list(
+        Recipe.ingredients.through.objects.filter(ingredient_id=instance.pk)
+        .values_list('recipe_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+def reindex_ingredient_recipes(sender, instance, **kwargs):
+    """Reindex recipes of a deleted ingredient"""
+    similarity.index_recipes(getattr(instance, '_cleared_recipes', []))
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_pantry_on_ingredients_change(sender, instance, action, reverse,
+                                        pk_set, **kwargs):
+    """Update the pantry index of the owner of the changed recipes"""
+    if action == 'pre_clear' and not reverse:
+        pantry.ingredients_removed(instance.user_id, (
+            (instance.pk, ingredient_id)
+            for ingredient_id in sender.objects.filter(
+                recipe_id=instance.pk
+            ).values_list('ingredient_id', flat=True)
+        ))
+    elif action == 'post_clear' and reverse:
+        pantry.ingredients_removed(instance.user_id, (
+            (recipe_id, instance.pk)
+            for recipe_id in getattr(instance, '_cleared_recipes', [])
+        ))
+    elif action in ('post_add', 'post_remove'):
+        if reverse:
+            pairs = ((recipe_id, instance.pk) for recipe_id in pk_set)
+        else:
+            pairs = ((instance.pk, ingredient_id) for ingredient_id in pk_set)
+        if action == 'post_add':
+            pantry.ingredients_added(instance.user_id, pairs)
+        else:
+            pantry.ingredients_removed(instance.user_id, pairs)
+
+
+@receiver(post_delete, sender=Ingredient)
+def update_pantry_on_ingredient_delete(sender, instance, **kwargs):
+    """Remove a deleted ingredient from the pantry index"""
+    pantry.ingredients_removed(instance.user_id, (
+        (recipe_id, instance.pk)
+        for recipe_id in getattr(instance, '_cleared_recipes', [])
+    ))
+
+
+@receiver(post_save, sender=Recipe)
+def update_pantry_on_recipe_create(sender, instance, created, **kwargs):
+    """Add new recipes to the pantry index, a recipe without ingredients
+       can always be cooked"""
+    if created:
+        pantry.recipes_added(instance.user_id, [instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def update_pantry_on_recipe_delete(sender, instance, **kwargs):
+    """Remove deleted recipes from the pantry index"""
+    if instance.deleted_at is None:  # else removed when marked as deleted
+        pantry.recipes_removed(instance.user_id, [instance.pk])
+
+
+@receiver(recipes_soft_deleted, sender=Recipe)
+def update_pantry_on_recipe_soft_delete(sender, recipes, **kwargs):
+    """Remove recipes marked as deleted from the pantry index"""
+    by_user = {}
+    for recipe_id, user_id in recipes:
+        by_user.setdefault(user_id, []).append(recipe_id)
+    for user_id, recipe_ids in by_user.items():
+        pantry.recipes_removed(user_id, recipe_ids)
+
+
+# Versions of the detail cache (recipe/caching.py)
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipe_version(sender, instance, **kwargs):
+    """A saved or deleted recipe has a new version"""
+    caching.bump('recipe', [instance.pk])
+
+
+@receiver(recipes_soft_deleted, sender=Recipe)
+def bump_soft_deleted_recipe_versions(sender, recipes, **kwargs):
+    """Recipes marked as deleted have new versions"""
+    caching.bump('recipe', [recipe_id for recipe_id, _ in recipes])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def bump_versions_on_m2m_change(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    """Recipes whose tags/ingredients changed have new versions"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        caching.bump('recipe', [instance.pk])
+    elif action == 'pre_clear':  # tag.recipe_set.clear()
+        caching.bump('recipe', sender.objects.filter(**{
+            f'{instance._meta.model_name}_id': instance.pk
+        }).values_list('recipe_id', flat=True))
+    else:
+        caching.bump('recipe', pk_set)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def bump_related_version(sender, instance, **kwargs):
+    """Details showing renamed or deleted tags/ingredients are outdated
+       (before deleting, while the recipes showing them can be found)"""
+    caching.bump(sender._meta.model_name, [instance.pk])
+
+
+@receiver(recipe_counts_changed)
+def bump_versions_on_recipe_count_change(sender, pks, **kwargs):
+    """recipe_count is shown in details too"""
+    caching.bump(sender._meta.model_name, pks)
+
+
+# Events of the clients (recipe/events.py)
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def publish_saved(sender, instance, created, **kwargs):
+    """Tell the clients about created or changed objects"""
+    events.publish(
+        instance.user_id, sender._meta.model_name, instance.pk,
+        'created' if created else 'changed'
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def publish_deleted(sender, instance, **kwargs):
+    """Tell the clients about deleted objects"""
+    if getattr(instance, 'deleted_at', None) is not None:
+        return  # told when the recipe was marked as deleted
+    events.publish(
+        instance.user_id, sender._meta.model_name, instance.pk, 'deleted'
+    )
+
+
+@receiver(recipes_soft_deleted, sender=Recipe)
+def publish_soft_deleted(sender, recipes, **kwargs):
+    """Recipes marked as deleted are deleted for the clients"""
+    for recipe_id, user_id in recipes:
+        events.publish(user_id, 'recipe', recipe_id, 'deleted')
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def publish_m2m_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Recipes whose tags/ingredients changed are changed for the clients,
+       tags and ingredients of a user are only used by their recipes"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'pre_clear':  # tag.recipe_set.clear()
+        recipe_ids = sender.objects.filter(**{
+            f'{instance._meta.model_name}_id': instance.pk
+        }).values_list('recipe_id', flat=True)
+    else:
+        recipe_ids = pk_set
+    for recipe_id in recipe_ids:
+        events.publish(instance.user_id, 'recipe', recipe_id, 'changed')
+
+
+@receiver(recipe_counts_changed)
+def publish_recipe_count_change(sender, pks, user_id=None, **kwargs):
+    """Tags/ingredients whose recipe_count changed are changed for the
+       clients"""
+    if user_id is None:  # ie. recipes of several users were deleted
+        owners = sender.objects.filter(pk__in=pks).values_list(
+            'pk', 'user_id'
+        )
+    else:
+        owners = ((pk, user_id) for pk in pks)
+    for pk, owner_id in owners:
+        events.publish(owner_id, sender._meta.model_name, pk, 'changed')
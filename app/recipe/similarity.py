@@ -0,0 +1,141 @@
+import hashlib
+import random
+import struct
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from mainapp import sharding
+from mainapp.models import Recipe, RecipeSignature, RecipeLSHBucket
+
+
+# "Similar recipes" are the ones whose ingredient sets have the highest
+# Jaccard similarity (|A & B| / |A | B|). Comparing a recipe with every
+# other one does not scale, so every recipe gets a MinHash signature:
+# NUM_HASHES hash functions, each one keeps the minimum hash of the
+# ingredient ids. Two recipes have the same minimum for a hash function
+# with probability equal to their Jaccard similarity.
+#
+# The signature is cut into BANDS bands of ROWS values (LSH banding), each
+# band is hashed into a bucket and stored in RecipeLSHBucket. Recipes that
+# share at least one bucket are candidates, found with an index lookup.
+# Only the candidates sharing the most buckets are scored exactly.
+
+BANDS = 16
+ROWS = 4
+NUM_HASHES = BANDS * ROWS
+
+# hash functions h(x) = (a * x + b) mod PRIME, with fixed coefficients so
+# signatures stay comparable across processes and deploys
+PRIME = (1 << 61) - 1
+_random = random.Random(20210815)
+HASH_COEFFICIENTS = [
+    (_random.randrange(1, PRIME), _random.randrange(0, PRIME))
+    for _ in range(NUM_HASHES)
+]
+
+
+def minhash_signature(ingredient_ids):
+    """Return the MinHash signature of a set of ingredient ids"""
+    return [
+        min((a * pk + b) % PRIME for pk in ingredient_ids)
+        for a, b in HASH_COEFFICIENTS
+    ]
+
+
+def band_buckets(signature):
+    """Return the bucket (signed 64 bit hash) of every band"""
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(
+            struct.pack(f'>{ROWS}Q', *rows), digest_size=8
+        ).digest()
+        buckets.append(int.from_bytes(digest, 'big', signed=True))
+    return buckets
+
+
+def jaccard(first, second):
+    """Return the Jaccard similarity of two sets"""
+    union = len(first | second)
+    return len(first & second) / union if union else 0.0
+
+
+def ingredient_sets(recipe_ids):
+    """Return {recipe_id: set of ingredient ids} with one query"""
+    sets = {recipe_id: set() for recipe_id in recipe_ids}
+    rows = Recipe.ingredients.through.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('recipe_id', 'ingredient_id')
+    for recipe_id, ingredient_id in rows:
+        sets[recipe_id].add(ingredient_id)
+    return sets
+
+
+def index_recipes(recipe_ids):
+    """(Re)compute signatures and LSH buckets of the given recipes in bulk.
+       Recipes without ingredients have neither of them."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    users = dict(Recipe.objects.filter(
+        pk__in=recipe_ids
+    ).values_list('pk', 'user_id'))
+    sets = ingredient_sets(users)
+
+    signatures = []
+    buckets = []
+    for recipe_id, ingredients in sets.items():
+        if not ingredients:
+            continue
+        signature = minhash_signature(ingredients)
+        signatures.append(
+            RecipeSignature(recipe_id=recipe_id, minhashes=signature)
+        )
+        buckets.extend(
+            RecipeLSHBucket(recipe_id=recipe_id, user_id=users[recipe_id],
+                            band=band, bucket=bucket)
+            for band, bucket in enumerate(band_buckets(signature))
+        )
+
+    with transaction.atomic(using=sharding.current()):
+        RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeLSHBucket.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeSignature.objects.bulk_create(signatures)
+        RecipeLSHBucket.objects.bulk_create(buckets)
+
+
+def similar_recipes(recipe, limit=10):
+    """Return [(recipe_id, similarity)] of the most similar recipes of the
+       same user, the most similar first"""
+    ingredients = ingredient_sets([recipe.pk])[recipe.pk]
+    if not ingredients:
+        return []
+    signature = RecipeSignature.objects.filter(
+        recipe_id=recipe.pk
+    ).values_list('minhashes', flat=True).first()
+    if signature is None:  # ie. created before the index existed
+        signature = minhash_signature(ingredients)
+
+    # one index lookup for all bands of the recipe
+    same_bucket = Q()
+    for band, bucket in enumerate(band_buckets(signature)):
+        same_bucket |= Q(band=band, bucket=bucket)
+    candidates = RecipeLSHBucket.objects.filter(
+        same_bucket,
+        user_id=recipe.user_id,
+        recipe__deleted_at__isnull=True
+    ).exclude(recipe_id=recipe.pk).values('recipe_id').annotate(
+        shared=Count('id')
+    ).order_by('-shared', 'recipe_id').values_list(
+        'recipe_id', flat=True
+    )[:settings.RECIPE_SIMILAR_CANDIDATES]
+
+    # exact scoring of the best candidates only
+    scored = [
+        (recipe_id, jaccard(ingredients, candidate))
+        for recipe_id, candidate in ingredient_sets(list(candidates)).items()
+    ]
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return [item for item in scored if item[1] > 0][:limit]
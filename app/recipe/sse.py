@@ -0,0 +1,145 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from . import events
+
+
+# Server-sent events (text/event-stream) of the changes of the user's
+# recipes, tags and ingredients, ie. a browser's
+#     new EventSource('/api/recipe/events/?token=<token>')
+# An open stream would hold a worker thread for as long as the client is
+# connected, so it's a plain ASGI application routed by app/asgi.py, which
+# waits on the events of recipe/events.py instead.
+#
+# Every event is named after the kind of object, with its id and action:
+#     event: recipe
+#     data: {"id": 1, "action": "changed"}
+# A 'resync' event means events were lost, the client has to sync
+# (.../api/recipe/sync/). Clients should sync after (re)connecting too:
+# events have no id, a stream can't be resumed (Last-Event-ID) since the
+# events sent meanwhile aren't kept anywhere.
+
+PATH = '/api/recipe/events/'
+# milliseconds clients wait before reconnecting
+RETRY = 5000
+
+
+def _token(scope):
+    """Return the token of the Authorization header or the token query
+       param (EventSource can't send headers)"""
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            words = value.decode('latin-1').split()
+            if len(words) == 2 and words[0].lower() == 'token':
+                return words[1]
+            return None
+    tokens = parse_qs(scope['query_string'].decode('latin-1')).get('token')
+    return tokens[0] if tokens else None
+
+
+@sync_to_async
+def _authenticate(key):
+    """Return the id of the active user of a token, or None"""
+    # connections are handled the same as during a request of Django
+    close_old_connections()
+    try:
+        user, _ = TokenAuthentication().authenticate_credentials(key)
+    except exceptions.AuthenticationFailed:
+        return None
+    finally:
+        close_old_connections()
+    return user.pk
+
+
+def format_event(event):
+    """Return an event in the text/event-stream format"""
+    data = {key: value for key, value in event.items()
+            if key not in ('user', 'type')}
+    return (
+        f'event: {event["type"]}\n'
+        f'data: {json.dumps(data)}\n\n'
+    ).encode()
+
+
+async def _respond(send, status, body, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _disconnected(receive):
+    """Wait until the client is gone"""
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def events_application(scope, receive, send):
+    """Stream the events of the authenticated user"""
+    if scope['method'] != 'GET':
+        return await _respond(
+            send, 405, b'{"detail": "Method not allowed."}',
+            [(b'allow', b'GET')]
+        )
+    key = _token(scope)
+    user_id = await _authenticate(key) if key else None
+    if user_id is None:
+        return await _respond(
+            send, 401, b'{"detail": "Invalid token."}',
+            [(b'www-authenticate', b'Token')]
+        )
+
+    subscription = events.hub.subscribe(user_id, asyncio.get_running_loop())
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    received = None
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # no buffering by nginx
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': f'retry: {RETRY}\n\n'.encode(),
+            'more_body': True,
+        })
+        while True:
+            if received is None:
+                received = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {received, disconnected},
+                timeout=settings.RECIPE_EVENTS_HEARTBEAT,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected in done:
+                break
+            if received in done:
+                body = format_event(received.result())
+                received = None
+            else:
+                # a comment keeps proxies from closing an idle connection
+                body = b': ping\n\n'
+            await send({
+                'type': 'http.response.body',
+                'body': body,
+                'more_body': True,
+            })
+    finally:
+        events.hub.unsubscribe(subscription)
+        disconnected.cancel()
+        if received is not None:
+            received.cancel()
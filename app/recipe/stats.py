@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db.models import Avg, Count, Max, Min, Q
+
+from mainapp.models import Recipe
+from . import fast
+
+
+# Statistics of the recipes of a user (count, min/max/avg and histograms of
+# price and time_minutes). Everything is computed by one aggregate query,
+# so no recipe rows are sent from the database to the application.
+
+def bucket_ranges(edges):
+    """Turn edges into (low, high) ranges, including open ended ranges
+       before the first and after the last edge, ie. [5, 10] ->
+       [(None, 5), (5, 10), (10, None)]"""
+    bounds = [None] + list(edges) + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _bucket_filter(field, low, high):
+    """Return the condition of a recipe being in the [low, high) range"""
+    condition = Q()
+    if low is not None:
+        condition &= Q(**{f'{field}__gte': low})
+    if high is not None:
+        condition &= Q(**{f'{field}__lt': high})
+    return condition
+
+
+def _format_price(number):
+    """Format prices the way RecipeSerializer does (ie. '5.90')"""
+    return None if number is None else fast.format_price(number)
+
+
+def _format_number(number):
+    """Round averages (the other values are integers already)"""
+    return None if number is None else round(number, 2)
+
+
+def recipe_stats(queryset, price_buckets=None, time_buckets=None):
+    """Return statistics of the recipes in the queryset"""
+    histograms = {
+        'price': bucket_ranges(
+            price_buckets or settings.RECIPE_STATS_PRICE_BUCKETS
+        ),
+        'time_minutes': bucket_ranges(
+            time_buckets or settings.RECIPE_STATS_TIME_BUCKETS
+        ),
+    }
+
+    aggregates = {'count': Count('id')}
+    for field, ranges in histograms.items():
+        aggregates[f'{field}_min'] = Min(field)
+        aggregates[f'{field}_max'] = Max(field)
+        aggregates[f'{field}_avg'] = Avg(field)
+        for i, (low, high) in enumerate(ranges):
+            aggregates[f'{field}_bucket_{i}'] = Count(
+                'id', filter=_bucket_filter(field, low, high)
+            )
+
+    # filtering by tags/ingredients joins their tables, which can repeat
+    # recipes. A subquery keeps every recipe once and it is still one query
+    result = Recipe.objects.filter(
+        pk__in=queryset.values('pk')
+    ).aggregate(**aggregates)
+
+    stats = {'count': result['count']}
+    for field, ranges in histograms.items():
+        value = _format_price if field == 'price' else _format_number
+        stats[field] = {
+            'min': value(result[f'{field}_min']),
+            'max': value(result[f'{field}_max']),
+            'avg': value(result[f'{field}_avg']),
+            'histogram': [
+                {
+                    'from': value(low),
+                    'to': value(high),
+                    'count': result[f'{field}_bucket_{i}'],
+                }
+                for i, (low, high) in enumerate(ranges)
+            ],
+        }
+    return stats
@@ -0,0 +1,82 @@
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from mainapp.sharding import use_shard
+from . import fast
+
+
+# The same options JSONRenderer uses by default (UNICODE_JSON, COMPACT_JSON
+# and STRICT_JSON), so a streamed list is byte for byte the same as the
+# rendered one. Rows from recipe/fast.py contain only str and int values,
+# which means the C accelerated encoder of the json module is used.
+_encoder = json.JSONEncoder(
+    ensure_ascii=False,
+    separators=(',', ':'),
+    allow_nan=False
+)
+
+
+def stream_requested(request):
+    """Return True if the client asked for a streamed list (?stream=1)"""
+    return request.query_params.get('stream', '').lower() in (
+        '1', 'true', 'yes'
+    )
+
+
+def chunked(iterable, size):
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_row_chunks(queryset, chunk_size=None):
+    """Yield chunks of recipe values() rows read from a server-side cursor"""
+    chunk_size = chunk_size or settings.RECIPE_STREAM_CHUNK_SIZE
+    # on PostgreSQL .iterator() fetches rows through a named (server-side)
+    # cursor, chunk_size rows at a time, instead of loading the whole result
+    rows = queryset.values(*fast.RECIPE_VALUES).iterator(
+        chunk_size=chunk_size
+    )
+    return chunked(rows, chunk_size)
+
+
+def iter_json_list(queryset, detail=False, chunk_size=None, expand=()):
+    """Yield the JSON array of the rendered recipes piece by piece"""
+    yield b'['
+    separator = b''
+    for rows in iter_row_chunks(queryset, chunk_size):
+        # every chunk is encoded on its own, the surrounding brackets
+        # are dropped and chunks are joined by commas instead. Relations
+        # are read from the shard of the recipes, the response is sent
+        # after the request left it
+        with use_shard(queryset.db):
+            body = _encoder.encode(
+                fast.render_rows(rows, detail=detail, expand=expand)
+            )
+        yield separator + body[1:-1].encode('utf-8')
+        separator = b','
+    yield b']'
+
+
+class StreamingJSONListResponse(StreamingHttpResponse):
+    """Streamed JSON list of recipes, so the memory used does not depend
+       on the number of recipes and the first bytes are sent right away"""
+
+    def __init__(self, queryset, detail=False, chunk_size=None, expand=(),
+                 **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        # the database is chosen now, while the shard of the request is set
+        queryset = queryset.using(queryset.db)
+        super().__init__(
+            iter_json_list(
+                queryset, detail=detail, chunk_size=chunk_size, expand=expand
+            ),
+            **kwargs
+        )
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from mainapp.models import Tag, Ingredient, Recipe, Tombstone
+from . import fast
+
+
+# Delta sync of offline clients (.../api/recipe/sync/?since=<cursor>).
+# Every response has a cursor, the next sync only returns the recipes,
+# tags and ingredients changed (updated_at) or deleted (tombstones) after
+# it, read through the (user, updated_at) indexes. The cursor is the time
+# of the sync minus RECIPE_SYNC_OVERLAP seconds: a transaction that saved
+# a row before the sync but committed after it is still picked up by the
+# next sync. Clients get some rows twice, which is fine as clients
+# replace their copy of a row by id.
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# tombstone model -> key of the response
+NAMES = {'recipe': 'recipes', 'tag': 'tags', 'ingredient': 'ingredients'}
+
+
+def encode_cursor(moment):
+    """Return the cursor of a time (microseconds since the epoch)"""
+    return str((moment - EPOCH) // timedelta(microseconds=1))
+
+
+def decode_cursor(cursor):
+    """Return the time of a cursor, ValueError if it's not a cursor"""
+    if not cursor.isdigit():
+        raise ValueError(cursor)
+    return EPOCH + timedelta(microseconds=int(cursor))
+
+
+def cursor_expired(since):
+    """Return True if deletions since then may have been forgotten"""
+    return since < timezone.now() - timedelta(
+        seconds=settings.RECIPE_SYNC_TOMBSTONE_TTL
+    )
+
+
+def changes(user, since=None):
+    """Return the rows of the user changed or deleted since the given time
+       (everything if None) and the cursor of the next sync"""
+    started = timezone.now()
+    recipes = Recipe.objects.filter(user=user, deleted_at__isnull=True)
+    tags = Tag.objects.filter(user=user)
+    ingredients = Ingredient.objects.filter(user=user)
+    deleted = {name: [] for name in NAMES.values()}
+    if since is not None:
+        recipes = recipes.filter(updated_at__gt=since)
+        tags = tags.filter(updated_at__gt=since)
+        ingredients = ingredients.filter(updated_at__gt=since)
+        tombstones = Tombstone.objects.filter(
+            user=user, deleted_at__gt=since
+        ).order_by('object_id').values_list('model', 'object_id')
+        for model, object_id in tombstones:
+            deleted[NAMES[model]].append(object_id)
+
+    fields = ('id', 'name', 'recipe_count')  # TagSerializer fields
+    return {
+        'cursor': encode_cursor(
+            started - timedelta(seconds=settings.RECIPE_SYNC_OVERLAP)
+        ),
+        'recipes': fast.render_queryset(recipes.order_by('id')),
+        'tags': list(tags.order_by('id').values(*fields)),
+        'ingredients': list(ingredients.order_by('id').values(*fields)),
+        'deleted': deleted,
+    }
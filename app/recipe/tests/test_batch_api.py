@@ -0,0 +1,88 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from mainapp.deletion import soft_delete_recipes
+from mainapp.models import Recipe, Tag, Ingredient
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user, detail_url
+)
+
+
+BATCH_URL = reverse('recipe:recipe-batch')
+
+
+class PublicBatchApiTests(TestCase):
+    """Test unauthenticated batch requests"""
+
+    def test_login_required(self):
+        """Test login is required to get recipes in batch"""
+        response = APIClient().get(BATCH_URL, {'ids': '1'})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateBatchApiTests(AuthenticatedClientMixin, TestCase):
+    """Test getting many recipes of the authenticated user at once"""
+
+    def setUp(self):
+        super().setUp()
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        self.recipes = [
+            create_sample_recipe(self.user, title=f'Recipe {i}')
+            for i in range(3)
+        ]
+        for recipe in self.recipes:
+            recipe.tags.add(tag)
+            recipe.ingredients.add(ingredient)
+
+    def test_details_in_order(self):
+        """Test details are returned in the requested order with one query
+           for recipes and one per relation"""
+        ids = [self.recipes[2].id, self.recipes[0].id, self.recipes[1].id]
+
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                BATCH_URL, {'ids': ','.join(map(str, ids))}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']], ids
+        )
+        self.assertEqual(response.data['missing'], [])
+        # the same representation as the detail endpoint
+        self.assertEqual(
+            response.data['results'][0],
+            self.client.get(detail_url(ids[0])).data
+        )
+
+    def test_missing_ids(self):
+        """Test unknown, deleted and other users' recipes are missing"""
+        other = create_user('other@gmail.com', 'Test1234')
+        foreign = create_sample_recipe(other)
+        soft_delete_recipes(Recipe.objects.filter(pk=self.recipes[1].pk))
+        ids = [self.recipes[0].id, foreign.id, self.recipes[1].id, 999999]
+
+        response = self.client.get(
+            BATCH_URL, {'ids': ','.join(map(str, ids))}
+        )
+
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [self.recipes[0].id]
+        )
+        self.assertEqual(response.data['missing'], ids[1:])
+
+    def test_invalid_ids(self):
+        """Test invalid or too many ids are rejected"""
+        too_many = ','.join(str(pk) for pk in range(1, 102))
+
+        for ids in ('', 'a,b', too_many):
+            response = self.client.get(BATCH_URL, {'ids': ids})
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
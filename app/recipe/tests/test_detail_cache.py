@@ -0,0 +1,184 @@
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from rest_framework import status
+
+from mainapp.deletion import soft_delete_recipes
+from mainapp.models import Tag, Ingredient, Recipe
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user, detail_url
+)
+from recipe import caching
+from recipe.checks import check_recipe_cache
+
+
+class RecipeDetailCacheTests(AuthenticatedClientMixin, TestCase):
+    """Test caching of recipe details"""
+
+    def setUp(self):
+        super().setUp()
+        caches[settings.RECIPE_CACHE_ALIAS].clear()
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(
+            user=self.user, name='Salt'
+        )
+        self.recipe = create_sample_recipe(self.user)
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+
+    def get(self):
+        response = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_cached(self):
+        """Test a cached detail is returned without rendering it"""
+        first = self.get()
+
+        with patch('recipe.views.fast.render_queryset') as render:
+            self.assertEqual(self.get(), first)
+
+        render.assert_not_called()
+
+    def test_hit_reads_cache_once(self):
+        """Test a cached detail is found with one read of the cache"""
+        first = self.get()
+
+        with self.assertNumQueries(1):
+            data = caching.get_detail(self.recipe.id, self.user.id, None)
+
+        self.assertEqual(data, first)
+
+    def test_recipe_change(self):
+        """Test saving a recipe invalidates its detail"""
+        self.get()
+
+        self.client.patch(detail_url(self.recipe.id), {'title': 'Cake'})
+
+        self.assertEqual(self.get()['title'], 'Cake')
+
+    def test_m2m_change(self):
+        """Test changing the ingredients of a recipe invalidates it"""
+        self.get()
+        pepper = Ingredient.objects.create(user=self.user, name='Pepper')
+
+        self.recipe.ingredients.add(pepper)
+
+        self.assertEqual(
+            [ingredient['name'] for ingredient in self.get()['ingredients']],
+            ['Salt', 'Pepper']
+        )
+
+    def test_tag_rename(self):
+        """Test renaming a tag invalidates the details showing it"""
+        self.get()
+
+        self.tag.name = 'Vegetarian'
+        self.tag.save()
+
+        self.assertEqual(self.get()['tags'][0]['name'], 'Vegetarian')
+
+    def test_tag_delete(self):
+        """Test deleting a tag invalidates the details showing it"""
+        self.get()
+
+        self.tag.delete()
+
+        self.assertEqual(self.get()['tags'], [])
+
+    def test_recipe_count_change(self):
+        """Test a tag used by another recipe invalidates the details"""
+        self.get()
+
+        create_sample_recipe(self.user).tags.add(self.tag)
+
+        self.assertEqual(self.get()['tags'][0]['recipe_count'], 2)
+
+    def test_other_user(self):
+        """Test a cached detail isn't returned to other users"""
+        self.get()
+        other = create_user('other@gmail.com', 'Test1234')
+        self.client.force_authenticate(other)
+
+        response = self.client.get(detail_url(self.recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_id(self):
+        """Test ids that aren't ASCII digits are not found"""
+        # %C2%B2 is a superscript two, a digit that int() doesn't take
+        for pk in ('abc', '%C2%B2'):
+            response = self.client.get(f'/api/recipe/recipes/{pk}/')
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_404_NOT_FOUND, pk)
+
+    def test_deleted(self):
+        """Test a deleted recipe is not returned from the cache"""
+        self.get()
+
+        soft_delete_recipes(Recipe.objects.filter(pk=self.recipe.pk))
+
+        response = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DetailLockTests(TestCase):
+    """Test concurrent misses are rendered once"""
+
+    def setUp(self):
+        self.cache = caches[settings.RECIPE_CACHE_ALIAS]
+        self.cache.clear()
+        self.renders = []
+
+    def render(self):
+        self.renders.append(1)
+        return {'id': 1, 'title': 'Cake', 'tags': [], 'ingredients': []}
+
+    def test_waits_for_rendering_request(self):
+        """Test a miss waits for the request holding the lock"""
+        self.cache.add('recipe-detail-lock:1', 1)
+
+        def finish_rendering(seconds):
+            """The request holding the lock stores the detail"""
+            self.cache.delete('recipe-detail-lock:1')
+            caching.get_detail(1, 7, self.render)
+
+        with patch('recipe.caching.time.sleep',
+                   side_effect=finish_rendering) as sleep:
+            data = caching.get_detail(1, 7, self.render)
+
+        self.assertEqual(data['title'], 'Cake')
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual(sleep.call_count, 1)
+
+    @override_settings(RECIPE_CACHE_LOCK_WAIT=0)
+    def test_lock_timeout(self):
+        """Test the detail is rendered (not stored) when waiting too long"""
+        self.cache.add('recipe-detail-lock:1', 1)
+
+        self.assertEqual(caching.get_detail(1, 7, self.render)['id'], 1)
+
+        self.assertIsNone(self.cache.get(caching.detail_key(1)))
+
+
+class RecipeCacheCheckTests(SimpleTestCase):
+    """Test the cache of recipe details has to be shared by processes"""
+
+    def test_shared_cache(self):
+        """Test the configured cache passes the check"""
+        self.assertEqual(check_recipe_cache(None), [])
+
+    @override_settings(RECIPE_CACHE_ALIAS='default')
+    def test_cache_of_each_process(self):
+        """Test a LocMemCache is refused"""
+        errors = check_recipe_cache(None)
+
+        self.assertEqual([error.id for error in errors], ['recipe.E001'])
+        self.assertIn(errors[0], checks.run_checks(
+            tags=[checks.Tags.caches]
+        ))
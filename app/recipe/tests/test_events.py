@@ -0,0 +1,324 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from mainapp.deletion import soft_delete_recipes
+from mainapp.models import Recipe, Tag, Ingredient
+from mainapp.testing import create_sample_recipe, create_user
+from recipe import events, sse
+from recipe.imports import RecipeImporter
+
+
+@sync_to_async
+def create_committed_recipe(user):
+    """Create a recipe in another thread, like another request would"""
+    try:
+        return create_sample_recipe(user)
+    finally:
+        connection.close()
+
+
+class PublishTests(TestCase):
+    """Test events are published for changes of recipes, tags and
+       ingredients"""
+
+    def setUp(self):
+        self.user = create_user()
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = create_sample_recipe(self.user)
+        # the test runs in the transaction of setUp, its events would be
+        # sent with them
+        connection.recipe_events = None
+
+    def published(self, change):
+        """Return the events published by a change"""
+        with patch('recipe.signals.events.publish') as publish:
+            change()
+        return [call.args for call in publish.call_args_list]
+
+    def test_save(self):
+        """Test created and changed objects are published"""
+        def change():
+            self.recipe.title = 'Cake'
+            self.recipe.save()
+            Ingredient.objects.create(user=self.user, name='Salt')
+
+        salt_event, = [
+            event for event in self.published(change)
+            if event[1] == 'ingredient'
+        ]
+        self.assertEqual(salt_event[3], 'created')
+        self.assertIn(
+            (self.user.id, 'recipe', self.recipe.id, 'changed'),
+            self.published(change)
+        )
+
+    def test_m2m_change(self):
+        """Test recipes are changed when their tags are, both ways, and the
+           tags with their recipe counts"""
+        other = create_sample_recipe(self.user)
+        tag_changed = (self.user.id, 'tag', self.tag.id, 'changed')
+
+        self.assertCountEqual(
+            self.published(lambda: self.recipe.tags.add(self.tag)),
+            [(self.user.id, 'recipe', self.recipe.id, 'changed'),
+             tag_changed]
+        )
+        self.assertCountEqual(
+            self.published(lambda: self.tag.recipe_set.clear()),
+            [(self.user.id, 'recipe', self.recipe.id, 'changed'),
+             tag_changed]
+        )
+        self.assertCountEqual(
+            self.published(lambda: self.tag.recipe_set.add(other)),
+            [(self.user.id, 'recipe', other.id, 'changed'), tag_changed]
+        )
+
+    def test_recipe_count_of_deleted_recipes(self):
+        """Test tags of deleted recipes are changed"""
+        self.recipe.tags.add(self.tag)
+
+        self.assertIn(
+            (self.user.id, 'tag', self.tag.id, 'changed'),
+            self.published(lambda: soft_delete_recipes(
+                Recipe.objects.filter(pk=self.recipe.pk)
+            ))
+        )
+
+    def test_import(self):
+        """Test imported recipes and the tags created for them are
+           published"""
+        def change():
+            RecipeImporter(self.user).run([json.dumps({
+                'title': 'Cake', 'time_minutes': 5, 'price': '1.00',
+                'tags': ['Vegan', 'Sweet'],
+            })])
+
+        published = self.published(change)
+
+        recipe = Recipe.objects.get(title='Cake')
+        sweet = Tag.objects.get(name='Sweet')
+        self.assertIn((self.user.id, 'recipe', recipe.id, 'created'),
+                      published)
+        self.assertIn((self.user.id, 'tag', sweet.id, 'created'), published)
+        self.assertIn((self.user.id, 'tag', self.tag.id, 'changed'),
+                      published)
+
+    def test_delete(self):
+        """Test deleted objects are published once"""
+        tag_id = self.tag.id
+
+        self.assertEqual(
+            self.published(lambda: self.tag.delete()),
+            [(self.user.id, 'tag', tag_id, 'deleted')]
+        )
+        self.assertEqual(
+            self.published(lambda: soft_delete_recipes(
+                Recipe.objects.filter(pk=self.recipe.pk)
+            )),
+            [(self.user.id, 'recipe', self.recipe.id, 'deleted')]
+        )
+        # deleting it for good later on isn't published again
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.published(lambda: self.recipe.delete()), [])
+
+    def test_published_on_commit(self):
+        """Test events are sent when the transaction commits"""
+        with patch('recipe.events.connection') as connection:
+            with self.captureOnCommitCallbacks() as callbacks:
+                events.publish(self.user.id, 'recipe', 1, 'changed')
+            connection.cursor.assert_not_called()
+
+            for callback in callbacks:
+                callback()
+
+        cursor = connection.cursor.return_value.__enter__.return_value
+        self.assertEqual(
+            cursor.execute.call_args.args[1][1],
+            [f'[{{"user":{self.user.id},"type":"recipe","id":1,'
+             f'"action":"changed"}}]']
+        )
+
+    def sent(self, change):
+        """Return the payloads of the NOTIFY queries sent by a change"""
+        with patch('recipe.events.connection') as connection:
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        return [call.args[1][1] for call in cursor.execute.call_args_list]
+
+    def test_one_query_per_transaction(self):
+        """Test the events of a transaction are sent with one query"""
+        def change():
+            for pk in range(3):
+                events.publish(self.user.id, 'tag', pk, 'deleted')
+
+        payloads, = self.sent(change)
+
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual(
+            [event['id'] for event in json.loads(payloads[0])], [0, 1, 2]
+        )
+
+    def test_large_transaction(self):
+        """Test payloads stay under the limit of NOTIFY"""
+        def change():
+            for pk in range(1000):
+                events.publish(self.user.id, 'tag', pk, 'deleted')
+
+        payloads, = self.sent(change)
+
+        self.assertGreater(len(payloads), 1)
+        for payload in payloads:
+            self.assertLessEqual(len(payload), events.MAX_PAYLOAD)
+        self.assertEqual(
+            [event['id'] for payload in payloads
+             for event in json.loads(payload)],
+            list(range(1000))
+        )
+
+    def test_rolled_back_events_not_sent(self):
+        """Test events of a rolled back transaction aren't sent later"""
+        def change():
+            try:
+                with transaction.atomic():
+                    events.publish(self.user.id, 'tag', 1, 'created')
+                    raise ValueError
+            except ValueError:
+                pass
+            events.publish(self.user.id, 'tag', 2, 'created')
+
+        payloads, = self.sent(change)
+
+        self.assertEqual(
+            [event['id'] for event in json.loads(payloads[0])], [2]
+        )
+
+
+class SubscriptionTests(TestCase):
+    """Test events of a subscription"""
+
+    @override_settings(RECIPE_EVENTS_QUEUE_SIZE=2)
+    def test_overflow(self):
+        """Test missed events of slow clients are replaced by a resync"""
+        async def push_too_many():
+            subscription = events.Subscription(
+                1, asyncio.get_running_loop()
+            )
+            for pk in range(3):
+                subscription.push({'user': 1, 'type': 'tag', 'id': pk})
+            await asyncio.sleep(0)
+            return [
+                subscription.queue.get_nowait()
+                for _ in range(subscription.queue.qsize())
+            ]
+
+        self.assertEqual(asyncio.run(push_too_many()), [events.RESYNC])
+
+    def test_format_event(self):
+        """Test events are formatted as server-sent events"""
+        event = {'user': 1, 'type': 'recipe', 'id': 2, 'action': 'deleted'}
+
+        self.assertEqual(
+            sse.format_event(event),
+            b'event: recipe\n'
+            b'data: {"id": 2, "action": "deleted"}\n\n'
+        )
+
+
+class EventStream:
+    """A client of the ASGI application of the event stream"""
+
+    def __init__(self, query_string=b'', headers=()):
+        self.scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': sse.PATH,
+            'query_string': query_string,
+            'headers': list(headers),
+        }
+        self.received = asyncio.Queue()
+        self.sent = asyncio.Queue()
+
+    def start(self):
+        self.task = asyncio.ensure_future(sse.events_application(
+            self.scope, self.received.get, self.sent.put
+        ))
+
+    async def next(self):
+        return await asyncio.wait_for(self.sent.get(), 10)
+
+    async def disconnect(self):
+        await self.received.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(self.task, 10)
+
+
+class EventStreamTests(TransactionTestCase):
+    """Test streaming events (tokens are looked up in another thread, so
+       the data is committed)"""
+
+    def setUp(self):
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user)
+
+    def tearDown(self):
+        events.hub.stop()
+
+    def test_login_required(self):
+        """Test an invalid or missing token is rejected"""
+        async def connect(stream):
+            stream.start()
+            start = await stream.next()
+            await stream.task
+            return start['status']
+
+        for stream in (EventStream(), EventStream(b'token=abc')):
+            self.assertEqual(asyncio.run(connect(stream)), 401)
+
+    def test_events_of_user(self):
+        """Test changes of the user are streamed through LISTEN/NOTIFY"""
+        other = create_user('other@gmail.com', 'Test1234')
+
+        async def stream_events():
+            stream = EventStream(headers=[
+                (b'authorization', f'Token {self.token.key}'.encode())
+            ])
+            stream.start()
+            start = await stream.next()
+            self.assertEqual(start['status'], 200)
+            self.assertEqual((await stream.next())['body'], b'retry: 5000\n\n')
+            await sync_to_async(events.hub.listening.wait)(10)
+
+            # other users' changes aren't streamed
+            await create_committed_recipe(other)
+            recipe = await create_committed_recipe(self.user)
+
+            body = (await stream.next())['body']
+            await stream.disconnect()
+            return recipe, body
+
+        recipe, body = asyncio.run(stream_events())
+
+        self.assertEqual(body, sse.format_event({
+            'type': 'recipe', 'id': recipe.id, 'action': 'created'
+        }))
+        self.assertEqual(events.hub.subscriptions, {})
+
+    @override_settings(RECIPE_EVENTS_HEARTBEAT=0.01)
+    def test_heartbeat(self):
+        """Test idle streams send comments"""
+        async def wait_for_heartbeat():
+            stream = EventStream(b'token=' + self.token.key.encode())
+            stream.start()
+            await stream.next()
+            await stream.next()
+            body = (await stream.next())['body']
+            await stream.disconnect()
+            return body
+
+        self.assertEqual(asyncio.run(wait_for_heartbeat()), b': ping\n\n')
@@ -0,0 +1,110 @@
+import csv
+import io
+import json
+
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from mainapp.models import Recipe, Tag, Ingredient
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user
+)
+
+from recipe import exports
+
+
+EXPORT_URL = reverse('recipe:recipe-export')
+
+
+class PublicExportApiTests(TestCase):
+    """Test unauthenticated recipe export"""
+
+    def test_login_required(self):
+        """Test login is required for exporting recipes"""
+        response = APIClient().get(EXPORT_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateExportApiTests(AuthenticatedClientMixin, TestCase):
+    """Test exporting recipes of the authenticated user"""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = create_sample_recipe(user=self.user, title='Plov')
+        self.recipe.tags.add(
+            Tag.objects.create(user=self.user, name='Asian'),
+            Tag.objects.create(user=self.user, name='Dinner')
+        )
+        self.recipe.ingredients.add(
+            Ingredient.objects.create(user=self.user, name='Rice')
+        )
+        create_sample_recipe(user=self.user, title='Toast, with butter')
+
+    def _content(self, response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_export_ndjson(self):
+        """Test exporting recipes as newline delimited JSON"""
+        response = self.client.get(EXPORT_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('recipes.ndjson', response['Content-Disposition'])
+        lines = self._content(response).splitlines()
+        records = {
+            record['title']: record for record in map(json.loads, lines)
+        }
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records['Plov'], {
+            'id': self.recipe.id,
+            'title': 'Plov',
+            'time_minutes': 10,
+            'price': '5.99',
+            'link': '',
+            'tags': ['Asian', 'Dinner'],
+            'ingredients': ['Rice'],
+        })
+        self.assertEqual(records['Toast, with butter']['tags'], [])
+
+    def test_export_csv(self):
+        """Test exporting recipes as csv"""
+        response = self.client.get(EXPORT_URL, {'type': 'csv'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(self._content(response))))
+        self.assertEqual(len(rows), 2)
+        plov = next(row for row in rows if row['title'] == 'Plov')
+        self.assertEqual(plov['tags'], 'Asian|Dinner')
+        self.assertEqual(plov['ingredients'], 'Rice')
+        self.assertEqual(plov['price'], '5.99')
+
+    def test_export_invalid_type(self):
+        """Test exporting with an unknown type returns an error"""
+        response = self.client.get(EXPORT_URL, {'type': 'xml'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_limited_to_user(self):
+        """Test only recipes of the authenticated user are exported"""
+        user2 = create_user('testt2@gmail.com', 'Test12345')
+        create_sample_recipe(user=user2, title='Not mine')
+
+        response = self.client.get(EXPORT_URL)
+
+        self.assertNotIn('Not mine', self._content(response))
+
+    def test_export_in_chunks(self):
+        """Test names are fetched chunk by chunk"""
+        queryset = Recipe.objects.filter(user=self.user).order_by('id')
+
+        with self.assertNumQueries(1 + 2 * 2):
+            # one query opens the cursor, then every chunk of 1 recipe
+            # fetches the names of its tags and ingredients
+            records = list(exports.iter_export_records(queryset, 1))
+
+        self.assertEqual(len(records), 2)
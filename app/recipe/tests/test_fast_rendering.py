@@ -0,0 +1,154 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.renderers import JSONRenderer
+
+from mainapp.models import Recipe, Tag, Ingredient
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user, detail_url
+)
+
+from recipe import fast
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def render(data):
+    """Render data the same way as the API does"""
+    return JSONRenderer().render(data)
+
+
+class FastRenderingTests(AuthenticatedClientMixin, TestCase):
+    """Test that the fast rendering path matches the DRF serializers"""
+
+    def setUp(self):
+        super().setUp()
+        tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ('Vegan', 'Dessert', 'Lunch')
+        ]
+        ingredients = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Salt', 'Sugar', 'Eggs', 'Ünïcode')
+        ]
+        self.recipe1 = create_sample_recipe(
+            user=self.user, title='Cake', link='https://example.com'
+        )
+        # added out of id order, both paths list relations by id
+        for tag in reversed(tags[:2]):
+            self.recipe1.tags.add(tag)
+        for ingredient in (ingredients[2], ingredients[0], ingredients[3],
+                           ingredients[1]):
+            self.recipe1.ingredients.add(ingredient)
+        self.recipe2 = create_sample_recipe(user=self.user, price='12.00')
+        self.recipe2.tags.add(tags[2])
+        create_sample_recipe(user=self.user, title='No relations')
+
+    def test_render_list_identical(self):
+        """Test list output is byte identical to RecipeSerializer"""
+        recipes = Recipe.objects.all().order_by('id')
+
+        expected = render(RecipeSerializer(recipes, many=True).data)
+
+        self.assertEqual(render(fast.render_queryset(recipes)), expected)
+
+    def test_render_detail_identical(self):
+        """Test detail output is byte identical to RecipeDetailSerializer"""
+        recipes = Recipe.objects.all().order_by('id')
+
+        expected = render(RecipeDetailSerializer(recipes, many=True).data)
+        data = fast.render_queryset(recipes, detail=True)
+
+        self.assertEqual(render(data), expected)
+
+    def test_list_endpoint_identical(self):
+        """Test the list endpoint renders like RecipeSerializer"""
+        response = self.client.get(RECIPES_URL)
+
+        recipes = Recipe.objects.filter(user=self.user)
+        expected = render(RecipeSerializer(recipes, many=True).data)
+
+        self.assertEqual(response.content, expected)
+
+    def test_detail_endpoint_identical(self):
+        """Test the detail endpoint renders like RecipeDetailSerializer"""
+        response = self.client.get(detail_url(self.recipe1.id))
+
+        expected = render(RecipeDetailSerializer(self.recipe1).data)
+
+        self.assertEqual(response.content, expected)
+
+    def test_relations_listed_by_id(self):
+        """Test tags and ingredients are listed by id, whatever order they
+           were added in"""
+        ids = sorted(self.recipe1.tags.values_list('id', flat=True))
+
+        detail = self.client.get(detail_url(self.recipe1.id)).data
+        data = RecipeSerializer(self.recipe1).data
+
+        self.assertEqual([tag['id'] for tag in detail['tags']], ids)
+        self.assertEqual(data['tags'], ids)
+        self.assertEqual(
+            data['ingredients'],
+            sorted(self.recipe1.ingredients.values_list('id', flat=True))
+        )
+
+    def test_list_expand(self):
+        """Test ?expand= nests tags/ingredients like details, with one
+           query per relation"""
+        recipes = Recipe.objects.filter(user=self.user)
+        expected = render(RecipeDetailSerializer(recipes, many=True).data)
+
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                RECIPES_URL, {'expand': 'tags,ingredients'}
+            )
+
+        self.assertEqual(response.content, expected)
+
+    def test_list_expand_one_relation(self):
+        """Test only the given relations are expanded, streamed or not"""
+        response = self.client.get(RECIPES_URL, {'expand': 'tags'})
+        streamed = self.client.get(
+            RECIPES_URL, {'expand': 'tags', 'stream': '1'}
+        )
+
+        recipe = next(
+            row for row in response.data if row['id'] == self.recipe1.id
+        )
+        self.assertEqual(recipe['tags'][0]['name'], 'Vegan')
+        self.assertEqual(len(recipe['ingredients']), 4)
+        self.assertIsInstance(recipe['ingredients'][0], int)
+        self.assertEqual(b''.join(streamed.streaming_content),
+                         response.content)
+
+    def test_list_expand_invalid(self):
+        """Test unknown relations are rejected"""
+        response = self.client.get(RECIPES_URL, {'expand': 'tags,user'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail_of_other_user_not_found(self):
+        """Test the detail endpoint does not return other users recipes"""
+        user2 = create_user('testt2@gmail.com', 'Test12345')
+        recipe = create_sample_recipe(user=user2)
+
+        response = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_benchmark_command(self):
+        """Test the benchmark command runs and leaves no data behind"""
+        out = StringIO()
+        call_command('benchmark_rendering', recipes=5, repeat=1, stdout=out)
+
+        self.assertIn('fast path', out.getvalue())
+        # the serializers get prefetched relations, no query per recipe
+        self.assertIn('RecipeSerializer (prefetched): ', out.getvalue())
+        self.assertIn('(3 queries)', out.getvalue())
+        self.assertEqual(Recipe.objects.count(), 3)
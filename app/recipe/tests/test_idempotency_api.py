@@ -0,0 +1,245 @@
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+
+from mainapp import idempotency
+from mainapp.models import IdempotencyKey, Recipe
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user
+)
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+BULK_DELETE_URL = reverse('recipe:recipe-bulk-delete')
+IMPORT_URL = reverse('recipe:recipe-import')
+
+PAYLOAD = {'title': 'Cake', 'time_minutes': 30, 'price': '5.00'}
+
+
+def image_upload_url(recipe_id):
+    """Return recipe image upload URL"""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+class IdempotencyApiTests(AuthenticatedClientMixin, TestCase):
+    """Test POST requests sent with an Idempotency-Key header"""
+
+    def post(self, url, data, key='key-1', **extra):
+        return self.client.post(url, data, HTTP_IDEMPOTENCY_KEY=key, **extra)
+
+    def test_create_replayed(self):
+        """Test a retry gets the first response and creates nothing"""
+        first = self.post(RECIPES_URL, PAYLOAD)
+
+        second = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second[idempotency.REPLAYED_HEADER], 'true')
+        self.assertFalse(first.has_header(idempotency.REPLAYED_HEADER))
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_create_without_key(self):
+        """Test requests without the header are not deduplicated"""
+        self.client.post(RECIPES_URL, PAYLOAD)
+        self.client.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_keys_per_user(self):
+        """Test other users can use the same key"""
+        other = create_user('other@gmail.com', 'Test1234')
+        self.post(RECIPES_URL, PAYLOAD)
+        self.client.force_authenticate(other)
+
+        response = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Recipe.objects.filter(user=other).count(), 1)
+
+    def test_key_reused_for_other_request(self):
+        """Test a key can't be used with another body"""
+        self.post(RECIPES_URL, PAYLOAD)
+
+        response = self.post(RECIPES_URL, dict(PAYLOAD, title='Pie'))
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_invalid_key(self):
+        """Test too long keys are rejected"""
+        response = self.post(RECIPES_URL, PAYLOAD, key='k' * 256)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_failed_request_not_stored(self):
+        """Test the key of a request that raised an error can be retried"""
+        response = self.post(RECIPES_URL, {'title': 'Cake'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.post(RECIPES_URL, {'title': 'Cake'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.has_header(idempotency.REPLAYED_HEADER))
+
+    def test_waits_for_running_request(self):
+        """Test a retry waits for the request in progress, then gets its
+           response"""
+        self.post(RECIPES_URL, PAYLOAD)
+        record = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.update(status_code=None, response=None)
+
+        def finish(seconds):
+            """The first request finishes while the retry is waiting"""
+            record.status_code = status.HTTP_201_CREATED
+            record.response = {'id': 1234}
+            record.save()
+
+        with patch('mainapp.idempotency.time.sleep', side_effect=finish):
+            response = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'id': 1234})
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_running_request_conflict(self):
+        """Test 409 when the request in progress doesn't finish in time"""
+        self.post(RECIPES_URL, PAYLOAD)
+        IdempotencyKey.objects.update(status_code=None, response=None)
+
+        response = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_abandoned_request_runs_again(self):
+        """Test a key whose request never finished is claimed again"""
+        self.post(RECIPES_URL, PAYLOAD)
+        IdempotencyKey.objects.update(
+            status_code=None,
+            created_at=timezone.now() - timedelta(hours=1)
+        )
+
+        response = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 2)
+
+    def test_bulk_delete_replayed(self):
+        """Test a retried bulk delete returns the first result"""
+        recipes = [create_sample_recipe(self.user) for _ in range(2)]
+        payload = {'ids': [recipe.id for recipe in recipes]}
+        self.post(BULK_DELETE_URL, payload, format='json')
+
+        response = self.post(BULK_DELETE_URL, payload, format='json')
+
+        self.assertEqual(response.data, {'deleted': 2})
+
+    def test_import_replayed(self):
+        """Test a retried import doesn't import the recipes twice"""
+        body = b'{"title": "Cake", "time_minutes": 30, "price": "5.00"}\n'
+        for _ in range(2):
+            response = self.post(
+                IMPORT_URL, body, content_type='application/x-ndjson'
+            )
+
+        self.assertEqual(response[idempotency.REPLAYED_HEADER], 'true')
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_upload_image_replayed(self):
+        """Test a retried upload doesn't store the image again"""
+        recipe = create_sample_recipe(self.user)
+        url = image_upload_url(recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as namedtempfile:
+            Image.new('RGB', (10, 10)).save(namedtempfile, format='JPEG')
+            responses = []
+            for _ in range(2):
+                namedtempfile.seek(0)
+                responses.append(self.post(
+                    url, {'image': namedtempfile}, format='multipart'
+                ))
+        recipe.refresh_from_db()
+        self.addCleanup(recipe.image.delete)
+
+        self.assertEqual(responses[1].status_code, status.HTTP_200_OK)
+        self.assertEqual(responses[1].data, responses[0].data)
+        self.assertEqual(responses[1][idempotency.REPLAYED_HEADER], 'true')
+        self.assertTrue(os.path.exists(recipe.image.path))
+
+    def test_large_upload_with_key(self):
+        """Test an upload larger than DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 MB)
+           is accepted and replayed, the body isn't loaded into memory"""
+        recipe = create_sample_recipe(self.user)
+        url = image_upload_url(recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as namedtempfile:
+            # random pixels, so the PNG isn't compressed below 3 MB
+            Image.frombytes('RGB', (1000, 1000), os.urandom(3000000)).save(
+                namedtempfile, format='PNG'
+            )
+            self.assertGreater(namedtempfile.tell(), 2621440)
+            responses = []
+            for _ in range(2):
+                namedtempfile.seek(0)
+                responses.append(self.post(
+                    url, {'image': namedtempfile}, format='multipart'
+                ))
+        recipe.refresh_from_db()
+        self.addCleanup(recipe.image.delete)
+
+        self.assertEqual(responses[0].status_code, status.HTTP_200_OK)
+        self.assertEqual(responses[1].data, responses[0].data)
+        self.assertEqual(responses[1][idempotency.REPLAYED_HEADER], 'true')
+
+    def test_upload_fingerprint_of_file(self):
+        """Test another file sent with the same key is another request"""
+        recipe = create_sample_recipe(self.user)
+        url = image_upload_url(recipe.id)
+        responses = []
+        for color in ('red', 'blue'):
+            with tempfile.NamedTemporaryFile(suffix='.jpg') as namedtempfile:
+                Image.new('RGB', (10, 10), color).save(
+                    namedtempfile, format='JPEG'
+                )
+                namedtempfile.seek(0)
+                responses.append(self.post(
+                    url, {'image': namedtempfile}, format='multipart'
+                ))
+        recipe.refresh_from_db()
+        self.addCleanup(recipe.image.delete)
+
+        self.assertEqual(responses[1].status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_clear_command(self):
+        """Test the command deletes expired keys only"""
+        self.post(RECIPES_URL, PAYLOAD, key='old')
+        self.post(RECIPES_URL, PAYLOAD, key='new')
+        IdempotencyKey.objects.filter(key='old').update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        out = StringIO()
+
+        call_command('clear_idempotency_keys', stdout=out)
+
+        self.assertIn('Deleted 1 idempotency keys', out.getvalue())
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list('key', flat=True)),
+            ['new']
+        )
@@ -0,0 +1,182 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from mainapp.models import Recipe, Tag, Ingredient
+from mainapp.testing import AuthenticatedClientMixin, create_user
+
+from recipe.imports import RecipeImporter
+
+
+IMPORT_URL = reverse('recipe:recipe-import')
+
+
+def ndjson(*records):
+    """Return the records as NDJSON lines"""
+    return '\n'.join(
+        record if isinstance(record, str) else json.dumps(record)
+        for record in records
+    ) + '\n'
+
+
+def sample_record(**params):
+    """Return a valid recipe record"""
+    record = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': '5.99',
+        'tags': ['Lunch'],
+        'ingredients': ['Salt', 'Eggs'],
+    }
+    record.update(params)
+    return record
+
+
+class PublicImportApiTests(TestCase):
+    """Test unauthenticated recipe import"""
+
+    def test_login_required(self):
+        """Test login is required for importing recipes"""
+        response = APIClient().post(IMPORT_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateImportApiTests(AuthenticatedClientMixin, TestCase):
+    """Test importing recipes for the authenticated user"""
+
+    def _post(self, body, **params):
+        url = IMPORT_URL
+        if params:
+            url += '?' + '&'.join(f'{k}={v}' for k, v in params.items())
+        return self.client.post(
+            url, data=body, content_type='application/x-ndjson'
+        )
+
+    def test_import_recipes(self):
+        """Test importing recipes with tags and ingredients by name"""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        body = ndjson(
+            sample_record(title='Omelette'),
+            sample_record(title='Pie', tags=['Dessert', 'Lunch']),
+        )
+
+        response = self._post(body)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['imported'], 2)
+        self.assertEqual(response.data['errors'], [])
+        self.assertEqual(response.data['next_offset'], 2)
+        pie = Recipe.objects.get(user=self.user, title='Pie')
+        self.assertEqual(
+            sorted(pie.tags.values_list('name', flat=True)),
+            ['Dessert', 'Lunch']
+        )
+        self.assertIn(salt, pie.ingredients.all())
+        # existing names are reused, missing ones are created once
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(
+            Ingredient.objects.filter(user=self.user).count(), 2
+        )
+        salt.refresh_from_db()
+        self.assertEqual(salt.recipe_count, 2)
+
+    def test_import_reports_invalid_lines(self):
+        """Test invalid lines are reported without aborting the import"""
+        body = ndjson(
+            sample_record(title='Good'),
+            '{not json',
+            sample_record(title=''),
+            '[1, 2]',
+            sample_record(title='Also good', price='abc'),
+            sample_record(title='Fine'),
+        )
+
+        response = self._post(body)
+
+        self.assertEqual(response.data['imported'], 2)
+        self.assertEqual(response.data['error_count'], 4)
+        self.assertEqual(
+            [error['line'] for error in response.data['errors']],
+            [2, 3, 4, 5]
+        )
+        self.assertIn('title', response.data['errors'][1]['errors'])
+        self.assertEqual(
+            set(Recipe.objects.values_list('title', flat=True)),
+            {'Good', 'Fine'}
+        )
+
+    def test_import_resume_from_offset(self):
+        """Test an import can be resumed from a line offset"""
+        body = ndjson(
+            sample_record(title='First'),
+            sample_record(title='Second'),
+            sample_record(title='Third'),
+        )
+
+        response = self._post(body, offset=2)
+
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(response.data['next_offset'], 3)
+        self.assertEqual(
+            list(Recipe.objects.values_list('title', flat=True)),
+            ['Third']
+        )
+
+    def test_import_invalid_offset(self):
+        """Test an invalid offset returns an error"""
+        # %C2%B2 is a superscript two, a digit that int() doesn't take
+        for offset in ('abc', '-1', '%C2%B2'):
+            response = self._post(ndjson(sample_record()), offset=offset)
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('offset', response.data)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_import_batch_queries(self):
+        """Test every batch is written with a fixed number of queries"""
+        lines = ndjson(*[
+            sample_record(title=f'Recipe {i}', tags=[f'Tag {i}'])
+            for i in range(20)
+        ]).splitlines()
+        importer = RecipeImporter(self.user, batch_size=20)
+
+        # savepoint, recipes insert, then select + insert of names, insert
+        # of through rows and update of recipe counts (one per distinct
+        # count) for both relations, similarity index of the batch (select
+        # of users and ingredients, savepoint, 2 deletes, 2 inserts, release
+        # savepoint), recipes of the counted tags and ingredients and their
+        # versions in the shared cache of details, release savepoint
+        with self.assertNumQueries(1 + 1 + 4 * 2 + 8 + 2 * 2 + 1):
+            result = importer.run(lines)
+
+        self.assertEqual(result['imported'], 20)
+        self.assertEqual(Recipe.tags.through.objects.count(), 20)
+        self.assertEqual(Recipe.ingredients.through.objects.count(), 40)
+
+
+class ImportCommandTests(TestCase):
+    """Test the import_recipes management command"""
+
+    def test_import_command(self):
+        """Test importing a NDJSON file for a user"""
+        user = create_user()
+        out = StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as dump:
+            dump.write(ndjson(sample_record(), '{bad', sample_record()))
+            dump.flush()
+            call_command(
+                'import_recipes', dump.name, email=user.email,
+                batch_size=1, stdout=out, stderr=StringIO()
+            )
+
+        self.assertEqual(Recipe.objects.filter(user=user).count(), 2)
+        self.assertIn('Imported 2 recipes, 1 invalid lines', out.getvalue())
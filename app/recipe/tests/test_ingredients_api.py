@@ -146,6 +146,7 @@ class PrivateIngredientApiTests(TestCase):
 
         response = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
 
+        ingredient1.refresh_from_db()  # recipe_count changed in database
         serializer1 = IngredientSerializer(ingredient1)
         serializer2 = IngredientSerializer(ingredient2)
 
@@ -181,3 +182,15 @@ class PrivateIngredientApiTests(TestCase):
         self.assertEqual(len(response.data), 1)
         # we will return 1, because we assigned only 1 id to two recipes
         # also here id is in int
+
+    def test_retrieve_ingredients_ordered_by_popularity(self):
+        """Test listing ingredients used by most recipes first"""
+        salt = create_sample_ingredient(user=self.user, name='Salt')
+        create_sample_ingredient(user=self.user, name='Saffron')
+        create_sample_recipe(user=self.user).ingredients.add(salt)
+
+        response = self.client.get(INGREDIENTS_URL, {'ordering': 'popular'})
+
+        self.assertEqual(response.data[0]['name'], 'Salt')
+        self.assertEqual(response.data[0]['recipe_count'], 1)
+        self.assertEqual(response.data[1]['recipe_count'], 0)
@@ -0,0 +1,178 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+
+from mainapp.models import Ingredient, PantryIndexGeneration
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user
+)
+
+from recipe import pantry
+
+
+PANTRY_URL = reverse('recipe:recipe-pantry')
+
+
+class PantryIndexTests(TestCase):
+    """Test the bitset index of recipe ingredients"""
+
+    def test_match(self):
+        """Test counting missing ingredients of every recipe"""
+        index = pantry.PantryIndex()
+        index.add_ingredients(1, [10, 11])
+        index.add_ingredients(2, [10, 12, 13])
+        index.add_ingredients(3, [12, 13, 14, 15, 16])
+        index.add_recipe(4)  # no ingredients
+
+        self.assertEqual(index.match({10, 11}), {1: 0, 4: 0})
+        self.assertEqual(
+            index.match({10, 11}, max_missing=2), {1: 0, 2: 2, 4: 0}
+        )
+        self.assertEqual(
+            index.match(set(), max_missing=5),
+            {1: 2, 2: 3, 3: 5, 4: 0}
+        )
+
+    def test_remove_and_reuse_positions(self):
+        """Test removed recipes free their position without leftovers"""
+        index = pantry.PantryIndex()
+        index.add_ingredients(1, [10, 11])
+        index.add_ingredients(2, [10])
+        index.remove_recipe(1)
+        index.add_recipe(3)  # reuses the position of recipe 1
+
+        self.assertEqual(index.match({10}), {2: 0, 3: 0})
+
+        index.remove_ingredients(2, [10])
+        self.assertEqual(index.match(set()), {2: 0, 3: 0})
+        self.assertEqual(index.ingredients, {})
+
+    def test_cache_bounded(self):
+        """Test the least recently used indexes are evicted"""
+        indexes = pantry.PantryIndexCache(max_size=2)
+        for user_id in (-1, -2, -1, -3):
+            indexes.get(user_id)
+
+        self.assertEqual(list(indexes._indexes), [-1, -3])
+
+
+class PantryApiTests(AuthenticatedClientMixin, TestCase):
+    """Test the "what can I cook" endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        pantry.indexes.clear()
+
+        self.eggs = Ingredient.objects.create(user=self.user, name='Eggs')
+        self.milk = Ingredient.objects.create(user=self.user, name='Milk')
+        self.flour = Ingredient.objects.create(user=self.user, name='Flour')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.omelette = create_sample_recipe(self.user, title='Omelette')
+            self.omelette.ingredients.add(self.eggs, self.milk)
+            self.pancakes = create_sample_recipe(self.user, title='Pancakes')
+            self.pancakes.ingredients.add(self.eggs, self.milk, self.flour)
+
+    def _ids(self, response):
+        return [
+            (row['id'], row['missing_ingredients']) for row in response.data
+        ]
+
+    def test_recipes_fully_made(self):
+        """Test only recipes with every ingredient in the pantry"""
+        response = self.client.get(
+            PANTRY_URL, {'pantry': f'{self.eggs.id},{self.milk.id}'}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._ids(response), [(self.omelette.id, [])])
+        self.assertEqual(response.data[0]['title'], 'Omelette')
+
+    def test_recipes_with_missing_ingredients(self):
+        """Test recipes missing at most k ingredients are listed"""
+        response = self.client.get(
+            PANTRY_URL, {'pantry': str(self.eggs.id), 'missing': 2}
+        )
+
+        self.assertEqual(self._ids(response), [
+            (self.omelette.id, [self.milk.id]),
+            (self.pancakes.id, [self.milk.id, self.flour.id]),
+        ])
+
+    def test_index_updated_incrementally(self):
+        """Test the cached index follows changes of recipes"""
+        params = {'pantry': f'{self.eggs.id},{self.milk.id}'}
+        self.client.get(PANTRY_URL, params)  # builds the index
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pancakes.ingredients.remove(self.flour)
+            self.omelette.delete()
+            toast = create_sample_recipe(self.user, title='Toast')
+
+        # no index rebuild, only the generation check and rendering
+        # (recipes and their relations)
+        with self.assertNumQueries(4):
+            response = self.client.get(PANTRY_URL, params)
+
+        self.assertEqual(
+            self._ids(response), [(self.pancakes.id, []), (toast.id, [])]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.milk.delete()
+            self.flour.recipe_set.add(toast)
+
+        response = self.client.get(PANTRY_URL, {'pantry': str(self.eggs.id)})
+        self.assertEqual(self._ids(response), [(self.pancakes.id, [])])
+
+    def test_index_rebuilt_after_other_process_change(self):
+        """Test an outdated index is rebuilt from the database"""
+        params = {'pantry': f'{self.eggs.id},{self.milk.id}'}
+        self.client.get(PANTRY_URL, params)
+        self.pancakes.ingredients.remove(self.flour)  # not committed
+        PantryIndexGeneration.objects.filter(user=self.user).update(
+            generation=1000
+        )
+
+        response = self.client.get(PANTRY_URL, params)
+
+        self.assertEqual(
+            self._ids(response),
+            [(self.omelette.id, []), (self.pancakes.id, [])]
+        )
+
+    def test_change_seen_by_other_process(self):
+        """Test a change committed by one process makes the index kept by
+           another process (another PantryIndexCache) outdated"""
+        other = pantry.PantryIndexCache(max_size=2)
+        ids = {self.eggs.id, self.milk.id}
+        self.assertEqual(set(other.get(self.user.id).match(ids)),
+                         {self.omelette.id})
+        pantry.indexes.get(self.user.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pancakes.ingredients.remove(self.flour)
+
+        self.assertEqual(set(other.get(self.user.id).match(ids)),
+                         {self.omelette.id, self.pancakes.id})
+        self.assertEqual(other.get(self.user.id).match(ids),
+                         pantry.indexes.get(self.user.id).match(ids))
+
+    def test_limited_to_user(self):
+        """Test recipes of other users are never returned"""
+        user2 = create_user('testt2@gmail.com', 'Test12345')
+        create_sample_recipe(user2, title='Water')
+
+        response = self.client.get(PANTRY_URL)
+
+        self.assertEqual(response.data, [])
+
+    def test_invalid_params(self):
+        """Test invalid pantry and missing values return an error"""
+        # \u00b2 is a superscript two, a digit that int() doesn't take
+        for params in ({'pantry': 'a,b'}, {'pantry': '\u00b2'},
+                       {'missing': -1}, {'missing': 100}):
+            response = self.client.get(PANTRY_URL, params)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
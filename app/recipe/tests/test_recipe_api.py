@@ -1,11 +1,15 @@
 import tempfile  # Generates temporary necessary files
 import os  # workinkg with paths
+from io import StringIO
 
 from PIL import Image
 # Helps us to create test images that we can upload to our recipe API
 
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
@@ -254,6 +258,140 @@ class PrivateRecipesApiTests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(len(tags), 0)
 
+    def test_update_recipe_writes_only_diff(self):
+        """Test updates only delete/insert the changed relations"""
+        recipe = create_sample_recipe(user=self.user)
+        tag = create_sample_tag(user=self.user)
+        ingredients = [
+            create_sample_ingredient(user=self.user, name=f'Item {i}')
+            for i in range(3)
+        ]
+        recipe.tags.add(tag)
+        recipe.ingredients.add(*ingredients[:2])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(detail_url(recipe.id), {
+                'tags': [tag.id],
+                'ingredients': [ingredients[1].id, ingredients[2].id],
+            })
+        writes = [
+            query['sql'].split(' (')[0] for query in queries
+            if query['sql'].startswith(('DELETE', 'INSERT'))
+            and 'mainapp_recipe_' in query['sql'].split(' (')[0]
+        ]
+
+        self.assertEqual(writes, [
+            'DELETE FROM "mainapp_recipe_ingredients" WHERE',
+            'INSERT INTO "mainapp_recipe_ingredients"',
+        ])
+        self.assertEqual(
+            sorted(recipe.ingredients.values_list('id', flat=True)),
+            [ingredients[1].id, ingredients[2].id]
+        )
+        ingredients[0].refresh_from_db()
+        ingredients[2].refresh_from_db()
+        self.assertEqual(ingredients[0].recipe_count, 0)
+        self.assertEqual(ingredients[2].recipe_count, 1)
+
+    def test_update_recipe_unchanged_relations(self):
+        """Test relations are only read when they did not change"""
+        recipe = create_sample_recipe(user=self.user)
+        tag = create_sample_tag(user=self.user)
+        recipe.tags.add(tag)
+        request = type('Request', (), {'user': self.user})()
+        serializer = RecipeSerializer(
+            recipe, data={'tags': [tag.id]}, partial=True,
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        # savepoint, update of the recipe, its version in the shared cache
+        # of details, ids of its tags, release
+        with self.assertNumQueries(5):
+            serializer.save()
+
+    def test_benchmark_update_command(self):
+        """Test the update benchmark runs and leaves no data behind"""
+        out = StringIO()
+        call_command('benchmark_recipe_update', ingredients=5, repeat=1,
+                     stdout=out)
+
+        self.assertIn('diff', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_create_recipe_ids_validated_in_bulk(self):
+        """Test ingredient ids are validated with one query"""
+        ingredients = [
+            create_sample_ingredient(user=self.user, name=f'Item {i}')
+            for i in range(30)
+        ]
+        payload = {
+            'title': 'Big salad',
+            'ingredients': [ingredient.id for ingredient in ingredients],
+            'tags': [],
+            'time_minutes': 5,
+            'price': 4.00
+        }
+        request = type('Request', (), {'user': self.user})()
+        serializer = RecipeSerializer(
+            data=payload, context={'request': request}
+        )
+
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+
+        self.assertEqual(serializer.validated_data['ingredients'], ingredients)
+
+    def test_create_recipe_reports_all_invalid_ids(self):
+        """Test every missing id and ids of other users are rejected"""
+        user2 = create_user(email='other@gmail.com', password='pass1234')
+        tag = create_sample_tag(user=self.user)
+        other_tag = create_sample_tag(user=user2, name='Other')
+        payload = {
+            'title': 'Cake',
+            'tags': [tag.id, other_tag.id, 999999],
+            'time_minutes': 30,
+            'price': 5.00
+        }
+
+        response = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data['tags']), 2)
+        self.assertIn(str(other_tag.id), response.data['tags'][0])
+        self.assertIn('999999', response.data['tags'][1])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_create_recipe_rejects_ids_of_other_types(self):
+        """Test floats, booleans and non digit strings are not taken as
+           ids"""
+        tag = create_sample_tag(user=self.user)
+        for tags in ([tag.id + 0.5], [True], ['1.0'], [None], [[tag.id]]):
+            payload = {
+                'title': 'Cake', 'tags': tags, 'ingredients': [],
+                'time_minutes': 30, 'price': 5.00
+            }
+
+            response = self.client.post(RECIPES_URL, payload, format='json')
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST, tags)
+            self.assertIn('Incorrect type', str(response.data['tags']))
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_update_recipe_rejects_other_users_ids(self):
+        """Test updates only accept tags of the user"""
+        user2 = create_user(email='other@gmail.com', password='pass1234')
+        recipe = create_sample_recipe(user=self.user)
+        other_tag = create_sample_tag(user=user2, name='Other')
+
+        response = self.client.patch(
+            detail_url(recipe.id), {'tags': [other_tag.id]}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(recipe.tags.exists())
+
 
 class RecipeImageUploadTests(TestCase):
     """Test managing recipe image upload"""
@@ -0,0 +1,66 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+
+from mainapp.models import Tag
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user, detail_url
+)
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+BULK_DELETE_URL = reverse('recipe:recipe-bulk-delete')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class RecipeDeleteApiTests(AuthenticatedClientMixin, TestCase):
+    """Test deleting recipes"""
+
+    def test_delete_recipe_hidden(self):
+        """Test a deleted recipe is hidden, its row is reaped later"""
+        recipe = create_sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe.tags.add(tag)
+
+        response = self.client.delete(detail_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        recipe.refresh_from_db()
+        self.assertIsNotNone(recipe.deleted_at)
+        self.assertEqual(self.client.get(RECIPES_URL).data, [])
+        self.assertEqual(
+            self.client.get(detail_url(recipe.id)).status_code,
+            status.HTTP_404_NOT_FOUND
+        )
+        response = self.client.get(TAGS_URL, {'assigned_only': 1})
+        self.assertEqual(response.data, [])
+
+    def test_bulk_delete(self):
+        """Test many recipes of the user are deleted at once"""
+        user2 = create_user('testt2@gmail.com', 'Test12345')
+        recipes = [create_sample_recipe(self.user) for _ in range(3)]
+        other = create_sample_recipe(user2)
+
+        response = self.client.post(BULK_DELETE_URL, {
+            'ids': [recipes[0].id, recipes[1].id, other.id]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertEqual(
+            [r['id'] for r in self.client.get(RECIPES_URL).data],
+            [recipes[2].id]
+        )
+        other.refresh_from_db()
+        self.assertIsNone(other.deleted_at)
+
+    def test_bulk_delete_invalid(self):
+        """Test invalid ids return an error"""
+        for payload in ({}, {'ids': []}, {'ids': ['a']}):
+            response = self.client.post(
+                BULK_DELETE_URL, payload, format='json'
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
@@ -0,0 +1,77 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from mainapp.models import Ingredient
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user
+)
+
+
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+
+
+class PublicShoppingListApiTests(TestCase):
+    """Test unauthenticated shopping list requests"""
+
+    def test_login_required(self):
+        """Test login is required for the shopping list"""
+        response = APIClient().get(SHOPPING_LIST_URL, {'ids': '1'})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateShoppingListApiTests(AuthenticatedClientMixin, TestCase):
+    """Test the shopping list of the authenticated user"""
+
+    def setUp(self):
+        super().setUp()
+        self.eggs = Ingredient.objects.create(user=self.user, name='Eggs')
+        self.milk = Ingredient.objects.create(user=self.user, name='Milk')
+        self.flour = Ingredient.objects.create(user=self.user, name='Flour')
+        self.omelette = create_sample_recipe(self.user, title='Omelette')
+        self.omelette.ingredients.add(self.eggs, self.milk)
+        self.pancakes = create_sample_recipe(self.user, title='Pancakes')
+        self.pancakes.ingredients.add(self.eggs, self.milk, self.flour)
+
+    def test_merged_ingredients(self):
+        """Test ingredients are merged and counted with one query"""
+        ids = f'{self.omelette.id},{self.pancakes.id},{self.omelette.id}'
+
+        with self.assertNumQueries(1):
+            response = self.client.get(SHOPPING_LIST_URL, {'ids': ids})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'id': self.eggs.id, 'name': 'Eggs', 'recipe_count': 2},
+            {'id': self.flour.id, 'name': 'Flour', 'recipe_count': 1},
+            {'id': self.milk.id, 'name': 'Milk', 'recipe_count': 2},
+        ])
+
+    def test_recipes_of_other_users_ignored(self):
+        """Test recipes of other users are left out"""
+        user2 = create_user('testt2@gmail.com', 'Test12345')
+        salt = Ingredient.objects.create(user=user2, name='Salt')
+        other = create_sample_recipe(user2, title='Salty')
+        other.ingredients.add(salt)
+
+        response = self.client.get(
+            SHOPPING_LIST_URL, {'ids': f'{self.omelette.id},{other.id}'}
+        )
+
+        self.assertEqual(
+            [row['name'] for row in response.data], ['Eggs', 'Milk']
+        )
+
+    def test_invalid_ids(self):
+        """Test missing or invalid ids return an error"""
+        too_many = ','.join(str(pk) for pk in range(1, 102))
+        # \u00b2 is a superscript two, a digit that int() doesn't take
+        for params in ({}, {'ids': ''}, {'ids': '1,a'}, {'ids': '\u00b2'},
+                       {'ids': too_many}):
+            response = self.client.get(SHOPPING_LIST_URL, params)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
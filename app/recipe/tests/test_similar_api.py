@@ -0,0 +1,185 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+
+from mainapp.deletion import soft_delete_recipes
+from mainapp.models import Recipe, Ingredient, RecipeSignature, \
+    RecipeLSHBucket
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user
+)
+
+from recipe import similarity
+
+
+def similar_url(recipe_id):
+    """Return the similar recipes URL of a recipe"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+class MinHashTests(TestCase):
+    """Test MinHash signatures and LSH banding"""
+
+    def test_signature_deterministic(self):
+        """Test the same set always has the same signature and buckets"""
+        first = similarity.minhash_signature({1, 2, 3})
+        second = similarity.minhash_signature({3, 2, 1})
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), similarity.NUM_HASHES)
+        self.assertEqual(
+            similarity.band_buckets(first), similarity.band_buckets(second)
+        )
+
+    def test_signature_estimates_jaccard(self):
+        """Test the share of equal minhashes is close to the similarity"""
+        first = similarity.minhash_signature(set(range(0, 100)))
+        second = similarity.minhash_signature(set(range(50, 150)))
+
+        equal = sum(a == b for a, b in zip(first, second)) / len(first)
+
+        # real Jaccard similarity is 50 / 150
+        self.assertAlmostEqual(equal, 1 / 3, delta=0.2)
+
+    def test_jaccard(self):
+        """Test the exact Jaccard similarity"""
+        self.assertEqual(similarity.jaccard({1, 2}, {2, 3}), 1 / 3)
+        self.assertEqual(similarity.jaccard(set(), set()), 0.0)
+
+
+class SimilarRecipesApiTests(AuthenticatedClientMixin, TestCase):
+    """Test the similar recipes endpoint"""
+    # the reaper and the commands visit every shard (DB_SHARDS)
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.ingredients = [
+            Ingredient.objects.create(user=self.user, name=f'Item {i}')
+            for i in range(10)
+        ]
+
+    def _recipe(self, title, indexes, user=None):
+        user = user or self.user
+        recipe = create_sample_recipe(user=user, title=title)
+        recipe.ingredients.add(*[self.ingredients[i] for i in indexes])
+        return recipe
+
+    def test_index_updated_on_ingredient_changes(self):
+        """Test signatures and buckets follow the ingredients"""
+        recipe = self._recipe('Soup', [0, 1, 2])
+
+        signature = RecipeSignature.objects.get(recipe=recipe)
+        self.assertEqual(
+            signature.minhashes,
+            similarity.minhash_signature(
+                {i.id for i in self.ingredients[:3]}
+            )
+        )
+        self.assertEqual(
+            RecipeLSHBucket.objects.filter(recipe=recipe).count(),
+            similarity.BANDS
+        )
+
+        recipe.ingredients.remove(self.ingredients[0])
+        signature.refresh_from_db()
+        self.assertEqual(
+            signature.minhashes,
+            similarity.minhash_signature(
+                {i.id for i in self.ingredients[1:3]}
+            )
+        )
+
+        recipe.ingredients.clear()
+        self.assertFalse(RecipeSignature.objects.filter(recipe=recipe))
+        self.assertFalse(RecipeLSHBucket.objects.filter(recipe=recipe))
+
+    def test_similar_recipes(self):
+        """Test the most similar recipes are returned first"""
+        recipe = self._recipe('Soup', [0, 1, 2, 3])
+        same = self._recipe('Same soup', [0, 1, 2, 3])
+        # similarity 0.8, it shares a band with probability 1 - (1 - 0.8^4)^16
+        close = self._recipe('Close soup', [0, 1, 2, 3, 4])
+        self._recipe('Cake', [7, 8, 9])
+
+        response = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(r['id'], r['similarity']) for r in response.data],
+            [(same.id, 1.0), (close.id, 0.8)]
+        )
+        self.assertEqual(response.data[0]['title'], 'Same soup')
+
+    def test_similar_limited_to_user(self):
+        """Test recipes of other users are never returned"""
+        user2 = create_user('testt2@gmail.com', 'Test12345')
+        recipe = self._recipe('Soup', [0, 1])
+        self._recipe('Copied soup', [0, 1], user=user2)
+
+        response = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(response.data, [])
+
+    def test_similar_excludes_deleted_recipes(self):
+        """Test recipes marked as deleted are never returned"""
+        recipe = self._recipe('Soup', [0, 1])
+        deleted = self._recipe('Deleted soup', [0, 1])
+        soft_delete_recipes(Recipe.objects.filter(pk=deleted.pk))
+
+        response = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(response.data, [])
+
+    def test_similar_stale_index(self):
+        """Test candidates of an outdated index that are gone, deleted or
+           of another user are skipped"""
+        recipe = self._recipe('Soup', [0, 1])
+        similar = self._recipe('Stew', [0, 1])
+        deleted = self._recipe('Broth', [0, 1])
+        soft_delete_recipes(Recipe.objects.filter(pk=deleted.pk))
+        other = create_sample_recipe(
+            create_user('other@gmail.com', 'Test1234')
+        )
+        stale = [(deleted.id, 1.0), (other.id, 1.0), (0, 1.0),
+                 (similar.id, 0.5)]
+
+        with patch('recipe.views.similarity.similar_recipes',
+                   return_value=stale):
+            response = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in response.data], [similar.id])
+
+    def test_similar_invalid_limit(self):
+        """Test an invalid limit returns an error"""
+        recipe = self._recipe('Soup', [0])
+
+        # %C2%B2 is a superscript two, a digit that int() doesn't take
+        for limit in ('0', '101', 'abc', '%C2%B2'):
+            response = self.client.get(
+                similar_url(recipe.id) + f'?limit={limit}'
+            )
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST, limit)
+            self.assertIn('limit', response.data)
+
+    def test_rebuild_command(self):
+        """Test the rebuild command indexes every recipe"""
+        recipe = self._recipe('Soup', [0, 1])
+        RecipeSignature.objects.all().delete()
+        RecipeLSHBucket.objects.all().delete()
+
+        call_command('rebuild_similarity_index', stdout=StringIO())
+
+        self.assertTrue(RecipeSignature.objects.filter(recipe=recipe))
+        self.assertEqual(
+            RecipeLSHBucket.objects.filter(recipe=recipe).count(),
+            similarity.BANDS
+        )
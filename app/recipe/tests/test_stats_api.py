@@ -0,0 +1,159 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from mainapp.models import Tag
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user
+)
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+STATS_URL = reverse('recipe:recipe-stats')
+
+
+class RecipeRangeFilterTests(AuthenticatedClientMixin, TestCase):
+    """Test filtering recipes by price and time ranges"""
+
+    def setUp(self):
+        super().setUp()
+        self.quick_cheap = create_sample_recipe(
+            user=self.user, title='Toast', time_minutes=5, price=2.50
+        )
+        self.quick_pricey = create_sample_recipe(
+            user=self.user, title='Caviar', time_minutes=5, price=99.00
+        )
+        self.slow_cheap = create_sample_recipe(
+            user=self.user, title='Plov', time_minutes=90, price=8.00
+        )
+
+    def _titles(self, response):
+        return sorted(recipe['title'] for recipe in response.data)
+
+    def test_filter_by_price_range(self):
+        """Test filtering recipes by minimum and maximum price"""
+        response = self.client.get(RECIPES_URL, {'price_max': '10'})
+        self.assertEqual(self._titles(response), ['Plov', 'Toast'])
+
+        response = self.client.get(
+            RECIPES_URL, {'price_min': '2.50', 'price_max': '8.00'}
+        )
+        self.assertEqual(self._titles(response), ['Plov', 'Toast'])
+
+        response = self.client.get(RECIPES_URL, {'price_min': '9'})
+        self.assertEqual(self._titles(response), ['Caviar'])
+
+    def test_bounds_outside_prices(self):
+        """Test bounds prices can't have are valid, ie. price_max=1000"""
+        response = self.client.get(
+            RECIPES_URL, {'price_min': '0.001', 'price_max': '1000'}
+        )
+        self.assertEqual(self._titles(response), ['Caviar', 'Plov', 'Toast'])
+
+        response = self.client.get(RECIPES_URL, {'price_min': '100000'})
+        self.assertEqual(response.data, [])
+
+    def test_filter_by_time_and_price(self):
+        """Test 'under 30 minutes and under $10'"""
+        response = self.client.get(
+            RECIPES_URL, {'time_max': 30, 'price_max': 10}
+        )
+
+        self.assertEqual(self._titles(response), ['Toast'])
+
+    def test_invalid_range_values(self):
+        """Test invalid range values return an error"""
+        for params in ({'price_max': 'cheap'}, {'time_min': '1.5'},
+                       {'price_min': 10, 'price_max': 5},
+                       {'time_min': 60, 'time_max': 30}):
+            response = self.client.get(RECIPES_URL, params)
+
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST, params
+            )
+
+    def test_ranges_ignored_for_single_recipes(self):
+        """Test range params only filter lists, not updates or deletes"""
+        url = reverse('recipe:recipe-detail', args=[self.quick_pricey.id])
+
+        response = self.client.patch(url + '?price_max=x', {'title': 'Roe'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete(url + '?price_max=10')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class RecipeStatsApiTests(AuthenticatedClientMixin, TestCase):
+    """Test the recipe statistics endpoint"""
+
+    def test_login_required(self):
+        """Test login is required for the stats"""
+        response = APIClient().get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_stats_single_query(self):
+        """Test stats are computed by one aggregate query"""
+        create_sample_recipe(user=self.user, time_minutes=10, price=4.00)
+        create_sample_recipe(user=self.user, time_minutes=20, price=6.00)
+        create_sample_recipe(user=self.user, time_minutes=150, price=60.00)
+        other = create_user('testt2@gmail.com', 'Test12345')
+        create_sample_recipe(user=other, price=1.00)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        price = response.data['price']
+        self.assertEqual(price['min'], '4.00')
+        self.assertEqual(price['max'], '60.00')
+        self.assertEqual(price['avg'], '23.33')
+        self.assertEqual(
+            [bucket['count'] for bucket in price['histogram']],
+            [1, 1, 0, 0, 1]
+        )
+        self.assertEqual(price['histogram'][0]['from'], None)
+        self.assertEqual(price['histogram'][0]['to'], '5.00')
+        time = response.data['time_minutes']
+        self.assertEqual((time['min'], time['max']), (10, 150))
+        self.assertEqual(time['avg'], 60)
+        self.assertEqual(
+            [bucket['count'] for bucket in time['histogram']],
+            [1, 1, 0, 0, 1]
+        )
+
+    def test_stats_custom_buckets_and_filters(self):
+        """Test custom bucket edges and list filters"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = create_sample_recipe(user=self.user, price=4.00)
+        recipe.tags.add(tag)
+        create_sample_recipe(user=self.user, price=6.00)
+
+        response = self.client.get(
+            STATS_URL, {'price_buckets': '3,5', 'tags': str(tag.id)}
+        )
+
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(
+            [(b['from'], b['to'], b['count'])
+             for b in response.data['price']['histogram']],
+            [(None, '3.00', 0), ('3.00', '5.00', 1), ('5.00', None, 0)]
+        )
+
+    def test_stats_empty(self):
+        """Test stats of a user without recipes"""
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.data['count'], 0)
+        self.assertIsNone(response.data['price']['avg'])
+
+    def test_stats_invalid_buckets(self):
+        """Test invalid bucket edges return an error"""
+        for edges in ('5,abc', '10,5', '1000000', 'nan'):
+            response = self.client.get(STATS_URL, {'price_buckets': edges})
+
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST, edges
+            )
@@ -0,0 +1,141 @@
+import asyncio
+import json
+
+from asgiref.sync import async_to_sync
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from mainapp.models import Recipe, Tag
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user
+)
+
+from app.asgi import application
+from recipe import streaming
+from recipe.serializers import RecipeSerializer
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+EXPORT_URL = reverse('recipe:recipe-export')
+
+
+class StreamingListTests(AuthenticatedClientMixin, TestCase):
+    """Test streamed recipe lists"""
+
+    def setUp(self):
+        super().setUp()
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        for i in range(5):
+            recipe = create_sample_recipe(user=self.user, title=f'Dish {i}')
+            recipe.tags.add(tag)
+
+    def test_stream_list_identical(self):
+        """Test streamed list is byte identical to the rendered list"""
+        response = self.client.get(RECIPES_URL, {'stream': 1})
+
+        recipes = Recipe.objects.filter(user=self.user)
+        expected = JSONRenderer().render(
+            RecipeSerializer(recipes, many=True).data
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(b''.join(response.streaming_content), expected)
+
+    def test_stream_list_in_chunks(self):
+        """Test the list is encoded chunk by chunk"""
+        recipes = Recipe.objects.filter(user=self.user).order_by('id')
+
+        pieces = list(streaming.iter_json_list(recipes, chunk_size=2))
+        expected = JSONRenderer().render(
+            RecipeSerializer(recipes, many=True).data
+        )
+
+        # opening bracket, 3 chunks (2 + 2 + 1 recipes), closing bracket
+        self.assertEqual(len(pieces), 5)
+        self.assertEqual(b''.join(pieces), expected)
+
+    def test_stream_empty_list(self):
+        """Test streaming a list without recipes"""
+        recipes = Recipe.objects.none()
+
+        body = b''.join(streaming.iter_json_list(recipes))
+
+        self.assertEqual(body, b'[]')
+
+    def test_stream_list_limited_to_user(self):
+        """Test streamed list returns only the recipes of the user"""
+        user2 = create_user('testt2@gmail.com', 'Test12345')
+        create_sample_recipe(user=user2, title='Not mine')
+
+        response = self.client.get(RECIPES_URL, {'stream': 'true'})
+
+        self.assertNotIn(b'Not mine', b''.join(response.streaming_content))
+
+
+@async_to_sync
+async def asgi_get(path, query_string, token):
+    """Return the status and body of a GET request to the ASGI application
+       (run in the thread of the test, so it sees the test's data)"""
+    received = asyncio.Queue()
+    await received.put({'type': 'http.request', 'body': b''})
+    sent = asyncio.Queue()
+    # like Django's test client, keep the connection of the test open
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        await application({
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'query_string': query_string,
+            'root_path': '',
+            'headers': [
+                (b'host', b'testserver'),
+                (b'authorization', f'Token {token}'.encode()),
+            ],
+            'client': ('127.0.0.1', 50000),
+            'server': ('testserver', 80),
+        }, received.get, sent.put)
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+    start = sent.get_nowait()
+    body = b''
+    while not sent.empty():
+        body += sent.get_nowait().get('body', b'')
+    return start['status'], body
+
+
+class AsgiStreamingTests(TestCase):
+    """Test streamed responses served by the ASGI application"""
+
+    def setUp(self):
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user).key
+        for i in range(3):
+            create_sample_recipe(user=self.user, title=f'Dish {i}')
+
+    def test_stream_list(self):
+        """Test ?stream=1 lists recipes under ASGI"""
+        status_code, body = asgi_get(RECIPES_URL, b'stream=1', self.token)
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(body)), 3)
+
+    def test_export(self):
+        """Test recipes are exported under ASGI"""
+        status_code, body = asgi_get(EXPORT_URL, b'', self.token)
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(len(body.splitlines()), 3)
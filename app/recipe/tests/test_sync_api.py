@@ -0,0 +1,173 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from mainapp.deletion import Reaper, soft_delete_recipes
+from mainapp.models import Recipe, Tag, Ingredient, Tombstone
+from mainapp.testing import (
+    AuthenticatedClientMixin, create_sample_recipe, create_user
+)
+from recipe import sync
+
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def ids(rows):
+    return [row['id'] for row in rows]
+
+
+class PublicSyncApiTests(TestCase):
+    """Test unauthenticated sync requests"""
+
+    def test_login_required(self):
+        """Test login is required to sync"""
+        response = APIClient().get(SYNC_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(RECIPE_SYNC_OVERLAP=0)
+class PrivateSyncApiTests(AuthenticatedClientMixin, TestCase):
+    """Test syncing the changes of the authenticated user"""
+    # the reaper and the commands visit every shard (DB_SHARDS)
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self.recipe = create_sample_recipe(self.user)
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.salt)
+
+        other = create_user('other@gmail.com', 'Test1234')
+        Tag.objects.create(user=other, name='Other')
+        create_sample_recipe(other)
+
+    def sync(self, cursor=None):
+        params = {'since': cursor} if cursor else {}
+        response = self.client.get(SYNC_URL, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_full_sync(self):
+        """Test a sync without cursor returns every row of the user with
+           one query per model and relation"""
+        with self.assertNumQueries(5):
+            data = self.sync()
+
+        self.assertEqual(ids(data['recipes']), [self.recipe.id])
+        self.assertEqual(data['recipes'][0]['tags'], [self.tag.id])
+        self.assertEqual(data['tags'], [
+            {'id': self.tag.id, 'name': 'Vegan', 'recipe_count': 1}
+        ])
+        self.assertEqual(ids(data['ingredients']), [self.salt.id])
+        self.assertEqual(
+            data['deleted'], {'recipes': [], 'tags': [], 'ingredients': []}
+        )
+
+    def test_nothing_changed(self):
+        """Test a sync right after another one returns nothing"""
+        cursor = self.sync()['cursor']
+
+        data = self.sync(cursor)
+
+        self.assertEqual(
+            (data['recipes'], data['tags'], data['ingredients']),
+            ([], [], [])
+        )
+        self.assertGreaterEqual(int(data['cursor']), int(cursor))
+
+    def test_changed_rows(self):
+        """Test created and changed rows are returned"""
+        cursor = self.sync()['cursor']
+        self.tag.name = 'Vegetarian'
+        self.tag.save()
+        pepper = Ingredient.objects.create(user=self.user, name='Pepper')
+
+        data = self.sync(cursor)
+
+        self.assertEqual(data['tags'][0]['name'], 'Vegetarian')
+        self.assertEqual(ids(data['ingredients']), [pepper.id])
+        self.assertEqual(data['recipes'], [])
+
+    def test_m2m_change(self):
+        """Test changing ingredients of a recipe changes the recipe and
+           the recipe counts of the ingredients"""
+        cursor = self.sync()['cursor']
+        pepper = Ingredient.objects.create(user=self.user, name='Pepper')
+        cursor_after_create = self.sync(cursor)['cursor']
+
+        self.recipe.ingredients.add(pepper)
+
+        data = self.sync(cursor_after_create)
+        self.assertEqual(ids(data['recipes']), [self.recipe.id])
+        self.assertEqual(data['recipes'][0]['ingredients'],
+                         [self.salt.id, pepper.id])
+        self.assertEqual(data['ingredients'], [
+            {'id': pepper.id, 'name': 'Pepper', 'recipe_count': 1}
+        ])
+
+    def test_deleted_rows(self):
+        """Test deleted recipes and tags are reported"""
+        cursor = self.sync()['cursor']
+        tag_id = self.tag.id
+
+        soft_delete_recipes(Recipe.objects.filter(pk=self.recipe.pk))
+        self.tag.delete()
+
+        data = self.sync(cursor)
+        self.assertEqual(data['recipes'], [])
+        self.assertEqual(data['deleted']['recipes'], [self.recipe.id])
+        self.assertEqual(data['deleted']['tags'], [tag_id])
+
+        # the reaper deleting the recipe for good leaves no other tombstone
+        Reaper().run()
+        self.assertEqual(Tombstone.objects.filter(model='recipe').count(), 1)
+
+    def test_expired_cursor(self):
+        """Test cursors older than the tombstones are rejected"""
+        cursor = sync.encode_cursor(timezone.now() - timedelta(days=60))
+
+        response = self.client.get(SYNC_URL, {'since': cursor})
+
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_invalid_cursor(self):
+        """Test invalid cursors are rejected"""
+        for cursor in ('abc', '9' * 30):
+            response = self.client.get(SYNC_URL, {'since': cursor})
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(RECIPE_SYNC_OVERLAP=60)
+    def test_overlap(self):
+        """Test the last changes before a sync are sent again, in case
+           their transaction was still running"""
+        cursor = self.sync()['cursor']
+
+        data = self.sync(cursor)
+
+        self.assertEqual(ids(data['recipes']), [self.recipe.id])
+
+    def test_reap_expired_tombstones(self):
+        """Test the reaper deletes expired tombstones only"""
+        Tombstone.objects.create(
+            user=self.user, model='tag', object_id=1,
+            deleted_at=timezone.now() - timedelta(days=60)
+        )
+        Tombstone.objects.create(user=self.user, model='tag', object_id=2)
+
+        deleted = Reaper().run()
+
+        self.assertEqual(deleted, {'tombstones': 1})
+        self.assertEqual(
+            list(Tombstone.objects.values_list('object_id', flat=True)), [2]
+        )
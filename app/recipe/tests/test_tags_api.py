@@ -154,6 +154,7 @@ class PrivateTagsApiTests(TestCase):
         # will filter by tags that are assigned only (to recipes)
         # 1 means True, 0 means False(default)
 
+        tag1.refresh_from_db()  # recipe_count changed in database
         serializer1 = TagSerializer(tag1)
         serializer2 = TagSerializer(tag2)
 
@@ -188,3 +189,30 @@ class PrivateTagsApiTests(TestCase):
         self.assertEqual(len(response.data), 1)
         # we will return 1, because we assigned only 1 id to two recipes
         # also here id is in int
+
+    # ------------------------Ordering by popularity------------------------ #
+    # ie. .../tags/?ordering=popular
+
+    def test_retrieve_tags_ordered_by_popularity(self):
+        """Test listing tags used by most recipes first"""
+        rare = create_sample_tag(user=self.user, name='Rare')
+        popular = create_sample_tag(user=self.user, name='Popular')
+        create_sample_tag(user=self.user, name='Unused')
+        for title in ('Soup', 'Salad'):
+            create_sample_recipe(user=self.user, title=title).tags.add(
+                popular
+            )
+        create_sample_recipe(user=self.user).tags.add(rare)
+
+        response = self.client.get(TAGS_URL, {'ordering': 'popular'})
+
+        self.assertEqual(
+            [(tag['name'], tag['recipe_count']) for tag in response.data],
+            [('Popular', 2), ('Rare', 1), ('Unused', 0)]
+        )
+
+    def test_retrieve_tags_invalid_ordering(self):
+        """Test an unknown ordering returns an error"""
+        response = self.client.get(TAGS_URL, {'ordering': 'random'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,5 +1,10 @@
+from django.db.models import Count
+from django.http import Http404
+
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework import viewsets, mixins, status
 # mixins provide only create, list, retrieve operations of ViewSet
 from rest_framework.authentication import TokenAuthentication
@@ -7,14 +12,23 @@ from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 # in order to use API endpoint user should authenticated
 
-from . import serializers
+from . import serializers, fast, streaming, exports, imports, similarity, \
+    pantry, caching, sync
+from .stats import recipe_stats
 from mainapp.models import Tag, Ingredient, Recipe
+from mainapp.counts import count_rows, set_count_headers
+from mainapp.deletion import soft_delete_recipes
+from mainapp.idempotency import idempotent
+from mainapp.sharding import ShardedViewMixin
 
 
 # We can also put viewsets.ModelViewSet, or we can mention individually those
 # that are necessary for us. RetrieveModelMixin we mentioned it in order to
 # get a specific item of the object. Ie, tags: 1,4,5 (ids of tags)
-class BaseRecipeAttrsViewSet(viewsets.GenericViewSet,
+# ShardedViewMixin runs the queries of the request on the database of the
+# user's rows (mainapp/sharding.py)
+class BaseRecipeAttrsViewSet(ShardedViewMixin,
+                             viewsets.GenericViewSet,
                              mixins.ListModelMixin,
                              mixins.CreateModelMixin,
                              mixins.RetrieveModelMixin):
@@ -43,12 +57,19 @@ class BaseRecipeAttrsViewSet(viewsets.GenericViewSet,
         )
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            queryset = queryset.filter(
+                recipe__isnull=False, recipe__deleted_at__isnull=True
+            )
             # this will return/filter tags/ingredients that are only assigned
             # to recipes
+        # ordering=popular lists the most used tags/ingredients first
+        ordering = self.request.query_params.get('ordering')
+        if ordering not in (None, 'popular'):
+            raise ValidationError({'ordering': ['Expected "popular".']})
+        order_by = ('-recipe_count', 'name') if ordering else ('-name',)
         return queryset.filter(
             user=self.request.user
-            ).order_by('-name').distinct()
+            ).order_by(*order_by).distinct()
         # request will have 'user' attached to it because
         # authentication_classes take care of authentication of user and
         # assignning it(user) to request. '.filter()' will filter by
@@ -67,6 +88,12 @@ class BaseRecipeAttrsViewSet(viewsets.GenericViewSet,
     # then it will filter by tags/ingredients that are assigned only to
     # scecific recipe(s).
 
+    def list(self, request, *args, **kwargs):
+        """Return the list with its number of items in X-Total-Count"""
+        response = super().list(request, *args, **kwargs)
+        # every item is in the response, so the count is exact and free
+        return set_count_headers(response, len(response.data), True)
+
     def perform_create(self, serializer):
         """Create a new tag/ingredient or any object that invokes
            this function"""
@@ -92,7 +119,7 @@ class IngredientViewSet(BaseRecipeAttrsViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ShardedViewMixin, viewsets.ModelViewSet):
     """Manage recipes in the database, .create(), .retrieve(), .list(),
        .update(), .partial_update(), .destroy()"""
 
@@ -100,6 +127,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated, )
     queryset = Recipe.objects.all()
     serializer_class = serializers.RecipeSerializer
+    throttle_scope = 'recipes'  # rate of mainapp.throttling per endpoint
 
     # helper function
     def _params_str_to_ints(self, qs):
@@ -107,6 +135,34 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return list(map(int, qs.split(',')))
         # It is the same as [int(str_id) for str_id in qs.split(',')]
 
+    # helper function
+    def _filter_ranges(self, queryset):
+        """Filter by price and time ranges, ie. ?price_max=10&time_max=30"""
+        params = serializers.RecipeRangeFilterSerializer(
+            data=self.request.query_params
+        )
+        params.is_valid(raise_exception=True)  # invalid values => 400
+        lookups = {
+            'price_min': 'price__gte',
+            'price_max': 'price__lte',
+            'time_min': 'time_minutes__gte',
+            'time_max': 'time_minutes__lte',
+        }
+        return queryset.filter(**{
+            lookups[param]: value
+            for param, value in params.validated_data.items()
+        })
+
+    # overridden function. Range filters only apply to lists of recipes,
+    # so ie. a PUT with a stray ?price_max=x doesn't fail with 400
+    # (get_object() filters the queryset too)
+    def filter_queryset(self, queryset):
+        """Filter lists of recipes by price and time ranges"""
+        queryset = super().filter_queryset(queryset)
+        if self.action in ('list', 'stats', 'export'):
+            queryset = self._filter_ranges(queryset)
+        return queryset
+
     # overridden function
     def get_queryset(self):
         """Retrieve objects to current authenticated user"""
@@ -125,7 +181,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(ingredients__id__in=ingredient_ids)
     # dictionary containing all of query params that are provided in request
     # ie. [tags, ingredients, ...] => these are all queries that contain objcs
-        return queryset.filter(user=self.request.user)
+        # recipes marked as deleted are hidden until they are reaped
+        return queryset.filter(
+            user=self.request.user, deleted_at__isnull=True
+        )
 
     # overridden function.
     # there are couple of actions available by default:
@@ -146,17 +205,118 @@ class RecipeViewSet(viewsets.ModelViewSet):
     # but it could be repetitive. That's why i just overrided the default
     # serializer with get_serializer_class()(new seraializer)
 
+    # overridden functions. list and retrieve only read data, so instead of
+    # creating a model instance and serializer fields per recipe, rows are
+    # rendered straight from the database by recipe/fast.py. The output is
+    # exactly the same as RecipeSerializer/RecipeDetailSerializer.
+    def list(self, request, *args, **kwargs):
+        """Return the list of recipes of the current user"""
+        queryset = self.filter_queryset(self.get_queryset())
+        # ie. .../recipes/?expand=tags renders tags like in details, with
+        # one grouped query for all recipes instead of ids only
+        params = serializers.RecipeExpandParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+        expand = params.validated_data.get('expand', set())
+        if streaming.stream_requested(request):
+            # ie. .../recipes/?stream=1 renders the list chunk by chunk,
+            # the count is known before it, exact or estimated by Postgres
+            # for large lists (mainapp/counts.py)
+            return set_count_headers(
+                streaming.StreamingJSONListResponse(queryset, expand=expand),
+                *count_rows(queryset)
+            )
+        data = fast.render_queryset(queryset, expand=expand)
+        return set_count_headers(Response(data), len(data), True)
+
+    def retrieve(self, request, pk=None, *args, **kwargs):
+        """Return the detailed representation of a recipe"""
+        pk = str(pk)
+        # ie. .../recipes/abc/, or Unicode digits int() doesn't take
+        if not (pk.isascii() and pk.isdigit()):
+            raise Http404
+
+        def render():
+            queryset = self.get_queryset().filter(pk=pk)
+            data = fast.render_queryset(queryset, detail=True)
+            return data[0] if data else None
+
+        # details are cached (recipe/caching.py), except the ones asked
+        # with list filters (ie. ?tags=1), which may hide the recipe
+        if request.query_params:
+            data = render()
+        else:
+            data = caching.get_detail(int(pk), request.user.id, render)
+        if data is None:
+            raise Http404
+        return Response(data)
+
+    # .../recipes/batch/?ids=3,1,2 returns the details of many recipes at
+    # once, instead of one .../recipes/<id>/ request per recipe
+    @action(methods=['GET'], detail=False, url_path='batch',
+            url_name='batch')
+    def batch(self, request):
+        """Return the details of the given recipes in the given order, and
+           the ids that don't exist (or belong to other users)"""
+        params = serializers.RecipeIdsParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+        ids = params.validated_data['ids']
+
+        # one query for the recipes plus one per relation
+        rows = {
+            row['id']: row for row in fast.render_queryset(
+                self.get_queryset().filter(pk__in=ids), detail=True
+            )
+        }
+        return Response({
+            'results': [rows[pk] for pk in ids if pk in rows],
+            'missing': [pk for pk in ids if pk not in rows],
+        })
+
+    # overridden function. Retries sent with the same Idempotency-Key
+    # header get the response of the first request (mainapp/idempotency.py)
+    @idempotent()
+    def create(self, request, *args, **kwargs):
+        """Create a new recipe"""
+        return super().create(request, *args, **kwargs)
+
     # overridden function
     def perform_create(self, serializer):
         """Create a new recipe process"""
         serializer.save(user=self.request.user)
 
+    # overridden function. The recipe is only marked as deleted, the
+    # reaper (a job, see mainapp/jobs.py) deletes it later
+    def perform_destroy(self, instance):
+        """Delete a recipe"""
+        soft_delete_recipes(Recipe.objects.filter(pk=instance.pk))
+
+    # .../recipes/bulk-delete/ with {"ids": [1, 2, 3]}
+    @action(methods=['POST'], detail=False, url_path='bulk-delete',
+            url_name='bulk-delete')
+    @idempotent()
+    def bulk_delete(self, request):
+        """Delete many recipes of the user at once"""
+        serializer = serializers.RecipeBulkDeleteSerializer(
+            data=request.data
+        )
+        serializer.is_valid(raise_exception=True)
+        deleted = soft_delete_recipes(self.get_queryset().filter(
+            pk__in=serializer.validated_data['ids']
+        ))
+        return Response({'deleted': deleted}, status=status.HTTP_200_OK)
+
     # created own function / helper function
     # create custom action to post image to recipe. detail means that
     # we can upload images only to created recipes(through recipe detail),
     # it will use detail URL that has ID in it.
     # Upload image is the path/name of url: .../recipes/1/upload-image
-    @action(methods=["POST"], detail=True, url_path='upload-image')
+    @action(methods=["POST"], detail=True, url_path='upload-image',
+            throttle_scope='uploads')
+    @idempotent()
     def upload_image(self, request, pk=None):  # pk(aka id) passed through url
         """Upload an image to a recipe"""
         recipe = self.get_object()
@@ -180,3 +340,169 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+    # .../recipes/export/?type=ndjson  or  .../recipes/export/?type=csv
+    # detail=False, because it exports all recipes instead of a single one
+    @action(methods=['GET'], detail=False, url_path='export')
+    def export(self, request):
+        """Export all recipes of the user with names of tags, ingredients"""
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in exports.EXPORT_TYPES:
+            choices = ', '.join(exports.EXPORT_TYPES)
+            return Response(
+                {'type': [f'Choose one of: {choices}']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        queryset = self.filter_queryset(self.get_queryset())
+        return exports.export_response(queryset, export_type)
+
+    # .../recipes/import/?offset=0 with NDJSON lines as the request body.
+    # 'import' is a Python keyword, that's why the function has another name
+    @action(methods=['POST'], detail=False, url_path='import',
+            url_name='import')
+    @idempotent(body=False)  # the body is a stream, see below
+    def import_recipes(self, request):
+        """Import recipes of the user from NDJSON lines"""
+        params = serializers.RecipeImportParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+
+        # the body is read line by line instead of loading it at once
+        stream = request.stream
+        lines = iter(stream.readline, b'') if stream is not None else []
+        importer = imports.RecipeImporter(
+            request.user, offset=params.validated_data['offset']
+        )
+        return Response(importer.run(lines), status=status.HTTP_200_OK)
+
+    # .../recipes/stats/ (the same filters as the list can be used)
+    @action(methods=['GET'], detail=False, url_path='stats')
+    def stats(self, request):
+        """Return count, min/max/avg and histograms of price and time"""
+        params = serializers.RecipeStatsParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+        return Response(recipe_stats(
+            self.filter_queryset(self.get_queryset()),
+            **params.validated_data
+        ))
+
+    # .../recipes/1/similar/?limit=10
+    @action(methods=['GET'], detail=True, url_path='similar')
+    def similar(self, request, pk=None):
+        """Return the recipes with the most similar ingredients"""
+        recipe = self.get_object()
+        params = serializers.RecipeSimilarParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+
+        scored = similarity.similar_recipes(
+            recipe, params.validated_data['limit']
+        )
+        # the index may still have recipes deleted or moved since
+        rows = {
+            row['id']: row for row in fast.render_queryset(
+                Recipe.objects.filter(
+                    pk__in=[pk for pk, _ in scored],
+                    user=request.user,
+                    deleted_at__isnull=True,
+                )
+            )
+        }
+        return Response([
+            dict(rows[recipe_id], similarity=round(score, 4))
+            for recipe_id, score in scored if recipe_id in rows
+        ])
+
+    # .../recipes/pantry/?pantry=1,2,3&missing=1 lists recipes that can be
+    # cooked with the given ingredients, missing at most 1 ingredient
+    @action(methods=['GET'], detail=False, url_path='pantry',
+            url_name='pantry')
+    def cook(self, request):
+        """Return the recipes that can be made with a pantry of ingredients,
+           the ones missing the fewest ingredients first"""
+        params = serializers.RecipePantryParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+        matches = pantry.cook_with(
+            request.user.id,
+            params.validated_data.get('pantry', set()),
+            params.validated_data['missing']
+        )
+
+        recipe_ids = sorted(matches, key=lambda pk: (matches[pk], pk))
+        missing = {pk: [] for pk in recipe_ids if matches[pk]}
+        if missing:
+            rows = Recipe.ingredients.through.objects.filter(
+                recipe_id__in=missing
+            ).exclude(
+                ingredient_id__in=params.validated_data.get('pantry', set())
+            ).order_by('ingredient_id').values_list(
+                'recipe_id', 'ingredient_id'
+            )
+            for recipe_id, ingredient_id in rows:
+                missing[recipe_id].append(ingredient_id)
+        rows = {
+            row['id']: row for row in fast.render_queryset(
+                Recipe.objects.filter(pk__in=recipe_ids)
+            )
+        }
+        return Response([
+            dict(rows[pk], missing_ingredients=missing.get(pk, []))
+            for pk in recipe_ids if pk in rows
+        ])
+
+    # .../recipes/shopping-list/?ids=1,2,3 merges ingredients of recipes
+    @action(methods=['GET'], detail=False, url_path='shopping-list',
+            url_name='shopping-list')
+    def shopping_list(self, request):
+        """Return the ingredients of the given recipes without duplicates,
+           with the number of those recipes using every ingredient"""
+        params = serializers.RecipeIdsParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+
+        # one grouped query over the through table, joined with recipes
+        # (to keep other users' recipes out) and ingredients (for names)
+        rows = Recipe.ingredients.through.objects.filter(
+            recipe_id__in=params.validated_data['ids'],
+            recipe__user=request.user,
+            recipe__deleted_at__isnull=True
+        ).values('ingredient_id', 'ingredient__name').annotate(
+            recipe_count=Count('recipe_id')
+        ).order_by('ingredient__name', 'ingredient_id')
+        return Response([
+            {
+                'id': row['ingredient_id'],
+                'name': row['ingredient__name'],
+                'recipe_count': row['recipe_count'],
+            }
+            for row in rows
+        ])
+
+
+class SyncView(ShardedViewMixin, APIView):
+    """Changes of the recipes, tags and ingredients of the user since the
+       last sync, for offline clients (see recipe/sync.py)"""
+    authentication_classes = (TokenAuthentication, )
+    permission_classes = (IsAuthenticated, )
+
+    def get(self, request):
+        """Return the rows changed and deleted since ?since=<cursor> (the
+           cursor of the previous sync), everything without it"""
+        params = serializers.RecipeSyncParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+        since = params.validated_data.get('since')
+        if since is not None and sync.cursor_expired(since):
+            return Response(
+                {'since': ['The cursor expired, sync again without it.']},
+                status=status.HTTP_410_GONE
+            )
+        return Response(sync.changes(request.user, since))
@@ -5,6 +5,7 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 # Test client to make test requests to our API and check the response
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 # status codes that contains response in readable form
 
 CREATE_USER_URL = reverse("user:create")
@@ -203,3 +204,21 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_delete_user(self):
+        """Test deleting the account marks the user as deleted"""
+        token = Token.objects.create(user=self.user)
+
+        response = self.client.delete(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.deleted_at)
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(
+            client.get(ME_URL).status_code, status.HTTP_401_UNAUTHORIZED
+        )
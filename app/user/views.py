@@ -7,6 +7,7 @@ from rest_framework.authtoken.views import ObtainAuthToken
 # username/email and password
 from rest_framework.settings import api_settings
 
+from mainapp.deletion import soft_delete_user
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 
@@ -30,7 +31,7 @@ class CreateTokenView(ObtainAuthToken):
 
 # 'authentication' is a mechanism by which authentication happens,
 # it can be through cookie(CookieAuthentication), token(TokenAuthentication)..
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage the authenticated user(modefying user's email, and etc.)"""
     serializer_class = UserSerializer
     authentication_classes = (authentication.TokenAuthentication,)
@@ -46,3 +47,10 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
         # request will have 'user' attached to it because
         # authentication_classes take care of authentication of user and
         # assignning it(user) to request.
+
+    # DELETE .../me/ only marks the user as deleted (the user can't log in
+    # anymore), the user and all of its data are deleted later in chunks
+    # by a job (or python manage.py reap_deleted)
+    def perform_destroy(self, instance):
+        """Delete the authenticated user"""
+        soft_delete_user(instance)
@@ -0,0 +1,3 @@
+-- the shards of DB_SHARDS (see app/settings.py), next to the default
+-- database on the same server
+CREATE DATABASE shard1;